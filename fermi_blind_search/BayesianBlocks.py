@@ -13,111 +13,234 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import json
 import logging
-import sys
+import os
 
 import numpy as np
 import numexpr
 
+try:
+
+    import numba
+
+except ImportError:
+
+    has_numba = False
+
+else:
+
+    has_numba = True
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("bayesian_blocks")
 
-__all__ = ['bayesian_blocks', 'bayesian_blocks_not_unique']
+__all__ = ['bayesian_blocks', 'bayesian_blocks_not_unique', 'bayesian_blocks_binned', 'bayesian_blocks_batch',
+           'bayesian_blocks_approximate', 'IncrementalBlocks', 'blocks_from_edges', 'BlocksWorkspace',
+           'get_workspace', 'set_backend', 'set_backend_from_config', 'get_backend']
 
+# Solvers available for the dynamic programming step. 'reference' is the original
+# O(N^2) loop, 'pelt' is the exact pruned version (see _find_last_pelt), which gives
+# the same blocks but discards change points which can never be optimal again
+SOLVERS = ('pelt', 'reference')
 
-def bayesian_blocks_not_unique(tt, ttstart, ttstop, p0):
 
-    # Verify that the input array is one-dimensional
-    tt = np.asarray(tt, dtype=float)
+def _check_solver(solver):
 
-    assert tt.ndim == 1
+    if solver not in SOLVERS:
 
-    # Now create the array of unique times
+        raise ValueError("Unknown solver %s. Available solvers: %s" % (solver, ", ".join(SOLVERS)))
 
-    unique_t = np.unique(tt)
 
-    t = tt
-    tstart = ttstart
-    tstop = ttstop
+# The fitness function of a block with N_k events and length T_k (see Scargle et al. 2012)
+_FITNESS_EXPRESSION = '''N_k * log(N_k/ T_k) '''
 
-    # Create initial cell edges (Voronoi tessellation) using the unique time stamps
 
-    edges = np.concatenate([[tstart],
-                            0.5 * (unique_t[1:] + unique_t[:-1]),
-                            [tstop]])
+class BlocksWorkspace(object):
+    """
+    Buffers used by the dynamic programming loop of the Bayesian Blocks.
 
-    # The last block length is 0 by definition
-    block_length = tstop - edges
+    The buffers are allocated once with enough capacity for the largest problem seen so far,
+    and then reused for all the steps of the loop and for all the following calls, so that
+    the loop does not allocate memory at each step. One workspace is kept for each process
+    (see get_workspace), so all the ROIs analyzed by the same worker share it.
 
-    if np.sum((block_length <= 0)) > 1:
+    The workspace also keeps the compiled fitness function, so that numexpr does not have to
+    parse the expression at each step.
 
-        raise RuntimeError("Events appears to be out of order! Check for order, or duplicated events.")
+    After each call the attribute bytes_allocated contains the number of bytes allocated for
+    new buffers during that call, which is zero once the workspace is large enough.
+    """
 
-    N = unique_t.shape[0]
+    def __init__(self, capacity=0):
 
-    # arrays to store the best configuration
-    best = np.zeros(N, dtype=float)
-    last = np.zeros(N, dtype=int)
+        self._buffers = {}
 
-    # Pre-computed priors (for speed)
-    # eq. 21 from Scargle 2012
+        # Bytes allocated during the last call, and since the creation of the workspace
+        self.bytes_allocated = 0
+        self.total_bytes_allocated = 0
 
-    priors = 4 - np.log(73.53 * p0 * np.power(np.arange(1, N + 1), -0.478))
+        self._fitness = numexpr.NumExpr(_FITNESS_EXPRESSION,
+                                        signature=[('N_k', np.float64), ('T_k', np.float64)],
+                                        optimization='aggressive')
 
-    # Count how many events are in each Voronoi cell
+        self.reserve(capacity)
 
-    x, _ = np.histogram(t, edges)
+    def reserve(self, capacity):
+        """
+        Make sure that the one-dimensional buffers can hold a problem with the given number of cells
+        """
 
-    # Speed tricks: resolve once for all the functions which will be used
-    # in the loop
-    cumsum = np.cumsum
-    log = np.log
-    argmax = np.argmax
-    numexpr_evaluate = numexpr.evaluate
-    arange = np.arange
+        for name, dtype in [('best', float), ('last', int), ('cum_x', float), ('T_k', float),
+                            ('N_k', float), ('fit_vec', float), ('A_R', float), ('candidates', int),
+                            ('new_candidates', int), ('rate_min', float), ('rate_max', float),
+                            ('candidates_block_length', float), ('candidates_cum_x', float),
+                            ('candidates_best_prev', float), ('new_rate_min', float), ('new_rate_max', float),
+                            ('min_d', float), ('keep', bool), ('keep_rate', bool)]:
 
-    # Decide the step for reporting progress
-    incr = max(int(float(N) / 100.0 * 10), 1)
+            self._get(name, capacity + 1, dtype)
 
-    logger.debug("Finding blocks...")
+    def start_call(self):
 
-    # This is where the computation happens. Following Scargle et al. 2012.
-    # This loop has been optimized for speed:
-    # * the expression for the fitness function has been rewritten to
-    #  avoid multiple log computations, and to avoid power computations
-    # * the use of scipy.weave and numexpr has been evaluated. The latter
-    #  gives a big gain (~40%) if used for the fitness function. No other
-    #  gain is obtained by using it anywhere else
+        self.bytes_allocated = 0
 
-    # Set numexpr precision to low (more than enough for us), which is
-    # faster than high
-    oldaccuracy = numexpr.set_vml_accuracy_mode('low')
-    numexpr.set_num_threads(1)
-    numexpr.set_vml_num_threads(1)
+    def _get(self, name, size, dtype=float):
+
+        buffer = self._buffers.get(name)
+
+        if buffer is None or buffer.shape[0] < size:
+
+            # Grow geometrically, so that a slowly increasing size does not cause
+            # a new allocation at each call
+            old_size = 0 if buffer is None else buffer.shape[0]
+
+            buffer = np.empty(max(size, 2 * old_size), dtype=dtype)
+
+            self._buffers[name] = buffer
+
+            self.bytes_allocated += buffer.nbytes
+            self.total_bytes_allocated += buffer.nbytes
+
+        return buffer
+
+    def buffer(self, name, shape, dtype=float):
+        """
+        Return a view of the buffer with the given name and shape. The content is undefined.
+
+        :param name: name of the buffer
+        :param shape: an integer, or a tuple for a two-dimensional buffer
+        :param dtype: type of the elements
+        :return: a numpy array
+        """
+
+        if isinstance(shape, tuple):
+
+            size = 1
+
+            for this_size in shape:
+
+                size *= this_size
+
+        else:
+
+            size = shape
+
+        return self._get(name, size, dtype)[:size].reshape(shape)
+
+    def fitness(self, N_k, T_k, out):
+        """
+        Evaluate N_k * log(N_k / T_k) in the provided output array
+        """
+
+        return self._fitness(N_k, T_k, out=out, ex_uses_vml=numexpr.use_vml)
+
+
+_workspace = None
+
+
+def get_workspace():
+    """
+    Return the workspace of this process, creating it if needed
+    """
+
+    global _workspace
+
+    if _workspace is None:
+
+        _workspace = BlocksWorkspace()
+
+    return _workspace
+
+
+def _fill_cumulative_counts(x, N, workspace):
+
+    # Cumulative number of events, so that the number of events in the block
+    # between cell i and cell R is cum_x[R + 1] - cum_x[i]
+
+    cum_x = workspace.buffer('cum_x', N + 1)
+
+    cum_x[0] = 0
+
+    if x is None:
+
+        # One event in each cell
+        cum_x[1:] = 1
+        np.cumsum(cum_x[1:], out=cum_x[1:])
+
+    else:
+
+        np.cumsum(x, out=cum_x[1:])
+
+    return cum_x
+
+
+def _find_last_reference(block_length, priors, x, workspace):
+    """
+    Original implementation of the dynamic programming step from Scargle et al. 2012. It
+    scans all the previous change points for each new cell, so it is O(N^2).
+
+    :param block_length: distance between each cell edge and the stop time (length N+1)
+    :param priors: prior for each step (length N)
+    :param x: number of events in each cell, or None if there is exactly one event in each cell
+    :param workspace: a BlocksWorkspace instance
+    :return: the array of the optimal previous change point for each cell
+    """
+
+    N = block_length.shape[0] - 1
+
+    # arrays to store the best configuration
+    best = workspace.buffer('best', N)
+    last = workspace.buffer('last', N, int)
+
+    cum_x = _fill_cumulative_counts(x, N, workspace)
+
+    # Speed tricks: resolve once for all the functions which will be used
+    # in the loop
+    argmax = np.argmax
+    subtract = np.subtract
+    fitness = workspace.fitness
+
+    T_k_buffer = workspace.buffer('T_k', N)
+    N_k_buffer = workspace.buffer('N_k', N)
+    fit_vec_buffer = workspace.buffer('fit_vec', N)
+    A_R_buffer = workspace.buffer('A_R', N)
 
     for R in range(N):
         br = block_length[R + 1]
-        T_k = block_length[:R + 1] - br
+        T_k = subtract(block_length[:R + 1], br, out=T_k_buffer[:R + 1])
 
         # N_k: number of elements in each block
-        # This expression has been simplified for the case of
-        # unbinned events (i.e., one element in each block)
-        # It was:
-        N_k = cumsum(x[:R + 1][::-1])[::-1]
-        # Now it is:
-        #N_k = arange(R + 1, 0, -1)
+        N_k = subtract(cum_x[R + 1], cum_x[:R + 1], out=N_k_buffer[:R + 1])
 
         # Evaluate fitness function
         # This is the slowest part, which I'm speeding up by using
         # numexpr. It provides a ~40% gain in execution speed.
 
-        fit_vec = numexpr_evaluate('''N_k * log(N_k/ T_k) ''',
-                                   optimization='aggressive',
-                                   local_dict={'N_k': N_k, 'T_k': T_k})
+        fit_vec = fitness(N_k, T_k, out=fit_vec_buffer[:R + 1])
 
         p = priors[R]
 
-        A_R = fit_vec - p
+        A_R = subtract(fit_vec, p, out=A_R_buffer[:R + 1])
 
         A_R[1:] += best[:R]
 
@@ -126,252 +249,1812 @@ def bayesian_blocks_not_unique(tt, ttstart, ttstop, p0):
         last[R] = i_max
         best[R] = A_R[i_max]
 
-    pass
+    return last
 
-    numexpr.set_vml_accuracy_mode(oldaccuracy)
 
-    logger.debug("Done\n")
+def _find_last_pelt(block_length, priors, x, workspace, steps_per_pass=16, known=None, state=None):
+    """
+    Pruned version of the dynamic programming step, which gives exactly the same result as
+    _find_last_reference but only evaluates the change points which can still be optimal.
+
+    The fitness of a block N * log(N / T) is, up to a constant N, the maximum over the rate
+    lambda of the Poisson log-likelihood N * (1 + log(lambda)) - lambda * T. Hence the score of
+    candidate change point i at step R is the maximum over lambda of
+
+        g_i(lambda) = best[i - 1] + N_k * (1 + log(lambda)) - lambda * T_k
+
+    When moving from R to R + 1 all the g_i change by the same amount, so if g_i is below
+    the score of another candidate for a range of lambda, it will stay below it forever in that
+    range. In particular the change point R + 1, which enters with the constant g = best[R],
+    beats candidate i outside of an interval of lambda. We keep track of the intersection of
+    these intervals, and drop the candidate for good when it becomes empty (this includes the
+    PELT condition best[i - 1] + fitness(i, R) < best[R], Killick et al. 2012, which corresponds
+    to an empty interval from the start).
+
+    The fitness of the live candidates is evaluated for steps_per_pass steps at the time with
+    one numexpr call (the fitness does not depend on the best configuration), then the steps
+    are completed sequentially with exactly the same arithmetic as in _find_last_reference.
+
+    Several sets of priors can be solved in one pass (like in _find_last_shared), sharing the
+    fitness: each set keeps its own best configuration and its own intervals, and a candidate
+    is dropped when its intervals are empty for all the sets (a candidate still alive for
+    some sets can never be optimal for the others, so it does not change their result).
+
+    :param block_length: distance between each cell edge and the stop time (length N+1)
+    :param priors: prior for each step (length N), or a 2d array with one row for each set of priors
+    :param x: number of events in each cell, or None if there is exactly one event in each cell
+    :param workspace: a BlocksWorkspace instance
+    The solution can be resumed from the first k cells already solved (see IncrementalBlocks), by
+    providing their best and last arrays in known, together with the candidates still alive after them
+    as returned in state. Without the candidates, all the first k cells enter as candidates and the
+    first pass prunes the ones which can no longer be optimal.
+
+    :param steps_per_pass: number of steps evaluated together
+    :param known: None, or a dictionary with the solution for the first k cells: 'best' and 'last' (shaped
+    like priors) and optionally 'candidates', 'rate_min' and 'rate_max'
+    :param state: None, or a dictionary where the fitness of the best configuration ending at each cell
+    ('best', shaped like priors) and the candidates still alive at the end, with the intervals of their
+    rates ('candidates', 'rate_min' and 'rate_max'), are stored
+    :return: the array of the optimal previous change point for each cell (a 2d array with one row for
+    each set of priors, if priors is 2d)
+    """
 
-    # Now find blocks
-    change_points = np.zeros(N, dtype=int)
-    i_cp = N
-    ind = N
-    while True:
-        i_cp -= 1
-        change_points[i_cp] = ind
+    N = block_length.shape[0] - 1
 
-        if ind == 0:
-            break
+    priors = np.asarray(priors, dtype=float)
+    shared = priors.ndim == 2
+    priors = np.atleast_2d(priors)
+    n_priors = priors.shape[0]
 
-        ind = last[ind - 1]
+    last = workspace.buffer('last', (n_priors, N), int)
 
-    change_points = change_points[i_cp:]
+    # best_prev[:, i] is the fitness of the best configuration ending just before cell i
+    # (i.e., best[i - 1] in the notation of the reference implementation), for each set of
+    # priors. By definition it is zero for the first cell
+    best_prev = workspace.buffer('best', (n_priors, N + 1))
+    best_prev[:, 0] = 0
 
-    finalEdges = edges[change_points]
+    cum_x = _fill_cumulative_counts(x, N, workspace)
 
-    return np.asarray(finalEdges)
+    # Candidate change points which are still alive, kept in increasing order so that
+    # argmax breaks ties exactly like in the reference implementation, with the
+    # interval of rates where they could still be optimal for each set of priors
+    candidates = workspace.buffer('candidates', N, int)
+    new_candidates = workspace.buffer('new_candidates', N, int)
+    rate_min = workspace.buffer('rate_min', (n_priors, N))
+    rate_max = workspace.buffer('rate_max', (n_priors, N))
+    new_rate_min = workspace.buffer('new_rate_min', (n_priors, N))
+    new_rate_max = workspace.buffer('new_rate_max', (n_priors, N))
+    n_candidates = 0
+    n_known = 0
 
+    if known is not None:
 
-def bayesian_blocks(tt, ttstart, ttstop, p0, bkgIntegralDistr=None, myLikelihood=None):
-    """Divide a series of events characterized by their arrival time in blocks
-    of perceptibly constant count rate. If the background integral distribution
-    is given, divide the series in blocks where the difference with respect to
-    the background is perceptibly constant.
+        n_known = known['last'].shape[-1]
 
+        last[:, :n_known] = known['last']
+        best_prev[:, 1:n_known + 1] = known['best']
 
-    Args:
-      tt (iterable): An iterable (list, numpy.array...) containing the arrival
-                     time of the events.
-                     NOTE: the input array MUST be time-ordered, and without
-                     duplicated entries. To ensure this, you may execute the
-                     following code:
+        if 'candidates' in known:
 
-                     tt_array = numpy.asarray(tt)
-                     tt_array = numpy.unique(tt_array)
-                     tt_array.sort()
+            n_candidates = known['candidates'].shape[0]
 
-                     before running the algorithm.
+            candidates[:n_candidates] = known['candidates']
+            rate_min[:, :n_candidates] = known['rate_min']
+            rate_max[:, :n_candidates] = known['rate_max']
 
-      p0 (float): The probability of finding a variations (i.e., creating a new
-                  block) when there is none. In other words, the probability of
-                  a Type I error, i.e., rejecting the null-hypothesis when is
-                  true. All found variations will have a post-trial significance
-                  larger than p0.
+        else:
 
-      bkgIntegralDistr (function, optional): the integral distribution for the
-                  background counts. It must be a function of the form f(x),
-                  which must return the integral number of counts expected from
-                  the background component between time 0 and x.
+            n_candidates = n_known
 
-    Returns:
-      numpy.array: the edges of the blocks found
+            candidates[:n_known] = range(n_known)
+            rate_min[:, :n_known] = 0.0
+            rate_max[:, :n_known] = np.inf
 
-    """
+    # Candidates entering during a pass do not exist before their step
+    not_yet = np.triu(np.ones((steps_per_pass, steps_per_pass), dtype=bool), 1)
 
-    # Verify that the input array is one-dimensional
-    tt = np.asarray(tt, dtype=float)
+    rows = np.arange(n_priors)
 
-    assert tt.ndim == 1
+    best_prev_1d = best_prev[0]
+    priors_1d = priors[0]
+    last_1d = last[0]
 
-    if (bkgIntegralDistr is not None):
-        # Transforming the inhomogeneous Poisson process into an homogeneous one with rate 1,
-        # by changing the time axis according to the background rate
-        logger.debug("Transforming the inhomogeneous Poisson process to a homogeneous one with rate 1...")
-        t = np.array(bkgIntegralDistr(tt))
-        logger.debug("done")
+    argmax = np.argmax
+    subtract = np.subtract
+    fitness = workspace.fitness
 
-        # Now compute the start and stop time in the new system
-        tstart = bkgIntegralDistr(ttstart)
-        tstop = bkgIntegralDistr(ttstop)
-    else:
-        t = tt
-        tstart = ttstart
-        tstop = ttstop
-    pass
+    for R0 in range(n_known, N, steps_per_pass):
 
-    # Create initial cell edges (Voronoi tessellation)
-    edges = np.concatenate([[tstart],
-                            0.5 * (t[1:] + t[:-1]),
-                            [tstop]])
+        R1 = min(R0 + steps_per_pass, N)
+        n_steps = R1 - R0
+        n_old = n_candidates
 
-    # Create the edges also in the original time system
-    edges_ = np.concatenate([[ttstart],
-                             0.5 * (tt[1:] + tt[:-1]),
-                             [ttstop]])
+        # Add the new candidates which will enter during this pass
+        n_candidates += n_steps
+        candidates[n_old:n_candidates] = range(R0, R1)
+        rate_min[:, n_old:n_candidates] = 0.0
+        rate_max[:, n_old:n_candidates] = np.inf
 
+        this_candidates = candidates[:n_candidates]
+        this_not_yet = not_yet[:n_steps, :n_steps]
 
-    # Create a lookup table to be able to transform back from the transformed system
-    # to the original one
-    lookupTable = {key: value for (key, value) in zip(edges, edges_)}
+        candidates_block_length = np.take(block_length, this_candidates,
+                                          out=workspace.buffer('candidates_block_length', n_candidates))
+        candidates_cum_x = np.take(cum_x, this_candidates,
+                                   out=workspace.buffer('candidates_cum_x', n_candidates))
+        this_best_prev = np.take(best_prev, this_candidates, axis=1,
+                                 out=workspace.buffer('candidates_best_prev', (n_priors, n_candidates)))
 
-    # The last block length is 0 by definition
-    block_length = tstop - edges
+        # The best configuration before the new candidates is not known yet (it is filled
+        # below, step by step). Until then their fitness is -inf, which must not become NaN
+        this_best_prev[:, n_old:] = 0.0
 
-    if np.sum((block_length <= 0)) > 1:
+        # Fitness for all the steps of this pass (rows) and all the candidates (columns)
+        shape = (n_steps, n_candidates)
 
-        raise RuntimeError("Events appears to be out of order! Check for order, or duplicated events.")
+        T_k = subtract(candidates_block_length[np.newaxis, :], block_length[R0 + 1:R1 + 1][:, np.newaxis],
+                       out=workspace.buffer('T_k', shape))
 
-    N = t.shape[0]
+        N_k = subtract(cum_x[R0 + 1:R1 + 1][:, np.newaxis], candidates_cum_x[np.newaxis, :],
+                       out=workspace.buffer('N_k', shape))
 
-    # arrays to store the best configuration
-    best = np.zeros(N, dtype=float)
-    last = np.zeros(N, dtype=int)
-    best_new = np.zeros(N, dtype=float)
-    last_new = np.zeros(N, dtype=int)
+        fit_mat = fitness(N_k, T_k, out=workspace.buffer('fit_vec', shape))
 
-    # Pre-computed priors (for speed)
+        np.copyto(fit_mat[:, n_old:], -np.inf, where=this_not_yet)
 
-    if (myLikelihood):
+        A_R_buffer = workspace.buffer('A_R', (n_priors, n_candidates))
 
-        priors = myLikelihood.getPriors(N, p0)
+        if shared:
 
-    else:
+            for j in range(n_steps):
 
-        # eq. 21 from Scargle 2012
-        #priors = 4 - np.log(73.53 * p0 * np.power(np.arange(1, N + 1), -0.478))
+                R = R0 + j
 
-        priors = [4 - np.log(73.53 * p0 * N**(-0.478))] * N
-    pass
+                # Now we know the best configuration before the candidate R
+                this_best_prev[:, n_old + j] = best_prev[:, R]
 
-    x = np.ones(N)
+                A_R = subtract(fit_mat[j], priors[:, R:R + 1], out=A_R_buffer)
 
-    # Speed tricks: resolve once for all the functions which will be used
-    # in the loop
-    cumsum = np.cumsum
-    log = np.log
-    argmax = np.argmax
-    numexpr_evaluate = numexpr.evaluate
-    arange = np.arange
+                A_R += this_best_prev
 
-    # Decide the step for reporting progress
-    incr = max(int(float(N) / 100.0 * 10), 1)
+                i_max = A_R.argmax(axis=1)
 
-    logger.debug("Finding blocks...")
+                last[:, R] = this_candidates[i_max]
+                best_prev[:, R + 1] = A_R[rows, i_max]
 
-    # This is where the computation happens. Following Scargle et al. 2012.
-    # This loop has been optimized for speed:
-    # * the expression for the fitness function has been rewritten to
-    #  avoid multiple log computations, and to avoid power computations
-    # * the use of scipy.weave and numexpr has been evaluated. The latter
-    #  gives a big gain (~40%) if used for the fitness function. No other
-    #  gain is obtained by using it anywhere else
+        else:
 
-    times = []
-    TSs = []
+            # Same as above with only one set of priors, on 1d arrays (which is faster)
+            this_best_prev_1d = this_best_prev[0]
+            A_R_buffer_1d = A_R_buffer[0]
 
-    # Set numexpr precision to low (more than enough for us), which is
-    # faster than high
-    oldaccuracy = numexpr.set_vml_accuracy_mode('low')
-    numexpr.set_num_threads(1)
-    numexpr.set_vml_num_threads(1)
+            for j in range(n_steps):
+
+                R = R0 + j
+
+                this_best_prev_1d[n_old + j] = best_prev_1d[R]
+
+                A_R = subtract(fit_mat[j], priors_1d[R], out=A_R_buffer_1d)
+
+                A_R += this_best_prev_1d
+
+                i_max = argmax(A_R)
+
+                last_1d[R] = this_candidates[i_max]
+                best_prev_1d[R + 1] = A_R[i_max]
+
+        # Pruning. For each step R of this pass, candidate i can still beat the change
+        # point R + 1 only where g_i(lambda) >= best[R]. With x = lambda / lambda_i,
+        # lambda_i = N_k / T_k, this is log(x) - x >= -1 - d, where
+        # d = (best[i - 1] + fitness(i, R) - best[R]) / N_k. We use the bounds
+        # 1 - sqrt(2 d) <= x <= 1 + d + sqrt(d^2 + 2 d), which always contain the exact solution,
+        # and a small tolerance on d, so that round-off can never remove a candidate which
+        # can actually be optimal. The rate of the blocks does not depend on the priors, while
+        # d and the bounds have one layer for each set of priors
+        best_this_pass = best_prev[:, R0 + 1:R1 + 1]
+
+        # best[R] minus the tolerance
+        threshold = workspace.buffer('threshold', (n_priors, n_steps))
+        np.abs(best_this_pass, out=threshold)
+        threshold += 1.0
+        threshold *= -1e-8
+        threshold += best_this_pass
+
+        layers = (n_priors, n_steps, n_candidates)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+
+            # Rate of the block (we reuse the memory of T_k)
+            rate = np.divide(N_k, T_k, out=T_k)
+
+            # d
+            d = np.add(fit_mat[np.newaxis, :, :], this_best_prev[:, np.newaxis, :],
+                       out=workspace.buffer('d', layers))
+            d -= threshold[:, :, np.newaxis]
+            d /= N_k
+
+            # Lower bound
+            this_rate_min = np.multiply(d, 2.0, out=workspace.buffer('rate_min_mat', layers))
+            np.sqrt(this_rate_min, out=this_rate_min)
+            np.subtract(1.0, this_rate_min, out=this_rate_min)
+            this_rate_min *= rate
+
+            # Upper bound
+            this_rate_max = np.add(d, 2.0, out=workspace.buffer('rate_max_mat', layers))
+            this_rate_max *= d
+            np.sqrt(this_rate_max, out=this_rate_max)
+            this_rate_max += d
+            this_rate_max += 1.0
+            this_rate_max *= rate
+
+            # Constraints cannot apply before the candidate enters
+            np.copyto(d[:, :, n_old:], 0.0, where=this_not_yet)
+            np.copyto(this_rate_min[:, :, n_old:], 0.0, where=this_not_yet)
+            np.copyto(this_rate_max[:, :, n_old:], np.inf, where=this_not_yet)
+
+            this_new_rate_min = np.max(this_rate_min, axis=1, out=new_rate_min[:, :n_candidates])
+            np.maximum(this_new_rate_min, rate_min[:, :n_candidates], out=this_new_rate_min)
+
+            this_new_rate_max = np.min(this_rate_max, axis=1, out=new_rate_max[:, :n_candidates])
+            np.minimum(this_new_rate_max, rate_max[:, :n_candidates], out=this_new_rate_max)
+
+            # (a negative d gives NaN above, which fails all comparisons)
+            min_d = np.min(d, axis=1, out=workspace.buffer('min_d', (n_priors, n_candidates)))
+
+            alive = np.greater_equal(min_d, 0, out=workspace.buffer('alive', (n_priors, n_candidates), bool))
+            alive &= np.less_equal(this_new_rate_min, this_new_rate_max,
+                                   out=workspace.buffer('alive_rate', (n_priors, n_candidates), bool))
+
+            keep = np.any(alive, axis=0, out=workspace.buffer('keep', n_candidates, bool))
+
+        n_candidates = np.count_nonzero(keep)
+
+        np.compress(keep, this_candidates, out=new_candidates[:n_candidates])
+        np.compress(keep, this_new_rate_min, axis=1, out=rate_min[:, :n_candidates])
+        np.compress(keep, this_new_rate_max, axis=1, out=rate_max[:, :n_candidates])
+
+        candidates, new_candidates = new_candidates, candidates
+
+    if state is not None:
+
+        state['best'] = best_prev[:, 1:].copy() if shared else best_prev_1d[1:].copy()
+        state['candidates'] = candidates[:n_candidates].copy()
+        state['rate_min'] = rate_min[:, :n_candidates].copy()
+        state['rate_max'] = rate_max[:, :n_candidates].copy()
+
+    return last if shared else last_1d
+
+
+def _find_last_shared(block_length, priors, x, workspace):
+    """
+    Dynamic programming step of _find_last_reference for several priors in one pass. The
+    fitness of the blocks does not depend on the prior, so it is computed only once for each
+    step and shared among all the priors, while each prior keeps its own best configuration.
+
+    :param block_length: distance between each cell edge and the stop time (length N+1)
+    :param priors: a 2d array with the prior for each step (one row for each set of priors)
+    :param x: number of events in each cell, or None if there is exactly one event in each cell
+    :param workspace: a BlocksWorkspace instance
+    :return: a 2d array with the optimal previous change point for each cell (one row for each set of priors)
+    """
+
+    N = block_length.shape[0] - 1
+    n_priors = priors.shape[0]
+
+    # arrays to store the best configuration for each prior
+    best = workspace.buffer('shared_best', (n_priors, N))
+    last = workspace.buffer('shared_last', (n_priors, N), int)
+
+    cum_x = _fill_cumulative_counts(x, N, workspace)
+
+    subtract = np.subtract
+    fitness = workspace.fitness
+
+    rows = np.arange(n_priors)
+
+    T_k_buffer = workspace.buffer('T_k', N)
+    N_k_buffer = workspace.buffer('N_k', N)
+    fit_vec_buffer = workspace.buffer('fit_vec', N)
 
     for R in range(N):
         br = block_length[R + 1]
-        T_k = block_length[:R + 1] - br
+        T_k = subtract(block_length[:R + 1], br, out=T_k_buffer[:R + 1])
 
         # N_k: number of elements in each block
-        # This expression has been simplified for the case of
-        # unbinned events (i.e., one element in each block)
-        # It was:
-        # N_k = cumsum(x[:R + 1][::-1])[::-1]
-        # Now it is:
-        N_k = arange(R + 1, 0, -1)
+        N_k = subtract(cum_x[R + 1], cum_x[:R + 1], out=N_k_buffer[:R + 1])
 
-        # Evaluate fitness function
-        # This is the slowest part, which I'm speeding up by using
-        # numexpr. It provides a ~40% gain in execution speed.
+        # Evaluate fitness function (once for all the priors)
+        fit_vec = fitness(N_k, T_k, out=fit_vec_buffer[:R + 1])
 
-        fit_vec = numexpr_evaluate('''N_k * log(N_k/ T_k) ''',
-                                   optimization='aggressive')
+        A_R = subtract(fit_vec, priors[:, R:R + 1], out=workspace.buffer('A_R', (n_priors, R + 1)))
 
-        p = priors[R]
+        A_R[:, 1:] += best[:, :R]
 
-        A_R = fit_vec - p
+        i_max = A_R.argmax(axis=1)
 
-        A_R[1:] += best[:R]
+        last[:, R] = i_max
+        best[:, R] = A_R[rows, i_max]
 
-        i_max = argmax(A_R)
+    return last
 
-        last[R] = i_max
-        best[R] = A_R[i_max]
 
-        # if(myLikelihood):
-        #  logger.debug("Maximum old: %i, Maximum new: %i" %(i_max,i_max_new))
-        #  logger.debug("Best old: %s, Best new: %s" %(best[R],best_new[R]))
+# Compiled version of the dynamic programming loop and of the backtracking, used by the 'numba'
+# backend (see set_backend). They perform exactly the same floating point operations as the
+# numexpr version, so the edges are identical
 
-    pass
 
-    numexpr.set_vml_accuracy_mode(oldaccuracy)
+def _reference_kernel(block_length, priors, cum_x, best, last):
 
-    # if(myLikelihood):
-    #   from operator import itemgetter
-    #   index, element = max(enumerate(TSs), key=itemgetter(1))
-    #   t1,t2 = times[index]
-    #   print("Maximum TS is %s in time interval %s-%s" %(element,t1,t2))
-    #
-    #   best = best_new
-    #   last = last_new
+    N = block_length.shape[0] - 1
 
-    # map(oneLoop,range(N))
+    for R in range(N):
 
-    logger.debug("Done\n")
+        br = block_length[R + 1]
+        p = priors[R]
 
-    # Now find blocks
-    change_points = np.zeros(N, dtype=int)
-    i_cp = N
-    ind = N
-    while True:
-        i_cp -= 1
-        change_points[i_cp] = ind
+        i_max = 0
+        a_max = 0.0
 
-        if ind == 0:
-            break
+        for i in range(R + 1):
 
-        ind = last[ind - 1]
+            T_k = block_length[i] - br
+            N_k = cum_x[R + 1] - cum_x[i]
 
-    change_points = change_points[i_cp:]
+            a = N_k * np.log(N_k / T_k) - p
 
-    edg = edges[change_points]
+            if i > 0:
 
-    # Transform the found edges back into the original time system
-    if (bkgIntegralDistr is not None):
-        finalEdges = map(lambda x: lookupTable[x], edg)
-    else:
-        finalEdges = edg
-    pass
+                a += best[i - 1]
 
-    return np.asarray(finalEdges)
+            if i == 0 or a > a_max:
+
+                i_max = i
+                a_max = a
+
+        last[R] = i_max
+        best[R] = a_max
+
+
+def _pelt_kernel(block_length, priors, cum_x, best_prev, last, candidates, rate_min, rate_max, fit):
+
+    # See _find_last_pelt for the explanation. Here the candidates are pruned after each step
+
+    N = block_length.shape[0] - 1
+
+    best_prev[0] = 0.0
+
+    n_candidates = 0
+
+    for R in range(N):
+
+        # The change point R enters
+        candidates[n_candidates] = R
+        rate_min[n_candidates] = 0.0
+        rate_max[n_candidates] = np.inf
+        n_candidates += 1
+
+        br = block_length[R + 1]
+        p = priors[R]
+
+        j_max = 0
+        a_max = 0.0
+
+        for j in range(n_candidates):
+
+            i = candidates[j]
+
+            T_k = block_length[i] - br
+            N_k = cum_x[R + 1] - cum_x[i]
+
+            fit[j] = N_k * np.log(N_k / T_k)
+
+            a = (fit[j] - p) + best_prev[i]
+
+            if j == 0 or a > a_max:
+
+                j_max = j
+                a_max = a
+
+        last[R] = candidates[j_max]
+        best_prev[R + 1] = a_max
+
+        # Pruning
+        threshold = (abs(a_max) + 1.0) * -1e-8 + a_max
+
+        n_kept = 0
+
+        for j in range(n_candidates):
+
+            i = candidates[j]
+
+            T_k = block_length[i] - br
+            N_k = cum_x[R + 1] - cum_x[i]
+
+            d = ((fit[j] + best_prev[i]) - threshold) / N_k
+
+            if not d >= 0:
+
+                continue
+
+            rate = N_k / T_k
+
+            this_rate_min = max((1.0 - np.sqrt(d * 2.0)) * rate, rate_min[j])
+            this_rate_max = min((np.sqrt((d + 2.0) * d) + d + 1.0) * rate, rate_max[j])
+
+            if this_rate_min <= this_rate_max:
+
+                candidates[n_kept] = i
+                rate_min[n_kept] = this_rate_min
+                rate_max[n_kept] = this_rate_max
+                n_kept += 1
+
+        n_candidates = n_kept
+
+
+def _change_points_kernel(last, change_points):
+
+    N = last.shape[0]
+
+    i_cp = N + 1
+    ind = N
+
+    while True:
+
+        i_cp -= 1
+        change_points[i_cp] = ind
+
+        if ind == 0:
+
+            break
+
+        ind = last[ind - 1]
+
+    return i_cp
+
+
+if has_numba:
+
+    _reference_kernel = numba.njit(nogil=True)(_reference_kernel)
+    _pelt_kernel = numba.njit(nogil=True)(_pelt_kernel)
+    _change_points_kernel = numba.njit(nogil=True)(_change_points_kernel)
+
+
+def _find_last_reference_jit(block_length, priors, x, workspace):
+
+    N = block_length.shape[0] - 1
+
+    best = workspace.buffer('best', N)
+    last = workspace.buffer('last', N, int)
+
+    cum_x = _fill_cumulative_counts(x, N, workspace)
+
+    _reference_kernel(block_length, np.asarray(priors, dtype=float), cum_x, best, last)
+
+    return last
+
+
+def _find_last_pelt_jit(block_length, priors, x, workspace):
+
+    N = block_length.shape[0] - 1
+
+    best_prev = workspace.buffer('best', N + 1)
+    last = workspace.buffer('last', N, int)
+
+    cum_x = _fill_cumulative_counts(x, N, workspace)
+
+    _pelt_kernel(block_length, np.asarray(priors, dtype=float), cum_x, best_prev, last,
+                 workspace.buffer('candidates', N, int), workspace.buffer('rate_min', N),
+                 workspace.buffer('rate_max', N), workspace.buffer('fit_vec', N))
+
+    return last
+
+
+# Implementation of the solvers for each backend
+_FIND_LAST = {'numexpr': {'pelt': _find_last_pelt,
+                          'reference': _find_last_reference},
+              'numba': {'pelt': _find_last_pelt_jit,
+                        'reference': _find_last_reference_jit}}
+
+# Backends for the dynamic programming loop. 'numexpr' is the interpreted loop, with the fitness
+# evaluated by numexpr, 'numba' compiles the whole loop (it needs numba)
+BACKENDS = ('numexpr', 'numba')
+
+# Until a backend is chosen (see set_backend_from_config), the best one available is used
+_backend = 'numba' if has_numba else 'numexpr'
+
+
+def set_backend(backend):
+    """
+    Choose the backend used for the dynamic programming loop of the Bayesian Blocks.
+
+    :param backend: 'numexpr', 'numba', or 'auto' (numba if it is installed, numexpr otherwise). If numba
+    is requested but not installed, numexpr is used instead
+    :return: the backend actually in use
+    """
+
+    global _backend
+
+    if backend not in BACKENDS + ('auto',):
+
+        raise ValueError("Unknown backend %s. Available backends: %s" % (backend, ", ".join(BACKENDS + ('auto',))))
+
+    if backend == 'auto':
+
+        backend = 'numba' if has_numba else 'numexpr'
+
+    if backend == 'numba' and not has_numba:
+
+        logger.warning("The numba backend for the Bayesian Blocks was requested, but numba is not installed. "
+                       "Falling back to numexpr.")
+
+        backend = 'numexpr'
+
+    _backend = backend
+
+    return _backend
+
+
+def get_backend():
+    """
+    Return the backend currently used for the dynamic programming loop of the Bayesian Blocks
+    """
+
+    return _backend
+
+
+def set_backend_from_config(configuration):
+    """
+    Choose the backend given in the [Hardware] section of the configuration (option bb_backend). If the
+    option is not there, use the best one available. Call it once the configuration file has been read.
+
+    :param configuration: the configuration (see configuration.get_config)
+    :return: the backend actually in use
+    """
+
+    if configuration.has_option("Hardware", "bb_backend"):
+
+        return set_backend(configuration.get("Hardware", "bb_backend"))
+
+    else:
+
+        return set_backend('auto')
+
+
+def _find_last(block_length, priors, x=None, solver='pelt', workspace=None, nthreads=1):
+
+    _check_solver(solver)
+
+    if workspace is None:
+
+        workspace = get_workspace()
+
+    workspace.start_call()
+
+    # Make room for the largest possible number of candidates
+    workspace.reserve(block_length.shape[0])
+
+    logger.debug("Finding blocks (solver: %s, backend: %s, threads: %s)..." % (solver, _backend, nthreads))
+
+    # This is where the computation happens. Following Scargle et al. 2012.
+    # This loop has been optimized for speed:
+    # * the expression for the fitness function has been rewritten to
+    #  avoid multiple log computations, and to avoid power computations
+    # * the use of scipy.weave and numexpr has been evaluated. The latter
+    #  gives a big gain (~40%) if used for the fitness function. No other
+    #  gain is obtained by using it anywhere else
+    # * all the arrays used in the loop live in the workspace, so they are
+    #  allocated only once
+
+    # Set numexpr precision to low (more than enough for us), which is
+    # faster than high
+    # With more than one thread numexpr splits the evaluation of the fitness among them
+    # (in chunks of candidate change points). The pruned solver evaluates more steps per pass,
+    # so that each thread gets enough work. The compiled kernels run in one thread, so with more
+    # threads the numexpr backend is used whatever the backend chosen
+    oldaccuracy = numexpr.set_vml_accuracy_mode('low')
+    numexpr.set_num_threads(nthreads)
+    numexpr.set_vml_num_threads(nthreads)
+
+    try:
+
+        if nthreads > 1 and solver == 'pelt':
+
+            last = _find_last_pelt(block_length, priors, x, workspace, steps_per_pass=16 * nthreads)
+
+        elif nthreads > 1:
+
+            last = _find_last_reference(block_length, priors, x, workspace)
+
+        else:
+
+            last = _FIND_LAST[_backend][solver](block_length, priors, x, workspace)
+
+    finally:
+
+        numexpr.set_vml_accuracy_mode(oldaccuracy)
+
+        if nthreads > 1:
+
+            numexpr.set_num_threads(1)
+            numexpr.set_vml_num_threads(1)
+
+    logger.debug("Done (allocated %s bytes in the workspace)\n" % workspace.bytes_allocated)
+
+    return last
+
+
+def _find_last_multi(block_length, priors, x=None, solver='pelt', workspace=None, nthreads=1):
+    """
+    Like _find_last, but for several sets of priors (one row of priors for each set).
+
+    :return: a list with the array of the optimal previous change point for each set of priors
+    """
+
+    _check_solver(solver)
+
+    if workspace is None:
+
+        workspace = get_workspace()
+
+    priors = np.asarray(priors, dtype=float)
+
+    workspace.start_call()
+
+    workspace.reserve(block_length.shape[0])
+
+    logger.debug("Finding blocks for %s priors in one pass..." % priors.shape[0])
+
+    oldaccuracy = numexpr.set_vml_accuracy_mode('low')
+    numexpr.set_num_threads(nthreads)
+    numexpr.set_vml_num_threads(nthreads)
+
+    try:
+
+        if solver == 'pelt':
+
+            # The pruned solver shares the fitness among the priors, like _find_last_shared
+            last = _find_last_pelt(block_length, priors, x, workspace, steps_per_pass=16 * nthreads)
+
+        else:
+
+            last = _find_last_shared(block_length, priors, x, workspace)
+
+    finally:
+
+        numexpr.set_vml_accuracy_mode(oldaccuracy)
+
+        if nthreads > 1:
+
+            numexpr.set_num_threads(1)
+            numexpr.set_vml_num_threads(1)
+
+    logger.debug("Done (allocated %s bytes in the workspace)\n" % workspace.bytes_allocated)
+
+    return list(last)
+
+
+def _find_change_points(last):
+
+    N = last.shape[0]
+
+    # Now find blocks (there are at most N + 1 change points, if each cell is a block)
+    change_points = np.zeros(N + 1, dtype=int)
+
+    if _backend == 'numba':
+
+        return change_points[_change_points_kernel(last, change_points):]
+
+    i_cp = N + 1
+    ind = N
+    while True:
+        i_cp -= 1
+        change_points[i_cp] = ind
+
+        if ind == 0:
+            break
+
+        ind = last[ind - 1]
+
+    change_points = change_points[i_cp:]
+
+    return change_points
+
+
+def _prepare_cells(tt, ttstart, ttstop, bkgIntegralDistr=None):
+    """
+    Compute the cells (Voronoi tessellation) for a list of unique, time-ordered events, both in the
+    original time system and in the system where the background is homogeneous with rate 1
+
+    :return: (edges in the transformed system, edges in the original system, block_length,
+              arrival times in the transformed system)
+    """
+
+    # Verify that the input array is one-dimensional
+    tt = np.asarray(tt, dtype=float)
+
+    assert tt.ndim == 1
+
+    if (bkgIntegralDistr is not None):
+        # Transforming the inhomogeneous Poisson process into an homogeneous one with rate 1,
+        # by changing the time axis according to the background rate
+        logger.debug("Transforming the inhomogeneous Poisson process to a homogeneous one with rate 1...")
+        t = np.array(bkgIntegralDistr(tt))
+        logger.debug("done")
+
+        # Now compute the start and stop time in the new system
+        tstart = bkgIntegralDistr(ttstart)
+        tstop = bkgIntegralDistr(ttstop)
+    else:
+        t = tt
+        tstart = ttstart
+        tstop = ttstop
+    pass
+
+    # Create initial cell edges (Voronoi tessellation)
+    edges = np.concatenate([[tstart],
+                            0.5 * (t[1:] + t[:-1]),
+                            [tstop]])
+
+    # Create the edges also in the original time system
+    edges_ = np.concatenate([[ttstart],
+                             0.5 * (tt[1:] + tt[:-1]),
+                             [ttstop]])
+
+    # The last block length is 0 by definition
+    block_length = tstop - edges
+
+    if np.sum((block_length <= 0)) > 1:
+
+        raise RuntimeError("Events appears to be out of order! Check for order, or duplicated events.")
+
+    return edges, edges_, block_length, t
+
+
+def bayesian_blocks_not_unique(tt, ttstart, ttstop, p0, solver='pelt', workspace=None):
+
+    # Verify that the input array is one-dimensional
+    tt = np.asarray(tt, dtype=float)
+
+    assert tt.ndim == 1
+
+    # Now create the array of unique times
+
+    unique_t = np.unique(tt)
+
+    t = tt
+    tstart = ttstart
+    tstop = ttstop
+
+    # Create initial cell edges (Voronoi tessellation) using the unique time stamps
+
+    edges = np.concatenate([[tstart],
+                            0.5 * (unique_t[1:] + unique_t[:-1]),
+                            [tstop]])
+
+    # The last block length is 0 by definition
+    block_length = tstop - edges
+
+    if np.sum((block_length <= 0)) > 1:
+
+        raise RuntimeError("Events appears to be out of order! Check for order, or duplicated events.")
+
+    N = unique_t.shape[0]
+
+    # Pre-computed priors (for speed)
+    # eq. 21 from Scargle 2012
+
+    priors = 4 - np.log(73.53 * p0 * np.power(np.arange(1, N + 1), -0.478))
+
+    # Count how many events are in each Voronoi cell
+
+    x, _ = np.histogram(t, edges)
+
+    last = _find_last(block_length, priors, x, solver=solver, workspace=workspace)
+
+    change_points = _find_change_points(last)
+
+    finalEdges = edges[change_points]
+
+    return np.asarray(finalEdges)
+
+
+def bayesian_blocks(tt, ttstart, ttstop, p0, bkgIntegralDistr=None, myLikelihood=None, solver='pelt',
+                    workspace=None, nthreads=1):
+    """Divide a series of events characterized by their arrival time in blocks
+    of perceptibly constant count rate. If the background integral distribution
+    is given, divide the series in blocks where the difference with respect to
+    the background is perceptibly constant.
+
+
+    Args:
+      tt (iterable): An iterable (list, numpy.array...) containing the arrival
+                     time of the events.
+                     NOTE: the input array MUST be time-ordered, and without
+                     duplicated entries. To ensure this, you may execute the
+                     following code:
+
+                     tt_array = numpy.asarray(tt)
+                     tt_array = numpy.unique(tt_array)
+                     tt_array.sort()
+
+                     before running the algorithm.
+
+      p0 (float): The probability of finding a variations (i.e., creating a new
+                  block) when there is none. In other words, the probability of
+                  a Type I error, i.e., rejecting the null-hypothesis when is
+                  true. All found variations will have a post-trial significance
+                  larger than p0.
+                  If a list of probabilities is given, the blocks are found for
+                  all of them in one pass, and a list of results is returned.
+
+      bkgIntegralDistr (function, optional): the integral distribution for the
+                  background counts. It must be a function of the form f(x),
+                  which must return the integral number of counts expected from
+                  the background component between time 0 and x.
+
+      solver (str, optional): the algorithm used to find the optimal partition.
+                  'pelt' (default) prunes the change points which can never be
+                  optimal again, and it is much faster for large number of
+                  events. 'reference' is the original O(N^2) loop. Both give
+                  the same blocks.
+
+      workspace (BlocksWorkspace, optional): the buffers to be used for the
+                  computation. By default the workspace of the current process
+                  is used (see get_workspace).
+
+      nthreads (int, optional): number of threads used to evaluate the fitness.
+                  Useful for very large lists of events, when there are free
+                  cores. The compiled kernels of the numba backend run in one
+                  thread, so with more than one thread the numexpr backend is
+                  used instead.
+
+    Returns:
+      numpy.array: the edges of the blocks found (or a list of them, if p0 is a list)
+
+    """
+
+    edges, edges_, block_length, _ = _prepare_cells(tt, ttstart, ttstop, bkgIntegralDistr)
+
+    N = block_length.shape[0] - 1
+
+    p0s = np.atleast_1d(p0)
+
+    # Pre-computed priors (for speed)
+
+    if (myLikelihood):
+
+        priors = [myLikelihood.getPriors(N, this_p0) for this_p0 in p0s]
+
+    else:
+
+        # eq. 21 from Scargle 2012
+        #priors = 4 - np.log(73.53 * p0 * np.power(np.arange(1, N + 1), -0.478))
+
+        priors = [[4 - np.log(73.53 * this_p0 * N**(-0.478))] * N for this_p0 in p0s]
+    pass
+
+    if np.ndim(p0) == 0:
+
+        last = _find_last(block_length, priors[0], solver=solver, workspace=workspace, nthreads=nthreads)
+
+        change_points = _find_change_points(last)
+
+        # Use the edges in the original time system
+        return edges_[change_points]
+
+    else:
+
+        lasts = _find_last_multi(block_length, priors, solver=solver, workspace=workspace, nthreads=nthreads)
+
+        return [edges_[_find_change_points(last)] for last in lasts]
+
+
+def blocks_from_edges(tt, edges, bkgIntegralDistr=None, event_padding=None):
+    """Summarize the blocks defined by the edges returned by the Bayesian Blocks.
+
+    Args:
+      tt (numpy.ndarray): the time-ordered arrival times used to find the edges
+
+      edges (numpy.ndarray): the edges of the blocks
+
+      bkgIntegralDistr (function, optional): the background integral distribution, used to compute
+                  the expected number of background events in each block. If None, the background is
+                  assumed to have rate 1.
+
+      event_padding (float, optional): if given, the interval of each block with at least 2 events is
+                  shrunk to go from the first event minus event_padding to the last event plus
+                  event_padding, before computing npred. This avoids intervals starting or ending
+                  in the middle of a gap in the data.
+
+    Returns:
+      numpy.recarray: one record for each block, with fields tstart and tstop (the interval of the block),
+                      start and stop (index of the first event in the block and of the first event after
+                      the block), nobs (number of events in the block) and npred (number of expected
+                      background events in the interval)
+
+    """
+
+    tt = np.asarray(tt, dtype=float)
+    edges = np.asarray(edges, dtype=float)
+
+    # Index of the first event at or after each edge. The events in block k
+    # are the ones from bounds[k] to bounds[k + 1] - 1
+    bounds = np.searchsorted(tt, edges, side='left')
+
+    start = bounds[:-1]
+    stop = bounds[1:]
+
+    nobs = stop - start
+
+    tstart = edges[:-1].copy()
+    tstop = edges[1:].copy()
+
+    if event_padding is not None:
+
+        idx = nobs >= 2
+
+        tstart[idx] = tt[start[idx]] - event_padding
+        tstop[idx] = tt[stop[idx] - 1] + event_padding
+
+    # Integral distribution at the beginning and at the end of all the blocks, in one call
+
+    n_blocks = tstart.shape[0]
+
+    if bkgIntegralDistr is not None:
+
+        integrals = np.asarray(bkgIntegralDistr(np.concatenate([tstart, tstop])), dtype=float)
+
+    else:
+
+        integrals = np.concatenate([tstart, tstop])
+
+    npred = integrals[n_blocks:] - integrals[:n_blocks]
+
+    return np.rec.fromarrays([tstart, tstop, start, stop, nobs, npred],
+                             names=['tstart', 'tstop', 'start', 'stop', 'nobs', 'npred'])
+
+
+def bayesian_blocks_binned(tt, ttstart, ttstop, p0, bkgIntegralDistr=None, min_bin_width=1.0, solver='pelt',
+                           workspace=None, nthreads=1):
+    """Like bayesian_blocks, but the events are first grouped in bins of a minimum width, so that the cost
+    depends on the number of bins instead of the number of events. This is much faster for lists with many
+    events.
+
+    The bins are defined in the time system where the background has rate 1 (i.e., the system
+    defined by bkgIntegralDistr), so min_bin_width is in units of expected background counts. If
+    bkgIntegralDistr is None, min_bin_width is in the same units as the arrival times.
+
+    Consecutive Voronoi cells whose events fall in the same bin are merged, so the edges of the
+    blocks are always a subset of the edges found by bayesian_blocks, and the result approaches the one
+    of bayesian_blocks when min_bin_width goes to zero.
+
+    Args:
+      tt, ttstart, ttstop, p0, bkgIntegralDistr: see bayesian_blocks
+
+      min_bin_width (float, optional): the minimum width of the bins
+
+      solver, workspace, nthreads: see bayesian_blocks
+
+    Returns:
+      numpy.ndarray: the edges of the blocks found (or a list of them, if p0 is a list)
+
+    """
+
+    edges, edges_, block_length, t = _prepare_cells(tt, ttstart, ttstop, bkgIntegralDistr)
+
+    N = t.shape[0]
+
+    assert min_bin_width > 0, "The minimum bin width must be positive"
+
+    # Index of the bin containing each event
+
+    bin_index = np.floor((t - edges[0]) / min_bin_width)
+
+    # Keep only the edges between events in different bins (plus the start and the stop)
+
+    selected = np.concatenate([[0], np.flatnonzero(np.diff(bin_index)) + 1, [N]])
+
+    # Number of events in each of the merged cells
+
+    x = np.diff(selected)
+
+    logger.debug("Binned %s events in %s cells" % (N, x.shape[0]))
+
+    # Pre-computed priors (for speed)
+    # eq. 21 from Scargle 2012, using the number of events like in bayesian_blocks
+
+    priors = [[4 - np.log(73.53 * this_p0 * N ** (-0.478))] * x.shape[0] for this_p0 in np.atleast_1d(p0)]
+
+    # Use the edges in the original time system
+    edges_ = edges_[selected]
+
+    if np.ndim(p0) == 0:
+
+        last = _find_last(block_length[selected], priors[0], x, solver=solver, workspace=workspace,
+                          nthreads=nthreads)
+
+        return edges_[_find_change_points(last)]
+
+    else:
+
+        lasts = _find_last_multi(block_length[selected], priors, x, solver=solver, workspace=workspace,
+                                 nthreads=nthreads)
+
+        return [edges_[_find_change_points(last)] for last in lasts]
+
+
+# Strategies to choose the allowed change points in bayesian_blocks_approximate
+DECIMATIONS = ('every', 'gti', 'log')
+
+
+def _partition_fitness(block_length, change_points, prior):
+
+    # Total fitness of the partition with the given change points (indexes of the
+    # Voronoi edges), for cells with one event each
+
+    T_k = block_length[change_points[:-1]] - block_length[change_points[1:]]
+    N_k = np.diff(change_points).astype(float)
+
+    return np.sum(N_k * np.log(N_k / T_k)) - prior * (change_points.shape[0] - 1)
+
+
+def _edge_displacement(edges1, edges2):
+
+    # Maximum distance between an edge in one list and the closest edge in the other list
+    # (i.e., the Hausdorff distance between the two lists)
+
+    def _max_distance(a, b):
+
+        idx = np.clip(np.searchsorted(b, a), 1, b.shape[0] - 1)
+
+        return np.max(np.minimum(np.abs(a - b[idx - 1]), np.abs(a - b[idx])))
+
+    return max(_max_distance(edges1, edges2), _max_distance(edges2, edges1))
+
+
+def bayesian_blocks_approximate(tt, ttstart, ttstop, p0, bkgIntegralDistr=None, decimation='every', k=10,
+                                gtis=None, n_lattice=1000, compare_exact=False, solver='pelt', workspace=None):
+    """Approximate version of bayesian_blocks, where the change points are allowed only at some of the
+    edges of the Voronoi cells. This reduces the number of cells to examine, trading accuracy for speed.
+
+    Args:
+      tt, ttstart, ttstop, p0, bkgIntegralDistr: see bayesian_blocks
+
+      decimation (str, optional): how to choose the allowed change points:
+                  'every': one every k events
+                  'gti': only at the boundaries of the Good Time Intervals (gtis must be provided)
+                  'log': at the edges closest to n_lattice points log-spaced in the transformed time
+                  system, with the finest spacing at the end of the interval (where the most recent data are)
+                  In all cases, if gtis are provided their boundaries are also allowed change points.
+
+      k (int, optional): decimation factor for decimation='every'
+
+      gtis (list, optional): list of (start, stop) pairs of the Good Time Intervals, in the same system
+                  of tt
+
+      n_lattice (int, optional): number of points of the lattice for decimation='log'
+
+      compare_exact (bool, optional): if True, also run the exact algorithm and report the difference
+                  (this of course takes longer than the exact algorithm alone)
+
+      solver, workspace: see bayesian_blocks
+
+    Returns:
+      tuple: the edges of the blocks found (or a list of them, if p0 is a list) and a dictionary with
+             the accuracy of the result:
+             'n_candidates': the number of allowed change points,
+             'resolution': the maximum distance between an edge of the exact solution and the closest allowed
+             change point (i.e., the largest possible edge displacement, given the allowed change points),
+             and if compare_exact is True:
+             'fitness_difference': the fitness of the exact solution minus the fitness of the approximate one
+             (always >= 0),
+             'edge_displacement': the maximum distance between an edge of one solution and the closest edge
+             of the other one.
+             If p0 is a list, the last two items are lists with one element for each p0.
+
+    """
+
+    if decimation not in DECIMATIONS:
+
+        raise ValueError("Unknown decimation %s. Available decimations: %s" % (decimation, ", ".join(DECIMATIONS)))
+
+    edges, edges_, block_length, t = _prepare_cells(tt, ttstart, ttstop, bkgIntegralDistr)
+
+    N = t.shape[0]
+
+    # Indexes of the edges which are allowed change points. The start and the stop are always there
+
+    allowed = [np.array([0, N])]
+
+    if decimation == 'every':
+
+        allowed.append(np.arange(0, N, int(k)))
+
+    elif decimation == 'log':
+
+        # Lattice with log-spaced distances from the stop time, going back to the start
+        distances = np.logspace(np.log10(block_length[-2]), np.log10(block_length[0]), int(n_lattice))
+
+        allowed.append(np.searchsorted(-block_length, -distances))
+
+    else:
+
+        assert gtis is not None, "You have to provide the GTIs for decimation='gti'"
+
+    if gtis is not None:
+
+        # Edge between the last event before and the first event after each boundary
+        boundaries = np.asarray(gtis, dtype=float).flatten()
+
+        allowed.append(np.searchsorted(tt, boundaries))
+
+    selected = np.unique(np.clip(np.concatenate(allowed), 0, N))
+
+    # Number of events in each of the merged cells
+
+    x = np.diff(selected)
+
+    p0s = np.atleast_1d(p0)
+
+    # eq. 21 from Scargle 2012, using the number of events like in bayesian_blocks
+
+    prior_values = [4 - np.log(73.53 * this_p0 * N ** (-0.478)) for this_p0 in p0s]
+
+    priors = [[prior] * x.shape[0] for prior in prior_values]
+
+    if np.ndim(p0) == 0:
+
+        lasts = [_find_last(block_length[selected], priors[0], x, solver=solver, workspace=workspace).copy()]
+
+    else:
+
+        lasts = _find_last_multi(block_length[selected], priors, x, solver=solver, workspace=workspace)
+
+    # Change points as indexes of the original Voronoi edges
+
+    change_points = [selected[_find_change_points(last)] for last in lasts]
+
+    results = [edges_[cp] for cp in change_points]
+
+    report = {'n_candidates': selected.shape[0],
+              'resolution': np.max(np.diff(edges_[selected])) / 2.0}
+
+    if compare_exact:
+
+        exact = bayesian_blocks(tt, ttstart, ttstop, list(p0s), bkgIntegralDistr, solver=solver, workspace=workspace)
+
+        exact_change_points = [np.searchsorted(edges_, these_edges) for these_edges in exact]
+
+        report['fitness_difference'] = [_partition_fitness(block_length, exact_cp, prior) -
+                                        _partition_fitness(block_length, cp, prior)
+                                        for exact_cp, cp, prior in zip(exact_change_points, change_points,
+                                                                       prior_values)]
+
+        report['edge_displacement'] = [_edge_displacement(these_exact, these_edges)
+                                       for these_exact, these_edges in zip(exact, results)]
+
+    if np.ndim(p0) == 0:
+
+        if compare_exact:
+
+            report['fitness_difference'] = report['fitness_difference'][0]
+            report['edge_displacement'] = report['edge_displacement'][0]
+
+        return results[0], report
+
+    else:
+
+        return results, report
+
+
+def _find_last_batch(block_lengths, priors, workspace):
+    """
+    Run the dynamic programming step of the reference implementation for several problems
+    in lockstep. The problems are padded to the same number of cells, and each step is
+    vectorized over the problems, so the overhead of the Python loop is paid only once
+    for the whole batch.
+
+    :param block_lengths: a list of arrays with the distance between the cell edges and the stop time
+    :param priors: the prior for each problem
+    :param workspace: a BlocksWorkspace instance
+    :return: a 2d array with the optimal previous change point for each problem (row) and cell (column)
+    """
+
+    n_problems = len(block_lengths)
+    N = max([x.shape[0] for x in block_lengths]) - 1
+
+    # Pad all problems to the same length. The padding cells continue with
+    # the same spacing as the last real cell, so that all the numbers stay
+    # finite. The results for the padding cells are never used
+    block_length = workspace.buffer('batch_block_length', (n_problems, N + 1))
+
+    for i, this_block_length in enumerate(block_lengths):
+
+        n = this_block_length.shape[0]
+
+        block_length[i, :n] = this_block_length
+        block_length[i, n:] = this_block_length[-1] - np.arange(1, N + 2 - n)
+
+    priors = np.asarray(priors, dtype=float)
+
+    best = workspace.buffer('batch_best', (n_problems, N))
+    last = np.zeros((n_problems, N), dtype=int)
+
+    # Number of events in each block (one event per cell)
+    N_k_all = np.arange(N, 0, -1, dtype=float)
+
+    rows = np.arange(n_problems)
+
+    subtract = np.subtract
+    fitness = workspace.fitness
+
+    for R in range(N):
+
+        T_k = subtract(block_length[:, :R + 1], block_length[:, R + 1:R + 2],
+                       out=workspace.buffer('T_k', (n_problems, R + 1)))
+
+        N_k = np.broadcast_to(N_k_all[N - R - 1:], T_k.shape)
+
+        fit_vec = fitness(N_k, T_k, out=workspace.buffer('fit_vec', (n_problems, R + 1)))
+
+        A_R = subtract(fit_vec, priors[:, np.newaxis], out=workspace.buffer('A_R', (n_problems, R + 1)))
+
+        A_R[:, 1:] += best[:, :R]
+
+        i_max = A_R.argmax(axis=1)
+
+        last[:, R] = i_max
+        best[:, R] = A_R[rows, i_max]
+
+    return last
+
+
+def bayesian_blocks_batch(tts, ttstarts, ttstops, p0, bkgIntegralDistrs=None, max_events=2000,
+                          max_batch_cells=2000000, workspace=None):
+    """
+    Run the Bayesian Blocks on many independent lists of events (for example many ROIs) at once.
+    The result is the same as running bayesian_blocks on each list, but lists with few events are
+    processed together in lockstep, with one vectorized step for all of them, which is much faster
+    than calling bayesian_blocks many times when the number of events in each list is small.
+
+    Lists with more than max_events events are processed one by one with bayesian_blocks.
+
+    The all-sky search (ltf) does not use it: each region is searched in a worker process, from the
+    selection of its events to its excesses, and with several null-hyp. probabilities at once, so the
+    small regions are never available together in one process (see bb_benchmark for the gain).
+
+    Args:
+      tts (list): a list of arrays of arrival times (each time-ordered and without duplicated entries,
+                  like for bayesian_blocks)
+
+      ttstarts, ttstops (list): the start and stop time for each list of events
+
+      p0 (float): the null hypothesis probability (see bayesian_blocks)
+
+      bkgIntegralDistrs (list, optional): the background integral distribution for each list of events,
+                  or None (see bayesian_blocks)
+
+      max_events (int, optional): lists with more events than this are not batched
+
+      max_batch_cells (int, optional): maximum number of lists times number of events in one batch,
+                  which limits the memory used
+
+      workspace (BlocksWorkspace, optional): the buffers to be used for the computation. By default the
+                  workspace of the current process is used (see get_workspace).
+
+    Returns:
+      list: the edges of the blocks found for each list of events
+
+    """
+
+    n_lists = len(tts)
+
+    assert len(ttstarts) == n_lists and len(ttstops) == n_lists, "You need one start and one stop time for each list"
+
+    if bkgIntegralDistrs is None:
+
+        bkgIntegralDistrs = [None] * n_lists
+
+    if workspace is None:
+
+        workspace = get_workspace()
+
+    results = [None] * n_lists
+
+    # Prepare the cells for all the small problems, and process right away the big ones
+
+    cells = {}
+
+    for i in range(n_lists):
+
+        n_events = len(tts[i])
+
+        if n_events == 0:
+
+            # Nothing to do, just one block
+            results[i] = np.array([ttstarts[i], ttstops[i]], dtype=float)
+
+        elif n_events > max_events:
+
+            results[i] = bayesian_blocks(tts[i], ttstarts[i], ttstops[i], p0, bkgIntegralDistrs[i],
+                                         workspace=workspace)
+
+        else:
+
+            cells[i] = _prepare_cells(tts[i], ttstarts[i], ttstops[i], bkgIntegralDistrs[i])
+
+    # Group the problems by size, so that the padding is small
+
+    order = sorted(cells.keys(), key=lambda i: cells[i][2].shape[0])
+
+    batches = []
+
+    for i in order:
+
+        n = cells[i][2].shape[0]
+
+        if len(batches) > 0:
+
+            this_batch = batches[-1]
+
+            n_min = cells[this_batch[0]][2].shape[0]
+
+            if n <= 1.25 * n_min + 10 and (len(this_batch) + 1) * n <= max_batch_cells:
+
+                this_batch.append(i)
+
+                continue
+
+        batches.append([i])
+
+    # Set numexpr precision to low (more than enough for us), which is
+    # faster than high
+    oldaccuracy = numexpr.set_vml_accuracy_mode('low')
+    numexpr.set_num_threads(1)
+    numexpr.set_vml_num_threads(1)
+
+    try:
+
+        for this_batch in batches:
+
+            workspace.start_call()
+
+            block_lengths = [cells[i][2] for i in this_batch]
+
+            # eq. 21 from Scargle 2012 (like in bayesian_blocks)
+            priors = [4 - np.log(73.53 * p0 * (x.shape[0] - 1) ** (-0.478)) for x in block_lengths]
+
+            last = _find_last_batch(block_lengths, priors, workspace)
+
+            for j, i in enumerate(this_batch):
+
+                N = block_lengths[j].shape[0] - 1
+
+                change_points = _find_change_points(last[j, :N])
+
+                # Use the edges in the original time system
+                results[i] = cells[i][1][change_points]
+
+            logger.debug("Processed a batch of %s problems with up to %s events (allocated %s bytes)"
+                         % (len(this_batch), max([x.shape[0] - 1 for x in block_lengths]),
+                            workspace.bytes_allocated))
+
+    finally:
+
+        numexpr.set_vml_accuracy_mode(oldaccuracy)
+
+    return results
+
+
+class IncrementalBlocks(object):
+    """
+    Bayesian Blocks on a list of events which grows with time, like the data window of the real-time
+    search.
+
+    The optimal partition of the first R cells (the arrays best and last of the dynamic programming)
+    does not depend on the events arriving later, as long as the prior stays the same. This class keeps
+    that state, so new events can be appended with extend() paying only for the new cells, and the edges
+    can be obtained at any moment with get_edges(). The state can be saved to disk with save() and
+    restored with load(). resume() does all of this for a window which is analyzed again with more events,
+    like the reruns of the real-time search (see ltf_rerun_analysis.py).
+
+    p0 can be a single value or a list, like in bayesian_blocks.
+
+    Since the prior cannot change while events are added, it is computed from p0 and from the number of
+    events expected in the window (n_events), instead of from the actual number of events N as in
+    bayesian_blocks. When the two numbers match, the result is the same as running bayesian_blocks on all
+    the events. Otherwise (eq. 21 from Scargle 2012) the result is the one of bayesian_blocks with a false
+    positive probability p0 * (N / n_events)^0.478 instead of p0, for example 2.4% larger than p0 if there
+    are 5% more events than expected. resume() rebuilds the state with the actual number of events when the
+    difference is larger than the fraction max_events_change, so that the mismatch is bounded.
+
+    The state is only valid for a fixed start of the window. When the start moves, like for a sliding
+    window, the first cell and the background integral distribution change, so nothing can be reused and
+    resume() rebuilds the state.
+
+    If the background is not constant, bkgIntegralDistr must be the integral distribution of the
+    background starting from ttstart (see bayesian_blocks). It is not saved with the state, so it must be
+    provided again to load(). resume() only reuses the events whose transformed time did not change.
+    """
+
+    def __init__(self, ttstart, p0, n_events, bkgIntegralDistr=None):
+
+        self._bkgIntegralDistr = bkgIntegralDistr
+
+        self.ttstart = float(ttstart)
+        self.p0 = float(p0) if np.ndim(p0) == 0 else [float(this_p0) for this_p0 in p0]
+        self.n_events = int(n_events)
+
+        # Optional description of the window (see resume)
+        self.description = None
+
+        # eq. 21 from Scargle 2012, with a fixed number of events (one prior for each p0)
+        self._priors = 4 - np.log(73.53 * np.atleast_1d(self.p0) * max(self.n_events, 1) ** (-0.478))
+
+        # Number of events added so far
+        self.n = 0
+
+        # Arrival times in the original and in the transformed time system
+        self._tt = np.empty(0)
+        self._t = np.empty(0)
+
+        # Start of the window in the transformed time system
+        self._t_start = self._transform(self.ttstart)[0]
+
+        # State of the dynamic programming, one column for each cell whose right edge is
+        # known (all cells but the last one) and one row for each prior
+        self._best = np.empty((self._priors.shape[0], 0))
+        self._last = np.empty((self._priors.shape[0], 0), dtype=int)
+
+        # Candidate change points still alive for the pruned solver after the last cell of the
+        # state, with the intervals of their rates (see _find_last_pelt), if known
+        self._alive = None
+
+        self._workspace = BlocksWorkspace()
+
+    def _transform(self, tt):
+
+        if self._bkgIntegralDistr is not None:
+
+            return np.array(self._bkgIntegralDistr(tt), dtype=float, ndmin=1)
+
+        else:
+
+            return np.array(tt, dtype=float, ndmin=1)
+
+    @staticmethod
+    def _grow(array, size):
+
+        # Grow geometrically (along the last axis), so that adding few events at the
+        # time does not reallocate the arrays each time
+        if array.shape[-1] >= size:
+
+            return array
+
+        new_array = np.empty(array.shape[:-1] + (max(size, 2 * array.shape[-1]),), dtype=array.dtype)
+        new_array[..., :array.shape[-1]] = array
+
+        return new_array
+
+    def _edges(self, t, start, stop_index):
+
+        # Left edge of the cells up to the right edge of cell stop_index - 1
+        # (the last edge is the middle point between events stop_index - 1 and stop_index)
+        return np.concatenate([[start], 0.5 * (t[1:stop_index + 1] + t[:stop_index])])
+
+    def _step(self, R, edges, right_edge, best, last):
+
+        # One step of the dynamic programming (see _find_last_shared), for the
+        # block ending at right_edge
+        workspace = self._workspace
+        n_priors = self._priors.shape[0]
+
+        T_k = np.subtract(right_edge, edges[:R + 1], out=workspace.buffer('T_k', R + 1))
+
+        N_k = np.subtract(R + 1, np.arange(R + 1), out=workspace.buffer('N_k', R + 1), casting='unsafe')
+
+        fit_vec = workspace.fitness(N_k, T_k, out=workspace.buffer('fit_vec', R + 1))
+
+        A_R = np.subtract(fit_vec[np.newaxis, :], self._priors[:, np.newaxis],
+                          out=workspace.buffer('A_R', (n_priors, R + 1)))
+
+        A_R[:, 1:] += best[:, :R]
+
+        i_max = A_R.argmax(axis=1)
+
+        last[:, R] = i_max
+        best[:, R] = A_R[np.arange(n_priors), i_max]
+
+    def extend(self, tt, nthreads=1):
+        """
+        Add new events. They must be time-ordered, without duplicates, and after the events already added.
+
+        The new cells are solved with the pruned solver (see _find_last_pelt), resumed from the state
+        and from the candidates it left alive.
+
+        :param tt: arrival times of the new events
+        :param nthreads: number of numexpr threads
+        """
+
+        tt = np.array(tt, dtype=float, ndmin=1)
+
+        if tt.shape[0] == 0:
+
+            return
+
+        if np.any(np.diff(tt) <= 0) or (self.n > 0 and tt[0] <= self._tt[self.n - 1]) or tt[0] < self.ttstart:
+
+            raise RuntimeError("Events appears to be out of order! Check for order, or duplicated events.")
+
+        n_old = self.n
+        n_new = n_old + tt.shape[0]
+
+        self._tt = self._grow(self._tt, n_new)
+        self._t = self._grow(self._t, n_new)
+        self._best = self._grow(self._best, n_new - 1)
+        self._last = self._grow(self._last, n_new - 1)
+
+        self._tt[n_old:n_new] = tt
+        self._t[n_old:n_new] = self._transform(tt)
+
+        self.n = n_new
+
+        # Now the right edge of the cells from n_old - 1 to n_new - 2 is known
+
+        N = n_new - 1
+        n_known = max(n_old - 1, 0)
+
+        if N == n_known:
+
+            return
+
+        edges = self._edges(self._t[:n_new], self._t_start, N)
+
+        # Only the differences of the block lengths matter, so the right edge of the last
+        # known cell can be used as the stop time
+        block_length = edges[-1] - edges
+
+        priors = np.repeat(self._priors[:, np.newaxis], N, axis=1)
+
+        # With one prior the solver works on 1d arrays (which is faster)
+        rows = 0 if priors.shape[0] == 1 else slice(None)
+
+        known = {'best': self._best[rows, :n_known], 'last': self._last[rows, :n_known]}
+
+        if self._alive is not None:
+
+            known.update(self._alive)
+
+        state = {}
+
+        workspace = self._workspace
+
+        workspace.start_call()
+        workspace.reserve(N + 1)
+
+        oldaccuracy = numexpr.set_vml_accuracy_mode('low')
+        oldthreads = numexpr.set_num_threads(nthreads)
+        numexpr.set_vml_num_threads(nthreads)
+
+        try:
+
+            last = _find_last_pelt(block_length, priors[rows], None, workspace, steps_per_pass=16 * nthreads,
+                                   known=known, state=state)
+
+        finally:
+
+            numexpr.set_vml_accuracy_mode(oldaccuracy)
+            numexpr.set_num_threads(oldthreads)
+            numexpr.set_vml_num_threads(oldthreads)
+
+        self._best[rows, :N] = state['best']
+        self._last[rows, :N] = last
+
+        self._alive = dict((name, state[name]) for name in ('candidates', 'rate_min', 'rate_max'))
+
+    def truncate(self, n):
+        """
+        Keep only the first n events (and the state for them)
+        """
+
+        # The state of the cells before the last kept event does not depend on the others, while
+        # the candidates alive after them are not known any more
+        if n < self.n:
+
+            self.n = max(int(n), 0)
+            self._alive = None
+
+    def common_prefix(self, tt):
+        """
+        Return how many events at the beginning of tt are the same as the events added so far, both in
+        the original and in the transformed time system (the background integral distribution might
+        have changed)
+        """
+
+        tt = np.array(tt, dtype=float, ndmin=1)
+
+        if self._transform(self.ttstart)[0] != self._t_start:
+
+            return 0
+
+        n = min(tt.shape[0], self.n)
+
+        same = (tt[:n] == self._tt[:n]) & (self._transform(tt[:n]) == self._t[:n])
+
+        return n if np.all(same) else int(np.argmin(same))
+
+    def get_edges(self, ttstop):
+        """
+        Return the edges of the blocks for the events added so far, in the original time system
+
+        :param ttstop: the end of the window (must be after the last event)
+        :return: an array with the edges of the blocks (or a list of them, if p0 is a list)
+        """
+
+        N = self.n
+        n_priors = self._priors.shape[0]
+
+        if N == 0:
+
+            results = [np.array([self.ttstart, ttstop], dtype=float) for _ in range(n_priors)]
+
+        elif ttstop <= self._tt[N - 1]:
+
+            raise RuntimeError("The stop time must be after the last event")
+
+        else:
+
+            # The last cell ends at the stop time. This step is not kept in the state, because
+            # the right edge of the last cell changes when new events are added
+
+            edges = self._edges(self._t[:N], self._t_start, N - 1)
+
+            best = self._workspace.buffer('best', (n_priors, N))
+            last = self._workspace.buffer('last', (n_priors, N), int)
+
+            best[:, :N - 1] = self._best[:, :N - 1]
+            last[:, :N - 1] = self._last[:, :N - 1]
+
+            oldaccuracy = numexpr.set_vml_accuracy_mode('low')
+
+            try:
+
+                self._step(N - 1, edges, self._transform(ttstop)[0], best, last)
+
+            finally:
+
+                numexpr.set_vml_accuracy_mode(oldaccuracy)
+
+            # Edges in the original time system
+            edges_ = np.concatenate([self._edges(self._tt[:N], self.ttstart, N - 1), [ttstop]])
+
+            results = [edges_[_find_change_points(this_last)] for this_last in last]
+
+        return results[0] if np.ndim(self.p0) == 0 else results
+
+    def save(self, filename):
+        """
+        Save the state to a .npz file. The file is replaced atomically, so a reader never sees
+        a partial state
+        """
+
+        temp_filename = "%s.%s.tmp" % (filename, os.getpid())
+
+        arrays = dict(ttstart=self.ttstart, p0=self.p0, n_events=self.n_events, t_start=self._t_start,
+                      description=json.dumps(self.description, sort_keys=True),
+                      tt=self._tt[:self.n], t=self._t[:self.n],
+                      best=self._best[:, :max(self.n - 1, 0)], last=self._last[:, :max(self.n - 1, 0)])
+
+        if self._alive is not None:
+
+            arrays.update(self._alive)
+
+        with open(temp_filename, "wb") as f:
+
+            np.savez(f, **arrays)
+
+        os.rename(temp_filename, filename)
+
+    @classmethod
+    def load(cls, filename, bkgIntegralDistr=None):
+        """
+        Restore a state saved with save()
+
+        :param filename: the .npz file
+        :param bkgIntegralDistr: the background integral distribution (the same used before saving)
+        :return: an IncrementalBlocks instance
+        """
+
+        data = np.load(filename)
+
+        p0 = data['p0']
+
+        instance = cls(float(data['ttstart']), float(p0) if p0.ndim == 0 else list(p0), int(data['n_events']),
+                       bkgIntegralDistr)
+
+        instance.description = json.loads(str(data['description']))
+
+        instance._t_start = float(data['t_start'])
+        instance._tt = data['tt']
+        instance._t = data['t']
+        instance._best = data['best']
+        instance._last = data['last']
+        instance.n = instance._tt.shape[0]
+
+        if 'candidates' in data.files:
+
+            instance._alive = dict((name, data[name]) for name in ('candidates', 'rate_min', 'rate_max'))
+
+        data.close()
+
+        return instance
+
+    @classmethod
+    def resume(cls, filename, tt, ttstart, p0, bkgIntegralDistr=None, description=None, max_events_change=0.0,
+               nthreads=1):
+        """
+        Return the state for all the events tt of a window, reusing the state saved in filename by a
+        previous analysis of the same window when possible, and save the new state to filename.
+
+        The saved state is reused if it has the same ttstart, p0 and description, and if the number of
+        events it was built for differs from len(tt) by at most the fraction max_events_change (see the
+        class docstring about the prior). The events at the beginning of the window which did not change
+        are kept, the others are added again. Otherwise the state is rebuilt for len(tt) events.
+
+        :param filename: the .npz file with the state (it does not need to exist)
+        :param tt: arrival times of all the events in the window
+        :param ttstart: start of the window
+        :param p0: the false positive probability (or a list of them)
+        :param bkgIntegralDistr: the background integral distribution (see the class docstring)
+        :param description: a dictionary describing the window (for example its start in MET and the region).
+        A state saved with a different description is not reused
+        :param max_events_change: maximum relative difference between the number of events of the saved
+        state and len(tt). With 0 the result is always the same as bayesian_blocks
+        :param nthreads: number of numexpr threads used for the new events
+        :return: a tuple (IncrementalBlocks instance, number of events reused from the saved state)
+        """
+
+        tt = np.array(tt, dtype=float, ndmin=1)
+
+        n_events = tt.shape[0]
+
+        instance = None
+
+        if os.path.exists(filename):
+
+            saved = cls.load(filename, bkgIntegralDistr)
+
+            # Compare the description after a round trip through JSON, like the saved one
+            same_window = (saved.ttstart == float(ttstart) and
+                           np.ndim(saved.p0) == np.ndim(p0) and
+                           np.array_equal(np.atleast_1d(saved.p0), np.atleast_1d(p0)) and
+                           saved.description == json.loads(json.dumps(description, sort_keys=True)))
+
+            if same_window and abs(n_events - saved.n_events) <= max_events_change * saved.n_events:
+
+                instance = saved
+
+            else:
+
+                logger.debug("Rebuilding the state in %s (window or prior changed)" % filename)
+
+        if instance is None:
+
+            instance = cls(ttstart, p0, n_events, bkgIntegralDistr)
+
+            instance.description = description
+
+        else:
+
+            instance.truncate(instance.common_prefix(tt))
 
+        n_reused = instance.n
 
-# To be run with a profiler
-if __name__ == "__main__":
+        logger.debug("Reusing %s of %s events from %s" % (n_reused, n_events, filename))
 
-    tt = np.random.uniform(0, 1000, int(sys.argv[1]))
-    tt.sort()
+        instance.extend(tt[n_reused:], nthreads=nthreads)
 
-    with open("sim.txt", "w+") as f:
-        for t in tt:
-            f.write("%s\n" % (t))
+        instance.save(filename)
 
-    res = bayesian_blocks(tt, 0, 1000, 1e-3, None)
-    print res
+        return instance, n_reused
@@ -23,4 +23,16 @@ def angular_distance_fast(ra1, dec1, ra2, dec2):
 
     a = np.sin(dlat/2.0)**2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon /2.0)**2
     c = 2 * np.arcsin(np.sqrt(a))
-    return np.rad2deg(c)
\ No newline at end of file
+    return np.rad2deg(c)
+
+def unit_vectors(ra, dec):
+    """
+    Return the unit vectors (as a n x 3 array) for the given R.A. and Dec. (in deg)
+    """
+
+    ra = np.deg2rad(np.atleast_1d(ra))
+    dec = np.deg2rad(np.atleast_1d(dec))
+
+    cd = np.cos(dec)
+
+    return np.vstack([np.cos(ra) * cd, np.sin(ra) * cd, np.sin(dec)]).T
@@ -0,0 +1,419 @@
+"""
+Benchmarks for the Bayesian Blocks.
+
+Each case runs one of the Bayesian Blocks functions on simulated events in a separate process,
+and measures the execution time and the peak memory. The scaling exponent of the execution time
+with the number of events is fitted for each kind of case. The results can be saved as a baseline
+and compared with later runs, to catch slowdowns (see the script ltf_benchmark_bayesian_blocks.py).
+
+A reference baseline is shipped in the data directory (BASELINE_NAME), together with the description
+of the machine where it was made. To compare with it:
+
+    ltf_benchmark_bayesian_blocks.py --reference --repeat 3
+
+The times can be compared only on a similar machine, while the scaling exponents can be compared
+anywhere (see test_bb_benchmark.py). Some cases must also be faster than others on any machine (see
+SPEEDUPS and compare_speedups).
+"""
+
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import time
+
+import numpy as np
+import numexpr
+
+from fermi_blind_search import BayesianBlocks
+from fermi_blind_search import myLogging
+from fermi_blind_search.data_files import get_data_file_path
+
+_logger = myLogging.log.getLogger("bb_benchmark")
+
+# Length of the simulated time interval
+_DURATION = 1e5
+
+DEFAULT_SIZES = (1000, 3000, 10000, 30000, 100000)
+
+FUNCTIONS = ('bayesian_blocks', 'bayesian_blocks_not_unique', 'bayesian_blocks_priors',
+             'bayesian_blocks_priors_separate', 'bayesian_blocks_batch', 'bayesian_blocks_batch_separate')
+
+# Null-hyp. probabilities of the cases with several priors: bayesian_blocks_priors finds the blocks for all
+# of them in one pass, bayesian_blocks_priors_separate runs one bayesian_blocks for each of them
+SEVERAL_P0 = (1e-1, 1e-3, 1e-6)
+
+# Number of events in each list of the batch cases, like the small ROIs in the tail of the distribution of the
+# number of events. The events are divided in lists of this size: bayesian_blocks_batch processes all of them
+# with one bayesian_blocks_batch, bayesian_blocks_batch_separate runs one bayesian_blocks for each of them
+BATCH_LIST_SIZE = 300
+
+# Pairs of functions (faster, slower, tolerance) where the first must not take more than tolerance times
+# the second for the same events (see compare_speedups). The shared pass of bayesian_blocks_priors is faster
+# than the separate passes without background or with bursty events, but on par (within ~15%) with a
+# background and flat events
+SPEEDUPS = (('bayesian_blocks_priors', 'bayesian_blocks_priors_separate', 1.2),
+            ('bayesian_blocks_batch', 'bayesian_blocks_batch_separate', 1.0))
+
+KINDS = ('flat', 'bursty')
+
+# Name of the reference baseline in the data directory
+BASELINE_NAME = "bb_benchmark_baseline.json"
+
+
+def make_events(n_events, kind, seed=0):
+    """
+    Simulate a time-ordered list of events between 0 and _DURATION.
+
+    :param n_events: number of events
+    :param kind: 'flat' (constant rate) or 'bursty' (constant rate plus a few bright flares, containing
+    10% of the events)
+    :param seed: seed for the random generator
+    :return: the arrival times
+    """
+
+    rng = np.random.RandomState(seed)
+
+    if kind == 'flat':
+
+        t = rng.uniform(0, _DURATION, n_events)
+
+    elif kind == 'bursty':
+
+        n_flares = 5
+        n_in_flares = n_events // 10
+
+        centers = rng.uniform(0.1 * _DURATION, 0.9 * _DURATION, n_flares)
+
+        t = np.concatenate([rng.uniform(0, _DURATION, n_events - n_in_flares),
+                            rng.normal(centers[rng.randint(0, n_flares, n_in_flares)], 1e-3 * _DURATION)])
+
+        t = np.clip(t, 0, _DURATION)
+
+    else:
+
+        raise ValueError("Unknown kind of events %s. Available kinds: %s" % (kind, ", ".join(KINDS)))
+
+    return np.unique(t)
+
+
+def _background_integral_distribution(x):
+
+    # A background rate oscillating between 0 and twice its average value (like
+    # a region moving in and out of the field of view)
+    x = np.asarray(x)
+
+    return x + 0.5 * _DURATION / np.pi * (1 - np.cos(np.pi * x / _DURATION * 4)) / 2.0
+
+
+def _run_case(args):
+
+    function, n_events, background, kind, p0 = args
+
+    if function.startswith('bayesian_blocks_batch'):
+
+        tts = [make_events(BATCH_LIST_SIZE, kind, seed=i) for i in range(max(1, n_events // BATCH_LIST_SIZE))]
+
+    else:
+
+        t = make_events(n_events, kind)
+
+    if function == 'bayesian_blocks_not_unique':
+
+        # Events with the same arrival time (like with a coarse time resolution)
+        t = np.round(t, -1)
+
+    bkg = _background_integral_distribution if background else None
+
+    memory_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start = time.time()
+
+    if function == 'bayesian_blocks':
+
+        BayesianBlocks.bayesian_blocks(t, 0, _DURATION, p0, bkg)
+
+    elif function == 'bayesian_blocks_priors':
+
+        BayesianBlocks.bayesian_blocks(t, 0, _DURATION, list(SEVERAL_P0), bkg)
+
+    elif function == 'bayesian_blocks_priors_separate':
+
+        for this_p0 in SEVERAL_P0:
+
+            BayesianBlocks.bayesian_blocks(t, 0, _DURATION, this_p0, bkg)
+
+    elif function == 'bayesian_blocks_batch':
+
+        BayesianBlocks.bayesian_blocks_batch(tts, [0] * len(tts), [_DURATION] * len(tts), p0, [bkg] * len(tts))
+
+    elif function == 'bayesian_blocks_batch_separate':
+
+        for t in tts:
+
+            BayesianBlocks.bayesian_blocks(t, 0, _DURATION, p0, bkg)
+
+    else:
+
+        BayesianBlocks.bayesian_blocks_not_unique(t, 0, _DURATION, p0)
+
+    elapsed = time.time() - start
+
+    # ru_maxrss is in kilobytes on Linux
+    peak_memory = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - memory_before) * 1024
+
+    return elapsed, peak_memory
+
+
+def _case_name(function, background, kind):
+
+    return "%s_%s_%s" % (function, 'background' if background else 'nobackground', kind)
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, functions=FUNCTIONS, kinds=KINDS, p0=1e-3, repeat=1):
+    """
+    Run all the benchmark cases.
+
+    :param sizes: list of number of events (for the batch cases, the total over the lists, see BATCH_LIST_SIZE)
+    :param functions: list of functions to benchmark (see FUNCTIONS)
+    :param kinds: list of kind of events (see KINDS)
+    :param p0: null-hyp. probability for the Bayesian Blocks (the cases with several priors use SEVERAL_P0)
+    :param repeat: number of times each case is run (the fastest time is kept)
+    :return: a dictionary with one item for each case (function, background and kind of events), containing
+    the lists of sizes, times (in seconds) and peak memory (in bytes), and the fitted scaling exponent
+    """
+
+    results = {}
+
+    for function in functions:
+
+        # bayesian_blocks_not_unique does not support a background
+        backgrounds = [False] if function == 'bayesian_blocks_not_unique' else [False, True]
+
+        for background in backgrounds:
+
+            for kind in kinds:
+
+                name = _case_name(function, background, kind)
+
+                times = []
+                memory = []
+
+                for n_events in sizes:
+
+                    best_time = None
+                    peak_memory = 0
+
+                    for _ in range(repeat):
+
+                        # Each case runs in a new process, so the peak memory is not
+                        # affected by the previous cases
+                        pool = multiprocessing.Pool(1)
+
+                        try:
+
+                            elapsed, this_memory = pool.apply(_run_case,
+                                                              ((function, n_events, background, kind, p0),))
+
+                        finally:
+
+                            pool.close()
+                            pool.join()
+
+                        best_time = elapsed if best_time is None else min(best_time, elapsed)
+                        peak_memory = max(peak_memory, this_memory)
+
+                    _logger.info("%s with %s events: %.3f s, %.1f MB" % (name, n_events, best_time,
+                                                                      peak_memory / 1024.0 ** 2))
+
+                    times.append(best_time)
+                    memory.append(peak_memory)
+
+                results[name] = {'sizes': list(sizes),
+                                 'times': times,
+                                 'peak_memory': memory,
+                                 'exponent': fit_scaling_exponent(sizes, times)}
+
+    return results
+
+
+def compare_speedups(results):
+    """
+    Check that the faster function of each pair in SPEEDUPS does not take more than the tolerance times the
+    other one, for each case (background and kind of events) and number of events in the results
+
+    :param results: the results from run_benchmarks
+    :return: a list of strings describing the failures (empty if there are none)
+    """
+
+    failures = []
+
+    for faster, slower, tolerance in SPEEDUPS:
+
+        for background in [False, True]:
+
+            for kind in KINDS:
+
+                faster_name = _case_name(faster, background, kind)
+                slower_name = _case_name(slower, background, kind)
+
+                if faster_name not in results or slower_name not in results:
+
+                    continue
+
+                slower_times = dict(zip(results[slower_name]['sizes'], results[slower_name]['times']))
+
+                for n_events, this_time in zip(results[faster_name]['sizes'], results[faster_name]['times']):
+
+                    if n_events in slower_times and this_time > tolerance * slower_times[n_events]:
+
+                        failures.append("%s with %s events: %.3f s, more than %s times %s (%.3f s)" %
+                                        (faster_name, n_events, this_time, tolerance, slower_name,
+                                         slower_times[n_events]))
+
+    return failures
+
+
+def fit_scaling_exponent(sizes, times):
+    """
+    Fit the times with a power law of the sizes
+
+    :return: the exponent of the power law
+    """
+
+    if len(sizes) < 2:
+
+        return float('nan')
+
+    slope, _ = np.polyfit(np.log(sizes), np.log(times), 1)
+
+    return float(slope)
+
+
+def describe_machine():
+    """
+    Return a description of this machine and of the software versions, saved with the baselines
+    """
+
+    cpu = platform.processor()
+
+    if os.path.exists("/proc/cpuinfo"):
+
+        with open("/proc/cpuinfo") as f:
+
+            for line in f:
+
+                if line.startswith("model name"):
+
+                    cpu = line.split(":", 1)[1].strip()
+
+                    break
+
+    return {'cpu': cpu,
+            'n_cpus': multiprocessing.cpu_count(),
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'numexpr': numexpr.__version__,
+            'backend': BayesianBlocks.get_backend()}
+
+
+def save_baseline(results, filename):
+    """
+    Save the results of run_benchmarks as a baseline, with the description of this machine
+    """
+
+    with open(filename, "w+") as f:
+
+        json.dump({'machine': describe_machine(), 'cases': results}, f, indent=2, sort_keys=True,
+                  separators=(',', ': '))
+
+
+def load_baseline(filename=None):
+    """
+    Load a baseline saved by save_baseline
+
+    :param filename: the baseline (default: the reference baseline BASELINE_NAME in the data directory)
+    :return: a dictionary with the description of the machine ('machine') and the results ('cases')
+    """
+
+    if filename is None:
+
+        filename = get_data_file_path(BASELINE_NAME)
+
+    with open(filename) as f:
+
+        return json.load(f)
+
+
+def compare_with_baseline(results, baseline, time_tolerance=1.5, exponent_tolerance=0.2):
+    """
+    Compare the results of run_benchmarks with a baseline
+
+    :param results: the results from run_benchmarks
+    :param baseline: the baseline (see load_baseline)
+    :param time_tolerance: a case is a regression if it is slower than this factor times the baseline. Use
+    None to compare only the scaling exponents (for example with a baseline made on a different machine)
+    :param exponent_tolerance: a case is a regression if its scaling exponent is larger than the one
+    of the baseline (over the same sizes) by more than this
+    :return: a list of strings describing the regressions (empty if there are none)
+    """
+
+    regressions = []
+
+    cases = baseline['cases']
+
+    for name in sorted(results.keys()):
+
+        if name not in cases:
+
+            continue
+
+        this = results[name]
+        reference = cases[name]
+
+        reference_times = dict(zip(reference['sizes'], reference['times']))
+
+        for n_events, this_time in zip(this['sizes'], this['times']):
+
+            if time_tolerance is not None and n_events in reference_times and \
+                    this_time > time_tolerance * reference_times[n_events]:
+
+                regressions.append("%s with %s events: %.3f s (baseline: %.3f s)" % (name, n_events, this_time,
+                                                                                   reference_times[n_events]))
+
+        # The exponents are compared over the sizes in common (the baseline can have more sizes)
+        this_times = dict(zip(this['sizes'], this['times']))
+
+        sizes = sorted([n_events for n_events in this_times if n_events in reference_times])
+
+        this_exponent = fit_scaling_exponent(sizes, [this_times[n_events] for n_events in sizes])
+        reference_exponent = fit_scaling_exponent(sizes, [reference_times[n_events] for n_events in sizes])
+
+        if this_exponent > reference_exponent + exponent_tolerance:
+
+            regressions.append("%s: scaling exponent %.2f (baseline: %.2f)" % (name, this_exponent,
+                                                                             reference_exponent))
+
+    return regressions
+
+
+def format_results(results):
+    """
+    Return a table with the results of run_benchmarks
+    """
+
+    lines = ["%-50s %10s %10s %12s" % ("case", "events", "time (s)", "memory (MB)")]
+
+    for name in sorted(results.keys()):
+
+        this = results[name]
+
+        for n_events, this_time, this_memory in zip(this['sizes'], this['times'], this['peak_memory']):
+
+            lines.append("%-50s %10s %10.3f %12.1f" % (name, n_events, this_time, this_memory / 1024.0 ** 2))
+
+        lines.append("%-50s scaling exponent: %.2f" % (name, this['exponent']))
+
+    return "\n".join(lines)
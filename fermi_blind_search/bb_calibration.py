@@ -0,0 +1,353 @@
+"""
+Calibration of the false-positive rate of the Bayesian Blocks.
+
+The prior on the number of blocks uses the constants of Scargle et al. (2013), eq. 21, which were
+derived for a constant background. Here the actual false-positive rate is measured with simulations:
+null event lists are generated from a background rate shaped like the one of ROIBackgroundEstimator
+(rate as a function of the off-axis angle from a lookup table, times the livetime fraction, with gaps
+when the region is outside of the theta cut or the spacecraft is in the SAA), and the Bayesian Blocks
+are run on them with the same background integral distribution and the same algorithm used by the
+search. A simulation is a false positive if it gives more than one block.
+
+The resulting table (false-positive rate for each null-hyp. probability p0) is stored on disk, keyed
+by the number of events and the configuration, so later runs reuse it instead of recomputing it (see
+the script ltf_calibrate_bb_prior.py).
+"""
+
+import copy
+import hashlib
+import json
+import multiprocessing
+import os
+
+import numpy as np
+import scipy.interpolate
+
+from fermi_blind_search import BayesianBlocks
+from fermi_blind_search import myLogging
+from fermi_blind_search.bkge.integral_distribution import IntegralDistribution
+from fermi_blind_search.data_files import get_data_file_path
+from fermi_blind_search.make_directory import make_dir_if_not_exist
+
+_logger = myLogging.log.getLogger("bb_calibration")
+
+# Version of the simulation. Change it when the simulation changes, so that the cached tables
+# become invalid
+_VERSION = 1
+
+DEFAULT_P0S = (1e-1, 1e-2, 1e-3, 1e-4, 1e-5, 1e-6)
+
+# Settings of the simulation:
+# duration: length of the time interval (s)
+# rate_table: name of the lookup table (in the ROIBackgroundEstimator_data directory) giving the
+#             rate as a function of the off-axis angle
+# theta_cut: maximum off-axis angle (deg) (like the theta cut of gtmktime)
+# orbit_period: orbital period (s)
+# rocking_angle: the pointing is rocked north and south of the orbital plane by this angle (deg),
+#                alternating every orbit
+# source_latitude: angle (deg) between the region and the orbital plane
+# saa_fraction: fraction of each orbit spent in the SAA (no data)
+# livetime_fraction: livetime fraction outside of the SAA
+# binsize: resolution (s) of the background integral distribution
+# binned_bb_threshold: above this number of events the binned Bayesian Blocks are used (None to
+#                      always use the unbinned ones), like in the search
+# binned_bb_min_width: minimum bin width for the binned Bayesian Blocks
+DEFAULT_SETTINGS = {'duration': 86400.0,
+                    'rate_table': 'ra0.039-dec29.138_rateForInterpolator.npz',
+                    'theta_cut': 60.0,
+                    'orbit_period': 5760.0,
+                    'rocking_angle': 50.0,
+                    'source_latitude': 30.0,
+                    'saa_fraction': 0.15,
+                    'livetime_fraction': 0.9,
+                    'binsize': 1.0,
+                    'binned_bb_threshold': None,
+                    'binned_bb_min_width': 1.0}
+
+# Timelines already computed in this process (see _get_timeline)
+_timelines = {}
+
+
+def settings_from_config(configuration, **kwargs):
+    """
+    Return the settings of the simulation matching the given configuration of the search (the theta
+    cut and the choice of the Bayesian Blocks algorithm). Keywords override the other settings.
+    """
+
+    settings = copy.deepcopy(DEFAULT_SETTINGS)
+
+    settings['theta_cut'] = float(configuration.get("Analysis", "theta_cut"))
+
+    if configuration.has_option("Analysis", "binned_bb_threshold"):
+
+        settings['binned_bb_threshold'] = int(configuration.get("Analysis", "binned_bb_threshold"))
+        settings['binned_bb_min_width'] = float(configuration.get("Analysis", "binned_bb_min_width"))
+
+    settings.update(kwargs)
+
+    return settings
+
+
+def _complete_settings(settings):
+
+    complete = copy.deepcopy(DEFAULT_SETTINGS)
+
+    if settings is not None:
+
+        unknown = set(settings.keys()) - set(DEFAULT_SETTINGS.keys())
+
+        if len(unknown) > 0:
+
+            raise ValueError("Unknown settings for the calibration: %s" % ", ".join(sorted(unknown)))
+
+        complete.update(settings)
+
+    return complete
+
+
+def _get_timeline(settings):
+
+    # The timeline (times, cumulative number of expected events and GTIs) only depends on the
+    # settings, so it is computed once per process
+
+    key = json.dumps(settings, sort_keys=True)
+
+    if key not in _timelines:
+
+        npzfile = np.load(os.path.join(get_data_file_path('ROIBackgroundEstimator_data'), settings['rate_table']))
+
+        # Like in ROIBackgroundEstimator, remove the points with infinite weight before building the spline
+        idx = np.isfinite(npzfile['weights'])
+
+        rate_interpolator = scipy.interpolate.UnivariateSpline(npzfile['theta'][idx], npzfile['rate'][idx],
+                                                               w=npzfile['weights'][idx],
+                                                               k=int(npzfile['k']), s=float(npzfile['s']))
+
+        n_bins = int(np.ceil(settings['duration'] / settings['binsize']))
+
+        edges = np.linspace(0, settings['duration'], n_bins + 1)
+
+        centers = 0.5 * (edges[1:] + edges[:-1])
+
+        # Pointing of the z-axis, which goes around the orbit rocked north and south
+        # of the orbital plane in alternate orbits
+        phase = 2 * np.pi * centers / settings['orbit_period']
+
+        rocking = np.deg2rad(settings['rocking_angle'])
+        rocking = np.where(np.floor(centers / settings['orbit_period']) % 2 == 0, rocking, -rocking)
+
+        latitude = np.deg2rad(settings['source_latitude'])
+
+        cos_theta = np.cos(phase) * np.cos(rocking) * np.cos(latitude) + np.sin(rocking) * np.sin(latitude)
+
+        theta = np.rad2deg(np.arccos(np.clip(cos_theta, -1, 1)))
+
+        in_saa = (centers % settings['orbit_period']) < settings['saa_fraction'] * settings['orbit_period']
+
+        good = (theta <= settings['theta_cut']) & ~in_saa
+
+        rate = np.where(good, np.maximum(rate_interpolator(np.minimum(theta, 80.0)), 0), 0)
+
+        npred = np.concatenate([[0.0], np.cumsum(rate * settings['livetime_fraction'] * np.diff(edges))])
+
+        # GTIs are the runs of good bins
+        changes = np.diff(np.concatenate([[0], good.astype(int), [0]]))
+
+        gtis = list(zip(edges[:-1][changes[:-1] == 1], edges[1:][changes[1:] == -1]))
+
+        _timelines[key] = (edges, npred, gtis)
+
+    return _timelines[key]
+
+
+def simulate_null_events(n_events, settings=None, seed=0):
+    """
+    Simulate a list of events from the background only.
+
+    :param n_events: expected number of events
+    :param settings: settings of the simulation (see DEFAULT_SETTINGS)
+    :param seed: seed for the random generator
+    :return: (arrival times, duration, background integral distribution, GTIs)
+    """
+
+    settings = _complete_settings(settings)
+
+    edges, npred, gtis = _get_timeline(settings)
+
+    # Normalize the background to the requested number of events
+    npred = npred / npred[-1] * n_events
+
+    rng = np.random.RandomState(seed)
+
+    # Inverse transform sampling of the background
+    t = np.sort(np.interp(rng.uniform(0, npred[-1], rng.poisson(n_events)), npred, edges))
+
+    # Like ROIBackgroundEstimator.getIntegralDistribution
+    integral_distribution = IntegralDistribution(edges, npred)
+
+    return t, settings['duration'], integral_distribution, gtis
+
+
+def _count_false_positives(args):
+
+    n_events, p0s, settings, seeds = args
+
+    counts = np.zeros(len(p0s), dtype=int)
+
+    for seed in seeds:
+
+        t, duration, integral_distribution, _ = simulate_null_events(n_events, settings, seed)
+
+        if t.shape[0] < 2:
+
+            continue
+
+        # Same choice of the algorithm as in the search
+        if settings['binned_bb_threshold'] is not None and t.shape[0] > settings['binned_bb_threshold']:
+
+            results = BayesianBlocks.bayesian_blocks_binned(t, 0.0, duration, list(p0s), integral_distribution,
+                                                            min_bin_width=settings['binned_bb_min_width'])
+
+        else:
+
+            results = BayesianBlocks.bayesian_blocks(t, 0.0, duration, list(p0s), integral_distribution)
+
+        counts += np.array([len(edges) > 2 for edges in results], dtype=int)
+
+    return counts
+
+
+def calibrate(n_events, p0s=DEFAULT_P0S, n_simulations=1000, settings=None, ncpus=1, seed=0):
+    """
+    Measure the false-positive rate of the Bayesian Blocks with simulations of the background.
+
+    :param n_events: expected number of events in each simulation
+    :param p0s: list of null-hyp. probabilities
+    :param n_simulations: number of simulations
+    :param settings: settings of the simulation (see DEFAULT_SETTINGS)
+    :param ncpus: number of processes to use
+    :param seed: the simulations use the seeds seed, seed + 1, ..., seed + n_simulations - 1 (so the
+    results do not depend on ncpus)
+    :return: the calibration table, as a dictionary
+    """
+
+    settings = _complete_settings(settings)
+
+    p0s = sorted([float(p0) for p0 in p0s], reverse=True)
+
+    # Several chunks per process, so that the processes finish at about the same time
+    n_chunks = min(n_simulations, 4 * ncpus)
+
+    chunks = np.array_split(np.arange(seed, seed + n_simulations), n_chunks)
+
+    tasks = [(n_events, p0s, settings, [int(x) for x in chunk]) for chunk in chunks]
+
+    if ncpus > 1:
+
+        pool = multiprocessing.Pool(ncpus)
+
+        try:
+
+            counts = pool.map(_count_false_positives, tasks)
+
+        finally:
+
+            pool.close()
+            pool.join()
+
+    else:
+
+        counts = list(map(_count_false_positives, tasks))
+
+    false_positives = np.sum(counts, axis=0)
+
+    return {'version': _VERSION,
+            'n_events': n_events,
+            'p0s': p0s,
+            'n_simulations': n_simulations,
+            'seed': seed,
+            'settings': settings,
+            'false_positives': [int(x) for x in false_positives],
+            'false_positive_rates': [float(x) / n_simulations for x in false_positives]}
+
+
+def calibration_key(n_events, p0s=DEFAULT_P0S, n_simulations=1000, settings=None, seed=0):
+    """
+    Return the key identifying a calibration table on disk
+    """
+
+    settings = _complete_settings(settings)
+
+    description = json.dumps({'version': _VERSION,
+                              'p0s': sorted([float(p0) for p0 in p0s], reverse=True),
+                              'n_simulations': n_simulations,
+                              'seed': seed,
+                              'settings': settings}, sort_keys=True)
+
+    return "N%s_%s" % (n_events, hashlib.md5(description.encode("utf-8")).hexdigest()[:16])
+
+
+def get_calibration(n_events, cache_dir, p0s=DEFAULT_P0S, n_simulations=1000, settings=None, ncpus=1, seed=0):
+    """
+    Like calibrate, but the table is read from cache_dir if it has been computed before with the same
+    parameters, otherwise it is computed and saved there.
+    """
+
+    filename = os.path.join(cache_dir, "bb_calibration_%s.json" % calibration_key(n_events, p0s, n_simulations,
+                                                                                   settings, seed))
+
+    if os.path.exists(filename):
+
+        _logger.info("Reading calibration for %s events from %s" % (n_events, filename))
+
+        with open(filename) as f:
+
+            return json.load(f)
+
+    _logger.info("Calibrating the false-positive rate for %s events with %s simulations..." % (n_events,
+                                                                                             n_simulations))
+
+    table = calibrate(n_events, p0s, n_simulations, settings, ncpus, seed)
+
+    make_dir_if_not_exist(cache_dir)
+
+    # Write to a temporary file first, so that an interrupted run does not leave a broken table
+    with open(filename + ".tmp", "w+") as f:
+
+        json.dump(table, f, indent=2, sort_keys=True)
+
+    os.rename(filename + ".tmp", filename)
+
+    return table
+
+
+def p0_for_false_positive_rate(table, false_positive_rate):
+    """
+    Return the largest null-hyp. probability in the calibration table with a false-positive rate not
+    larger than the given one, or None if there is none
+    """
+
+    selected = [p0 for p0, rate in zip(table['p0s'], table['false_positive_rates']) if rate <= false_positive_rate]
+
+    if len(selected) == 0:
+
+        return None
+
+    return max(selected)
+
+
+def format_table(table):
+    """
+    Return the calibration table as text
+    """
+
+    lines = ["N = %s, %s simulations" % (table['n_events'], table['n_simulations']),
+             "%12s %12s %12s" % ("p0", "FP rate", "error")]
+
+    for p0, rate in zip(table['p0s'], table['false_positive_rates']):
+
+        error = np.sqrt(max(rate * (1 - rate), 1.0 / table['n_simulations']) / table['n_simulations'])
+
+        lines.append("%12g %12.3g %12.3g" % (p0, rate, error))
+
+    return "\n".join(lines)
@@ -1,10 +1,7 @@
-import bisect
-import glob
 import sys
 
 import numpy
 import os
-import re
 import scipy.interpolate
 
 from fermi_blind_search.fits_handling.fits_interface import pyfits
@@ -12,7 +9,21 @@ from fermi_blind_search.fits_handling.fits_interface import pyfits
 import matplotlib.pyplot as plt
 
 from fermi_blind_search.bkge.angular_distance import getAngularDistance
+from fermi_blind_search.bkge.data_space import (DEFAULT_CHUNK_SIZE, DataSpace, get_roi, iterate_event_times,
+                                                rate_histogram)
+from fermi_blind_search.bkge.integral_distribution import (GTIGrid, IntegralDistribution, join_gtis,
+                                                           make_adaptive_grid)
+from fermi_blind_search.bkge.npred_cache import get_digest, make_key
+from fermi_blind_search.bkge.lookup_tables import (get_theta_lookup_file, get_rate_interpolator,
+                                                   make_theta_lookup_table)
 from fermi_blind_search.data_files import get_data_file_path
+from fermi_blind_search.fits_handling.ft2_cache import FT2Cache
+
+# Distance (s) between the points of the grid on which the rate is sampled (see ROIBackgroundEstimator._sample)
+DEFAULT_BINSIZE = 1.0
+
+# Distance (s) between the last point of the grid and the end of each GTI (see GTIGrid)
+_PADDING = 0.2
 
 
 class myFT1File(object):
@@ -34,23 +45,7 @@ class myFT1File(object):
             self.gtis['stop'] = f['GTI'].data.field("STOP")
 
             # Read the ROI
-            header = f['EVENTS'].header
-            dskeys = filter(lambda x: x.startswith("DSVAL"), header.keys())
-
-            # Get the key for the CIRCLE(ra,dec,radius) instruction
-            roikey = filter(lambda x: header[x].upper().startswith("CIRCLE"), dskeys)
-
-            if (len(roikey) == 0):
-                raise RuntimeError("Provided ft1 file does not contain a ROI definition")
-
-            # This is a string like 'CIRCLE(-234.25,+4.7,7.2)'
-            circleDef = header[roikey[0]]
-
-            # Extract RA,Dec and radius
-            self.ra, self.dec, self.rad = map(lambda x: float(x),
-                                              re.findall(
-                                                  'CIRCLE\(([-,+]?[0-9\.]+),([-,+]?[0-9\.]+),([0-9\.]+)\)',
-                                                  circleDef, re.IGNORECASE)[0])
+            self.ra, self.dec, self.rad = get_roi(f['EVENTS'].header)
 
     def inGTIs(self, time):
 
@@ -133,171 +128,27 @@ class myFT2File(object):
         return self.stop
 
 
-# class TimeDependentExposure(object):
-#
-#     def __init__(self, ft2file, ft1file, dcostheta=0.1):
-#
-#         self.ft1 = myFT1File(ft1file)
-#
-#         self.ft2 = myFT2File(ft2file)
-#
-#         # Now compute how many exposures I need to compute
-#         _changePoints = []
-#
-#         # The first changePoints is the tstart of the ft1
-#         _changePoints.append(self.ft1.tstart)
-#         raz_prev, decz_prev = self.ft2.getPointing(_changePoints[0])
-#         offaxis_prev = angularDistance.getAngularDistance(self.ft1.ra, self.ft1.dec,
-#                                                           raz_prev, decz_prev)
-#         cos_prev = math.cos(numpy.deg2rad(offaxis_prev))
-#
-#         ft2EntriesTimes = self.ft2.getStartTimes()
-#         idx = (ft2EntriesTimes >= self.ft1.tstart)
-#
-#         for t in ft2EntriesTimes[idx]:
-#
-#             # Get the cos of the off-axis angle
-#             raz, decz = self.ft2.getPointing(t)
-#             offaxis = angularDistance.getAngularDistance(self.ft1.ra, self.ft1.dec,
-#                                                          raz, decz)
-#             if (offaxis >= 70.0):
-#                 # Outside the FOV!
-#                 continue
-#
-#             cos = math.cos(numpy.deg2rad(offaxis))
-#
-#             # Get the delta cos with respect to the previous change point
-#             deltaCos = abs(cos - cos_prev)
-#
-#             if (deltaCos >= dcostheta):
-#
-#                 # Accept this as a change point
-#                 _changePoints.append(t)
-#                 cos_prev = cos
-#
-#             else:
-#
-#                 continue
-#
-#         # Filter out all changePoints not contained in GTIs
-#         changePoints = []
-#
-#         for change in _changePoints:
-#
-#             # Find start time of closest GTI
-#             idx = (self.ft1.gtis['start'] >= change)
-#
-#             if (numpy.sum(idx) == 0):
-#                 # After last GTI
-#                 continue
-#
-#             thisStart = self.ft1.gtis['start'][idx][0]
-#
-#             thisStop = self.ft1.gtis['stop'][idx][0]
-#
-#             if (thisStop >= change):
-#                 # This change points is inside a GTI, keep it
-#                 changePoints.append(change)
-#
-#         # Now add all the start and stop times of the GTIs, so that we
-#         # always finish each GTI with an exposure computation (to avoid
-#         # extrapolation madness)
-#         changePoints.extend(self.ft1.gtis['start'])
-#         changePoints.extend(self.ft1.gtis['stop'])
-#
-#         self.changePoints = numpy.unique(numpy.asarray(changePoints))
-#         self.changePoints.sort()
-#
-#         print("Found %s change points" % (self.changePoints.shape[0]))
-
-
 ######################
 ######################
 ######################
 ######################
 
-def countsInInterval(t, t1, t2):
-    # Find leftmost item greater than or equal to start[i]
-
-    firstElementInInterval = bisect.bisect_left(t, t1)
-
-    # Find rightmost value less than or equal to tstop
-
-    lastElementInInterval = bisect.bisect_right(t, t2) - 1
-
-    return firstElementInInterval, lastElementInInterval, lastElementInInterval - firstElementInInterval + 1
-
-
-def get_theta_lookup_file(ra, dec):
-
-    root_for_interpolator = "ra%.3f-dec%.3f_rateForInterpolator" % (ra, dec)
-
-    path = get_data_file_path('ROIBackgroundEstimator_data')
-
-    return os.path.join(path, '%s.npz' % root_for_interpolator)
-
-
 class ROIBackgroundEstimatorDataMaker(object):
-    def __init__(self, ft1file, ft2file):
-
-        self.ft1 = myFT1File(ft1file)
-
-        with pyfits.open(ft2file) as f:
+    def __init__(self, ft1file, ft2file, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        :param ft1file: the FT1 file of the simulated reference ROI
+        :param ft2file: the FT2 file, or a FT2Cache (see fits_handling.ft2_cache)
+        :param chunk_size: number of rows read at once from the FT1 and the FT2 files
+        """
 
-            ft2data = f['SC_DATA'].data
-
-            start = ft2data.field("START")
-            stop = ft2data.field("STOP")
-
-            # Check that Ft2 covers ft1
-
-            if (start[0] > self.ft1.tstart):
-                raise RuntimeError("Provided FT2 file does not cover FT1 interval")
-
-            # Throw away all part of the Ft2 which are useless
-            idx = (ft2data.field("START") >= self.ft1.tstart) & (ft2data.field("STOP") < self.ft1.tstop)
-            # idx = (ft2data.field("START") >= self.ft1.tstart) & (ft2data.field("STOP") < (self.ft1.tstart + 100*86400.0))
-
-            start = start[idx]
-            stop = stop[idx]
-            ra_scx = ft2data.field("RA_SCX")[idx]
-            dec_scx = ft2data.field("DEC_SCX")[idx]
-            ra_scz = ft2data.field("RA_SCZ")[idx]
-            dec_scz = ft2data.field("DEC_SCZ")[idx]
-            ft2livetime = ft2data.field("LIVETIME")[idx]
-
-            # Now make sure that the FT2 file is time-ordered
-
-            idx = numpy.argsort(start)
-
-            start = start[idx]
-            stop = stop[idx]
-            ra_scx = ra_scx[idx]
-            dec_scx = dec_scx[idx]
-            ra_scz = ra_scz[idx]
-            dec_scz = dec_scz[idx]
-            ft2livetime = ft2livetime[idx]
-
-        print("Covering time interval %s - %s" % (start.min(), start.max()))
-
-        nEntries = start.shape[0]
-
-        self.theta = numpy.zeros(nEntries, dtype=numpy.float16)
-        # self.phi = numpy.zeros(nEntries)
-        self.livetime = numpy.zeros(nEntries, dtype=numpy.float32)
-        self.counts = numpy.zeros(nEntries, dtype=numpy.int16)
+        import fitsio
 
-        t = numpy.array(self.ft1.time, copy=True)
+        header = fitsio.read_header(ft1file, 'EVENTS')
 
-        t.sort()
+        self.ra, self.dec, self.rad = get_roi(header)
 
-        idx = (t >= start[0]) & (t <= stop[-1])
-
-        t = list(t[idx])
-
-        nEvents = len(t)
-
-        sys.stdout.write("\nFound %s events within the FT2 boundaries\n" % nEvents)
+        tstart = float(header['TSTART'])
+        tstop = float(header['TSTOP'])
 
         root = ".".join(os.path.basename(ft1file).split(".")[:-1])
 
@@ -320,41 +171,52 @@ class ROIBackgroundEstimatorDataMaker(object):
             sys.stdout.write("File %s does not exists\n" % lookup_table_file)
             sys.stdout.write("Filling data space (theta,phi,counts)...\n")
 
-            sys.stdout.write("(processing %s entries)\n" % (nEntries))
-
-            self.theta = getAngularDistance(ra_scz, dec_scz, self.ft1.ra, self.ft1.dec)
-
-            # self.theta = getTheta(ra_scz, dec_scz, self.ft1.ra,self.ft1.dec)
-            self.counts = numpy.array(map(lambda (t1, t2): countsInInterval(t, t1, t2)[-1], zip(start, stop)))
-
-            self.livetime[:] = ft2livetime[:]
+            data_space = DataSpace(self.ra, self.dec, tstart, tstop, ft2file, chunk_size)
 
-            # for i in range(nEntries):
+            print("Covering time interval %s - %s (%s entries)" % (data_space.start[0], data_space.start[-1],
+                                                                   data_space.start.shape[0]))
 
-            # thetaPhi = getThetaPhi(ra_scx[i],dec_scx[i],ra_scz[i],dec_scz[i],self.ft1.ra,self.ft1.dec)
-            # self.theta[i] = thetaPhi[0]
-            # self.phi[i] = thetaPhi[1]
+            n_events = 0
+            n_outside = 0
 
-            #    i1,i2,n = countsInInterval(t,start[i],stop[i])
+            for times in iterate_event_times(ft1file, chunk_size):
 
-            #    self.counts[i] = n
-            #    self.livetime[i] = ft2livetime[i]
+                n_events += times.shape[0]
+                n_outside += data_space.add_events(times)
 
-            #    if(i > 0 and i % 1000 == 0):
-            #        sys.stdout.write("\r%.2f percent completed" % (float(i)/start.shape[0]*100.0)) 
+            sys.stdout.write("\nFound %s events within the FT2 entries (%s outside)\n" % (n_events - n_outside,
+                                                                                         n_outside))
 
-            sys.stdout.write("\r100 percent completed    \n")
-
-            if numpy.sum(self.counts) != nEvents:
-                print("ARGH")
-                import pdb;
-                pdb.set_trace()
+            self.theta = data_space.theta
+            self.counts = data_space.counts
+            self.livetime = data_space.livetime
 
             numpy.savez(lookup_table_file, theta=self.theta,
                         # phi=self.phi,
                         counts=self.counts,
                         livetime=self.livetime)
 
+    @classmethod
+    def from_data_space(cls, data_space_file):
+        """
+        Make the instance from a data space saved by reference_rois.make_reference_data_spaces, without
+        reading the FT1 and the FT2 files
+        """
+
+        maker = cls.__new__(cls)
+
+        with numpy.load(data_space_file) as npzfile:
+
+            maker.ra = float(npzfile['ra'])
+            maker.dec = float(npzfile['dec'])
+            maker.rad = float(npzfile['rad'])
+
+            maker.theta = npzfile['theta']
+            maker.counts = npzfile['counts']
+            maker.livetime = npzfile['livetime']
+
+        return maker
+
     def makeThetaHistogram(self, **kwargs):
 
         # Freedman-Diaconis rule for the bin size (why not?)
@@ -379,7 +241,7 @@ class ROIBackgroundEstimatorDataMaker(object):
         interpolate = True
         errors = True
 
-        for key, val in kwargs.iteritems():
+        for key, val in kwargs.items():
 
             if key.lower() == 'binsize':
                 binsize = val
@@ -408,34 +270,10 @@ class ROIBackgroundEstimatorDataMaker(object):
             if (key.lower() == "errors"):
                 errors = bool(val)
 
-        cosbins = numpy.linspace(numpy.cos(numpy.deg2rad(75)), 1, nTheta + 1)[::-1]
-        thetaBins = numpy.rad2deg(numpy.arccos(cosbins))
+        thetaBins, rate, rateErr = rate_histogram(self.theta, self.counts, self.livetime, nTheta)
 
         print(thetaBins)
 
-        cc = numpy.zeros(nTheta)
-        cce = numpy.zeros(nTheta)
-        livetime = numpy.zeros(nTheta)
-
-        for i, th1, th2 in zip(range(nTheta), thetaBins[:-1], thetaBins[1:]):
-            idx = (
-                ((self.theta >= th1) & (self.theta < th2))
-                # & ( (self.phi >= phimin) & (self.phi < phimax)  )
-            )
-            totC = numpy.sum(self.counts[idx])
-
-            livetime[i] = numpy.sum(self.livetime[idx])
-            cc[i] = totC
-            cce[i] = 1 + numpy.sqrt(totC + 0.75)
-
-        rate = cc / livetime
-        rateErr = cce / livetime
-
-        idx = numpy.isnan(rate)
-        rate[idx] = 0.0
-        idx = numpy.isnan(rateErr)
-        rateErr[idx] = 0.0
-
         width = thetaBins[1:] - thetaBins[:-1]
         center = (thetaBins[:-1] + thetaBins[1:]) / 2
 
@@ -458,24 +296,15 @@ class ROIBackgroundEstimatorDataMaker(object):
 
         if (interpolate):
             # Polynomial interpolation
-            # Add one point at the beginning to avoid Runge phenomenon at
-            # theta = 0
-            xi = numpy.insert(center, 0, 0.0)
-            yi = numpy.insert(rate, 0, rate[0])
-            wi = numpy.insert(rateErr, 0, rateErr[0])
-
-            # Add one point at the end for the same reason
-            xi = numpy.append(xi, 80.0)
-            yi = numpy.append(yi, 0.0)
-            wi = numpy.append(wi, wi[0])
+            xi, yi, wi, k, s = make_theta_lookup_table(thetaBins, rate, rateErr, k=k, s=s)
 
             # Save interpolator points
 
-            rate_lookup_table_file = get_theta_lookup_file(self.ft1.ra, self.ft1.dec)
+            rate_lookup_table_file = get_theta_lookup_file(self.ra, self.dec)
 
-            numpy.savez(rate_lookup_table_file, rate=yi, theta=xi, weights=1.0 / wi, k=k, s=s)
+            numpy.savez(rate_lookup_table_file, rate=yi, theta=xi, weights=wi, k=k, s=s)
 
-            self.rateInterpolator = scipy.interpolate.UnivariateSpline(xi, yi, w=1.0 / wi, k=k, s=s, check_finite=True)
+            self.rateInterpolator = scipy.interpolate.UnivariateSpline(xi, yi, w=wi, k=k, s=s, check_finite=True)
 
             xx = numpy.linspace(0, 80, 100)
             yy = self.rateInterpolator(xx)
@@ -535,9 +364,81 @@ class ROIBackgroundEstimatorDataMaker(object):
 class ROIBackgroundEstimator(object):
 
     def __init__(self, dataFt1, dataFt2):
+        """
+        :param dataFt1: the FT1 file of the ROI
+        :param dataFt2: the FT2 file, or a FT2Cache (see fits_handling.ft2_cache), which avoids reading the
+        FT2 file again for each ROI
+        """
 
         self.dataFt1 = myFT1File(dataFt1)
 
+        if isinstance(dataFt2, FT2Cache):
+
+            # The cache is already sorted by time
+
+            if dataFt2['START'][0] > self.dataFt1.tstart:
+                raise RuntimeError("Provided FT2 file does not cover FT1 interval")
+
+            # Keep only the part of the Ft2 which is useful
+
+            idx = dataFt2.get_slice(self.dataFt1.tstart - 100.0, self.dataFt1.tstop + 100.0)
+
+            start = dataFt2['START'][idx]
+            stop = dataFt2['STOP'][idx]
+
+            ra_scz = dataFt2['RA_SCZ'][idx]
+            dec_scz = dataFt2['DEC_SCZ'][idx]
+
+            ft2livetime = dataFt2['LIVETIME'][idx]
+
+        else:
+
+            start, stop, ra_scz, dec_scz, ft2livetime = self._read_ft2(dataFt2)
+
+        self.livetimeFraction = ft2livetime / (stop - start)
+
+        self.ft2_start = start
+
+        self.dataTheta = getAngularDistance(ra_scz, dec_scz, self.dataFt1.ra, self.dataFt1.dec)
+
+        # Fix the pole and antipode for which the haversine formula is unstable
+
+        idx = numpy.isnan(self.dataTheta)
+
+        self.dataTheta[idx] = 180.0
+
+        print("FT2 covering time interval %s - %s" % (start.min(), start.max()))
+
+        # Now prepare the interpolators
+
+        # Rate from the simulations (already fitted, from the archive of the lookup tables)
+
+        self.rateInterpolator = get_rate_interpolator(self.dataFt1.ra, self.dataFt1.dec)
+
+        # Theta from the data
+
+        self.dataThetaInterpolator = scipy.interpolate.InterpolatedUnivariateSpline(
+            start, self.dataTheta, k=1)
+
+        # Livetime from the data
+
+        self.dataLivetimeFractionInterpolator = scipy.interpolate.InterpolatedUnivariateSpline(
+            start, self.livetimeFraction, k=1)
+
+        # Check that all interpolations have gone fine
+
+        if numpy.sum(numpy.isnan(self.rateInterpolator.get_coeffs())) > 0:
+            raise RuntimeError("Rate interpolation failed for (R.A., Dec.) = (%s, %s)\n" % (self.dataFt1.ra,
+                                                                                           self.dataFt1.dec))
+
+        if numpy.sum(numpy.isnan(self.dataThetaInterpolator.get_coeffs())) > 0:
+            raise RuntimeError("Theta interpolation for data for %s failed!\n" % dataFt1)
+
+        if numpy.sum(numpy.isnan(self.dataLivetimeFractionInterpolator.get_coeffs())) > 0:
+            raise RuntimeError("Livetime fraction interpolation for data for %s failed!\n" % dataFt2)
+
+    def _read_ft2(self, dataFt2):
+
         with pyfits.open(dataFt2) as f:
 
             ft2data = f['SC_DATA'].data
@@ -580,200 +481,175 @@ class ROIBackgroundEstimator(object):
 
         ft2livetime = ft2livetime[idx]
 
-        self.livetimeFraction = ft2livetime / (stop - start)
+        return start, stop, ra_scz, dec_scz, ft2livetime
 
-        self.ft2_start = start
+    def _getGTIs(self, t1=None, t2=None):
 
-        self.dataTheta = getAngularDistance(ra_scz, dec_scz, self.dataFt1.ra, self.dataFt1.dec)
+        if (t1 == None or t2 == None):
 
-        # Fix the pole and antipode for which the haversine formula is unstable
+            t1 = self.dataFt1.tstart
+            t2 = self.dataFt1.tstop
 
-        idx = numpy.isnan(self.dataTheta)
+        gtis = numpy.array(list(self.dataFt1.iterateOverGTIs(t1, t2)), dtype=float).reshape(-1, 2)
 
-        self.dataTheta[idx] = 180.0
+        return gtis[:, 0], gtis[:, 1]
 
-        print("FT2 covering time interval %s - %s" % (start.min(), start.max()))
+    def _sample(self, gti_starts, gti_stops, binsize=DEFAULT_BINSIZE, max_relative_error=None):
+        """
+        Return the grid covering the given GTIs and the expected rate on it. The grid has one point every
+        binsize seconds or, if max_relative_error is given, the points are placed where the rate changes so
+        that the relative error on its integral is at most max_relative_error (see make_adaptive_grid)
+        """
 
-        lookup_table_file = get_theta_lookup_file(self.dataFt1.ra, self.dataFt1.dec)
+        # Pad the end of the GTIs so that it will never happen that we have
+        # events between the last bin and the end of the GTI where the
+        # predicted rate is 0 due to the SAA
 
-        # This is to cope with the fact that sometimes (I don't know why) the name of the
-        # file is slightly different
+        if max_relative_error is None:
 
-        if not os.path.exists(lookup_table_file):
-            # Try with a slightly different RA
+            grid = GTIGrid(gti_starts, gti_stops, binsize, padding=_PADDING)
 
-            ra = float(os.path.basename(lookup_table_file).split("-")[0].replace("ra", "")[:-2])
+            rate = self._getRate(grid.times)
 
-            other_tokens = "-".join(os.path.basename(lookup_table_file).split("-")[1:])
+        else:
 
-            search_expr = os.path.join(get_data_file_path('ROIBackgroundEstimator_data'),
-                                       'ra%s*%s' % (ra, other_tokens))
+            grid, rate = make_adaptive_grid(gti_starts, gti_stops, self.ft2_start, self.dataTheta,
+                                            self.livetimeFraction, self.rateInterpolator, self._getRate,
+                                            max_relative_error, padding=_PADDING)
 
-            files_ = glob.glob(search_expr)
+        exposure = numpy.sum(self.dataLivetimeFractionInterpolator(grid.times) * grid.widths)  # type: float
 
-            if len(files_)==0:
+        print("Exposure in %i GTIs = %.3f, duration = %.3f (%i points)" % (grid.gti_starts.shape[0], exposure,
+                                                                         numpy.sum(gti_stops - gti_starts),
+                                                                         len(grid)))
 
-                raise RuntimeError("Could not find data files for background estimation (%s)" % (search_expr))
+        return grid, rate
 
-            else:
+    def _getRate(self, times):
 
-                lookup_table_file = files_[0]
+        # Expected rate (counts/s) at the given times, evaluated all at once
 
-        if os.path.exists(lookup_table_file):
+        theta = self.dataThetaInterpolator(times)
 
-            sys.stdout.write("Reading theta histogram from %s...\n" % lookup_table_file)
+        assert numpy.alltrue(theta <= 80), "You have to cut your data with gtmktime and a theta cut of 65 at most!"
 
-            npzfile = numpy.load(lookup_table_file)
+        return self.rateInterpolator(theta) * self.dataLivetimeFractionInterpolator(times)
 
-            # Rate as function of theta
+    def getExpectedRate(self, t1=None, t2=None, binsize=DEFAULT_BINSIZE, max_relative_error=None):
+        """
+        Return the times of the grid covering the GTIs and the expected number of events in the bin of
+        each point. Each GTI is preceded and followed by a point with zero events, so that between GTIs
+        the interpolation is zero.
 
-            self.sim_theta = npzfile['theta']
-            self.sim_rate = npzfile['rate']
-            self.sim_weights = npzfile['weights']
-            self.k = npzfile['k']
-            self.s = npzfile['s']
+        :param binsize: distance between the points of the grid
+        :param max_relative_error: if given, the points are placed adaptively instead (see _sample)
+        """
 
-            del npzfile
+        gti_starts, gti_stops = self._getGTIs(t1, t2)
 
-            # Now make sure there are no infinite weight
+        if gti_starts.shape[0] == 0:
 
-            idx = numpy.isfinite(self.sim_weights)
+            return numpy.array([]), numpy.array([])
 
-            self.sim_theta = self.sim_theta[idx]
-            self.sim_weights = self.sim_weights[idx]
-            self.sim_rate = self.sim_rate[idx]
+        grid, rate = self._sample(gti_starts, gti_stops, binsize, max_relative_error)
 
-        else:
+        n_gtis = grid.gti_starts.shape[0]
 
-            raise IOError("Cannot find lookup table %s" % (lookup_table_file))
+        # Position of each point of the grid in the output, after the zero before its GTI
+        points = numpy.arange(len(grid)) + 2 * grid.gti + 1
 
-        # Now prepare the interpolators
+        times = numpy.empty(len(grid) + 2 * n_gtis)
+        lc = numpy.zeros_like(times)
 
-        # Rate from the simulations
+        times[points] = grid.times
+        times[grid.first + 2 * numpy.arange(n_gtis)] = grid.gti_starts - 1e-3
+        times[grid.last + 2 * numpy.arange(n_gtis) + 2] = grid.gti_stops
 
-        self.rateInterpolator = scipy.interpolate.UnivariateSpline(self.sim_theta, self.sim_rate,
-                                                                   w=self.sim_weights, k=self.k, s=self.s)
+        lc[points] = rate * grid.widths
 
-        # Theta from the data
+        return times, lc
 
-        self.dataThetaInterpolator = scipy.interpolate.InterpolatedUnivariateSpline(
-            start, self.dataTheta, k=1)
+    def getIntegralDistribution(self, t0, t1=None, t2=None, cache=None, cuts=None, max_relative_error=None):
+        """
+        Return the cumulative number of expected events as a function of t - t0, as a piecewise-linear
+        function (see IntegralDistribution) which is zero before the first GTI and constant after the last
+        one.
 
-        # Livetime from the data
+        :param cache: a NpredCache (see npred_cache), to reuse the integral of the GTIs already computed by
+        a previous run
+        :param cuts: a dictionary with the cuts of the analysis, used in the key of the cache
+        :param max_relative_error: if given, the rate is sampled adaptively with this maximum relative error
+        on the integral, instead of every second (see _sample)
+        """
 
-        self.dataLivetimeFractionInterpolator = scipy.interpolate.InterpolatedUnivariateSpline(
-            start, self.livetimeFraction, k=1)
+        gti_starts, gti_stops = self._getGTIs(t1, t2)
 
-        # Check that all interpolations have gone fine
-
-        if numpy.sum(numpy.isnan(self.rateInterpolator.get_coeffs())) > 0:
-            raise RuntimeError("Rate interpolation failed using %s\n" % lookup_table_file)
-
-        if numpy.sum(numpy.isnan(self.dataThetaInterpolator.get_coeffs())) > 0:
-            raise RuntimeError("Theta interpolation for data for %s failed!\n" % dataFt1)
-
-        if numpy.sum(numpy.isnan(self.dataLivetimeFractionInterpolator.get_coeffs())) > 0:
-            raise RuntimeError("Livetime fraction interpolation for data for %s failed!\n" % dataFt2)
-
-    def getExpectedRate(self, t1=None, t2=None, binsize=1.0):
-
-        if (t1 == None or t2 == None):
-
-            t1 = self.dataFt1.tstart
-            t2 = self.dataFt1.tstop
-
-        # Generate the grid iterating over the GTIs
-
-        times = []
-        lc = []
+        if gti_starts.shape[0] == 0:
 
-        for gti_t1, gti_t2 in self.dataFt1.iterateOverGTIs(t1, t2):
+            self.intDistr = IntegralDistribution([0.0], [0.0])
 
-            # Generate grid for this GTI
-            
-            # Pad the end of the GTI so that it will never happen that we have
-            # events between the last bin and the end of the GTI where the
-            # predicted rate is 0 due to the SAA
-            
-            padded_gti_t2 = gti_t2 - 0.2
-            
-            # Modify the binsize so we end always exactly at the end of the padded GTI
-            # (we wrap in a max() call so that we will always have at least 2 bins)
-            nbins = max(2, int(numpy.ceil((padded_gti_t2 - gti_t1) / binsize)))
+            return self.intDistr
 
-            this_times = numpy.linspace(gti_t1, padded_gti_t2, nbins)
+        if cache is not None:
 
-            new_binsize = this_times[1] - this_times[0]
+            knots, npred = self._getCachedIntegral(gti_starts, gti_stops, cache, cuts, max_relative_error)
 
-            #this_lc = numpy.zeros_like(this_times)
+        else:
 
-            theta = self.dataThetaInterpolator(this_times)
+            grid, rate = self._sample(gti_starts, gti_stops, max_relative_error=max_relative_error)
 
-            assert numpy.alltrue(theta <= 80), "You have to cut your data with gtmktime and a theta cut of 65 at most!"
+            # Exact integral of the rate interpolated linearly on the grid
+            knots, npred = grid.integrate(rate)
 
-            this_lc = self.rateInterpolator(theta) * self.dataLivetimeFractionInterpolator(this_times) * new_binsize
+        # Remove time offset
 
-            # for i, t in enumerate(this_times):
-            #
-            #     theta = self.dataThetaInterpolator(t)
-            #
-            #     if theta > 80:
-            #
-            #         raise RuntimeError("You have to cut your data with gtmktime and a theta cut of 65 at most!")
-            #
-            #     else:
-            #
-            #         this_lc[i] = self.rateInterpolator(theta) * self.dataLivetimeFractionInterpolator(t)
+        self.intDistr = IntegralDistribution(knots - t0, npred)
 
-            # Add a zero before the first bin of this GTI, so
-            # between GTIs the interpolation will be zero
+        return self.intDistr
 
-            times.append(gti_t1 - 1e-3)
-            lc.append(0.0)
+    def _getFT2Digest(self, gti_t1, gti_t2):
 
-            # Add these bins
+        # Digest of the spacecraft data used by the interpolators within the GTI (the
+        # entries within the GTI plus the ones just before and after it)
 
-            times.extend(this_times)
-            lc.extend(this_lc)
+        i1 = max(0, numpy.searchsorted(self.ft2_start, gti_t1, side='right') - 1)
+        i2 = numpy.searchsorted(self.ft2_start, gti_t2, side='right') + 1
 
-            # Add another zero after these bins, so
-            # between GTIs the interpolation will be zero
-                        
-            times.append(gti_t2)
-            lc.append(0.0)
+        return get_digest(self.ft2_start[i1:i2], self.dataTheta[i1:i2], self.livetimeFraction[i1:i2])
 
-            exposure = numpy.sum(self.dataLivetimeFractionInterpolator(this_times) * new_binsize)  # type: float
+    def _getCachedIntegral(self, gti_starts, gti_stops, cache, cuts, max_relative_error):
 
-            print("Exposure in GTI %.3f-%.3f = %.3f, duration = %.3f" % (gti_t1, gti_t2, exposure, gti_t2 - gti_t1))
+        key = make_key({'ra': float(self.dataFt1.ra), 'dec': float(self.dataFt1.dec),
+                        'lookup_table': get_digest(self.rateInterpolator.get_knots(),
+                                                   self.rateInterpolator.get_coeffs()),
+                        'cuts': cuts if cuts is not None else {},
+                        'binsize': DEFAULT_BINSIZE, 'padding': _PADDING, 'max_relative_error': max_relative_error})
 
-        return numpy.array(times), numpy.array(lc)
+        digests = [self._getFT2Digest(gti_t1, gti_t2) for gti_t1, gti_t2 in zip(gti_starts, gti_stops)]
 
-    def getIntegralDistribution(self, t0, t1=None, t2=None):
+        segments = cache.get(key, gti_starts, gti_stops, digests)
 
-        # Get the predicted light curve
+        missing = numpy.array([i for i, segment in enumerate(segments) if segment is None], dtype=int)
 
-        tt, lc = self.getExpectedRate(t1, t2)
-        
-        # Remove time offset
+        print("Background of %i GTIs out of %i taken from the cache" % (len(segments) - missing.shape[0],
+                                                                      len(segments)))
 
-        tt = tt - t0
+        if missing.shape[0] > 0:
 
-        # Make the integral distribution
+            # Compute only the GTIs which are not in the cache
 
-        # n_obs = self.dataFt1.getNumberOfEvents(t1, t2)
+            grid, rate = self._sample(gti_starts[missing], gti_stops[missing],
+                                      max_relative_error=max_relative_error)
 
-        int_distr_points = numpy.cumsum(lc)  # / numpy.sum(lc) * n_obs
+            new_segments = grid.integrate_gtis(rate)
 
-        # Build a linear spline interpolating the integral distribution,
-        # which is very fast to evaluate on any given x
+            for i, segment in zip(missing, new_segments):
 
-        # We use ext=3, which according to the scipy documentation means
-        # that any backward extrapolation will return the first value (0),
-        # and any forward extrapolation will return the last value (nobs)
+                segments[i] = segment
 
-        self.intDistr = scipy.interpolate.InterpolatedUnivariateSpline(tt, int_distr_points, k=1, ext=3)
+            cache.put(key, gti_starts[missing], gti_stops[missing], [digests[i] for i in missing], new_segments)
 
-        return self.intDistr
+        return join_gtis(segments)
 
 
 # def getTheta(ra_scz, dec_scz, ra, dec):
@@ -0,0 +1,264 @@
+"""
+All-sky background cube.
+
+Instead of computing the background separately for each ROI (see ROIBackgroundEstimator), the off-axis
+angle of all the grid points for all the FT2 entries is computed at once, as chunked dot products of unit
+vectors, and turned into the expected rate and the cumulative number of expected events for each grid
+point and each FT2 entry. These are saved as float32 arrays in a directory (see make_background_cube),
+which the processes memory-map (see open_background_cube). The background of a ROI is then a slice of
+these arrays.
+
+The off-axis angle and the livetime fraction are taken at the start of each FT2 entry, while
+ROIBackgroundEstimator interpolates them between the entries, so the two differ by about 1% of the expected
+events (see the background_cube option of the configuration).
+"""
+
+import hashlib
+import os
+
+import numpy
+
+from fermi_blind_search.angular_distance import unit_vectors
+from fermi_blind_search.bkge.integral_distribution import IntegralDistribution
+from fermi_blind_search.bkge.lookup_tables import get_rate_interpolator
+from fermi_blind_search.cache_directory import open_cache_directory, read_manifest, write_cache_directory
+from fermi_blind_search.fits_handling.ft2_cache import open_ft2_cache
+from fermi_blind_search.sky_index import SkyIndex
+
+# Version of the cube. Change it when the content of the cube changes, so that existing cubes
+# are rebuilt
+_VERSION = 1
+
+
+def _angles(vectors, ra, dec):
+
+    # Angle (in deg) between each of the vectors and each of the given directions,
+    # as a len(vectors) x len(ra) array
+    cos = numpy.dot(vectors, unit_vectors(ra, dec).T)
+
+    return numpy.rad2deg(numpy.arccos(numpy.clip(cos, -1, 1)))
+
+
+def make_background_cube(ras, decs, ft2_cache_dir, directory, zmax, thetamax, rad, chunk_size=1024,
+                         rate_interpolators=None):
+    """
+    Build the background cube for the given grid points, unless the directory already contains the cube for
+    the same grid, FT2 and selection.
+
+    The rate for each grid point and FT2 entry is the rate from the lookup table at the off-axis angle of
+    the grid point, times the livetime fraction of the entry. It is zero for the entries excluded by the
+    same selection used for the GTIs of the ROIs (see FT2Cache.get_gtis).
+
+    :param ras: R.A. of the grid points
+    :param decs: Dec. of the grid points
+    :param ft2_cache_dir: directory of the FT2 cache (see fits_handling.ft2_cache)
+    :param directory: directory for the cube
+    :param zmax: zenith cut (deg)
+    :param thetamax: theta cut (deg)
+    :param rad: radius of the ROIs (deg)
+    :param chunk_size: number of FT2 entries processed at once
+    :param rate_interpolators: the rate as a function of the off-axis angle for each grid point (by
+    default read from the lookup tables). If given, the cube is always rebuilt
+    :return: the cube directory
+    """
+
+    ras = numpy.asarray(ras, dtype=float)
+    decs = numpy.asarray(decs, dtype=float)
+
+    ft2 = open_ft2_cache(ft2_cache_dir)
+
+    grid_digest = hashlib.md5(numpy.vstack([ras, decs]).tobytes()).hexdigest()
+
+    description = {'version': _VERSION, 'ft2': ft2.get_source(), 'grid': grid_digest,
+                   'zmax': float(zmax), 'thetamax': float(thetamax), 'rad': float(rad)}
+
+    if rate_interpolators is None and read_manifest(directory) == description:
+
+        return directory
+
+    if rate_interpolators is None:
+
+        rate_interpolators = [get_rate_interpolator(ra, dec) for ra, dec in zip(ras, decs)]
+
+    n_points = ras.shape[0]
+    n_entries = len(ft2)
+
+    with write_cache_directory(directory, description) as tmp_directory:
+
+        numpy.save(os.path.join(tmp_directory, "ra.npy"), ras)
+        numpy.save(os.path.join(tmp_directory, "dec.npy"), decs)
+        numpy.save(os.path.join(tmp_directory, "start.npy"), numpy.asarray(ft2['START']))
+        numpy.save(os.path.join(tmp_directory, "stop.npy"), numpy.asarray(ft2['STOP']))
+
+        rate = numpy.lib.format.open_memmap(os.path.join(tmp_directory, "rate.npy"), mode='w+',
+                                            dtype=numpy.float32, shape=(n_points, n_entries))
+
+        npred = numpy.lib.format.open_memmap(os.path.join(tmp_directory, "npred.npy"), mode='w+',
+                                             dtype=numpy.float32, shape=(n_points, n_entries))
+
+        grid_vectors = unit_vectors(ras, decs)
+
+        # The cumulative sum is carried over from one chunk to the next in double precision
+        total = numpy.zeros(n_points)
+
+        for i1 in range(0, n_entries, chunk_size):
+
+            rows = slice(i1, min(i1 + chunk_size, n_entries))
+
+            start = ft2['START'][rows]
+            stop = ft2['STOP'][rows]
+            livetime = ft2['LIVETIME'][rows]
+
+            good = ft2.get_good_entries(rows)
+
+            # Off-axis angle and zenith angle of each grid point (rows) for each entry (columns)
+            theta = _angles(grid_vectors, ft2['RA_SCZ'][rows], ft2['DEC_SCZ'][rows])
+
+            selected = (good[numpy.newaxis, :] &
+                        (theta <= (thetamax - rad)) &
+                        (_angles(grid_vectors, ft2['RA_ZENITH'][rows], ft2['DEC_ZENITH'][rows]) <= (zmax - rad)))
+
+            livetime_fraction = livetime / (stop - start)
+
+            this_rate = numpy.zeros(theta.shape)
+
+            for i in range(n_points):
+
+                idx = selected[i]
+
+                this_rate[i, idx] = numpy.maximum(rate_interpolators[i](theta[i, idx]), 0) * livetime_fraction[idx]
+
+            this_npred = numpy.cumsum(this_rate * (stop - start), axis=1) + total[:, numpy.newaxis]
+
+            total = this_npred[:, -1]
+
+            rate[:, rows] = this_rate
+            npred[:, rows] = this_npred
+
+        rate.flush()
+        npred.flush()
+
+        del rate, npred
+
+    return directory
+
+
+def open_background_cube(directory):
+    """
+    Return the BackgroundCube for the given directory. Each directory is opened only once per process.
+    """
+
+    return open_cache_directory(directory, BackgroundCube)
+
+
+class BackgroundCube(object):
+
+    def __init__(self, directory):
+
+        if read_manifest(directory) is None:
+
+            raise IOError("%s does not contain a background cube" % directory)
+
+        self.directory = directory
+
+        self.ra = numpy.load(os.path.join(directory, "ra.npy"))
+        self.dec = numpy.load(os.path.join(directory, "dec.npy"))
+
+        self.start = numpy.load(os.path.join(directory, "start.npy"), mmap_mode='r')
+        self.stop = numpy.load(os.path.join(directory, "stop.npy"), mmap_mode='r')
+
+        # Expected rate (counts/s, including the livetime fraction) and cumulative number of
+        # expected events at the end of each FT2 entry, for each grid point
+        self.rate = numpy.load(os.path.join(directory, "rate.npy"), mmap_mode='r')
+        self.npred = numpy.load(os.path.join(directory, "npred.npy"), mmap_mode='r')
+
+        self._index = SkyIndex(self.ra, self.dec)
+
+    def get_index(self, ra, dec, tolerance=1e-3):
+        """
+        Return the index of the grid point at ra, dec (within the tolerance, in deg)
+        """
+
+        index, distance = self._index.query(ra, dec)
+
+        if distance > tolerance:
+
+            raise KeyError("The grid point (%.3f, %.3f) is not in the background cube" % (ra, dec))
+
+        return index
+
+    def _get_slice(self, tstart, tstop):
+
+        # Entries overlapping the interval tstart - tstop
+        i1 = numpy.searchsorted(self.stop, tstart, side='left')
+        i2 = numpy.searchsorted(self.start, tstop, side='left')
+
+        return slice(i1, max(i1, i2))
+
+    def get_integral_distribution(self, index, t0, tstart=None, tstop=None, gtis=None):
+        """
+        Return the integral distribution of the expected number of events for a grid point, like
+        ROIBackgroundEstimator.getIntegralDistribution (zero before the interval, constant after it).
+
+        :param index: index of the grid point (see get_index)
+        :param t0: time offset (the integral distribution is a function of t - t0)
+        :param tstart: start of the interval (default: start of the FT2)
+        :param tstop: end of the interval (default: end of the FT2)
+        :param gtis: list of (start, stop) of the GTIs. If given, the expected events outside of the GTIs are
+        removed (otherwise the selection of the cube is used as is)
+        :return: the IntegralDistribution instance
+        """
+
+        tstart = self.start[0] if tstart is None else tstart
+        tstop = self.stop[-1] if tstop is None else tstop
+
+        rows = self._get_slice(tstart, tstop)
+
+        start = numpy.asarray(self.start[rows])
+        stop = numpy.asarray(self.stop[rows])
+
+        if gtis is None:
+
+            # Just a lookup in the cube
+            before = float(self.npred[index, rows.start - 1]) if rows.start > 0 else 0.0
+
+            npred_stop = numpy.asarray(self.npred[index, rows], dtype=float) - before
+
+            # Value at the start of each entry
+            npred_start = numpy.concatenate([[0.0], npred_stop[:-1]])
+
+            x = numpy.vstack([start, stop]).T.flatten()
+            y = numpy.vstack([npred_start, npred_stop]).T.flatten()
+
+            # Remove the duplicated knots between contiguous entries (the
+            # values are the same)
+            keep = numpy.concatenate([[True], numpy.diff(x) > 0])
+
+            x = x[keep]
+            y = y[keep]
+
+        else:
+
+            gti_starts, gti_stops = numpy.array(sorted(gtis), dtype=float).reshape(-1, 2).T
+
+            # Knots at the boundaries of the entries and of the GTIs
+            x = numpy.unique(numpy.concatenate([start, stop, gti_starts, gti_stops]))
+            x = x[(x >= start[0]) & (x <= stop[-1])]
+
+            # Rate between two knots (zero in the gaps between entries)
+            middle = 0.5 * (x[1:] + x[:-1])
+
+            entry = numpy.searchsorted(start, middle, side='right') - 1
+
+            this_rate = numpy.where(middle < stop[entry],
+                                    numpy.asarray(self.rate[index, rows], dtype=float)[entry], 0.0)
+
+            # Time covered by the GTIs between two knots
+            covered = numpy.concatenate([[0.0], numpy.cumsum(gti_stops - gti_starts)])
+
+            coverage = numpy.interp(x, numpy.vstack([gti_starts, gti_stops]).T.flatten(),
+                                    numpy.vstack([covered[:-1], covered[1:]]).T.flatten())
+
+            y = numpy.concatenate([[0.0], numpy.cumsum(this_rate * numpy.diff(coverage))])
+
+        return IntegralDistribution(x - t0, y)
@@ -0,0 +1,258 @@
+"""
+Data space of the simulated reference ROIs: the off-axis angle of the ROI, the livetime and the number of
+simulated events for each FT2 entry, from which the lookup tables of the rate as a function of the off-axis
+angle are made (see ROIBackgroundEstimator.ROIBackgroundEstimatorDataMaker).
+
+The FT2 file and the simulated FT1 file cover years, so they are read in chunks of bounded size: only the
+off-axis angle, the livetime and the number of events of each entry are kept.
+"""
+
+import re
+
+import numpy
+
+from fermi_blind_search.angular_distance import unit_vectors
+from fermi_blind_search.fits_handling.ft2_cache import FT2Cache
+
+# Number of rows read at once from the FT2 and the FT1 files
+DEFAULT_CHUNK_SIZE = 100000
+
+_FT2_COLUMNS = ('START', 'STOP', 'RA_SCZ', 'DEC_SCZ', 'LIVETIME')
+
+
+def get_roi(header):
+    """
+    Return R.A., Dec. and radius of the ROI from the data selection keywords of the header of a FT1 file
+    """
+
+    dskeys = [key for key in header.keys() if key.startswith("DSVAL")]
+
+    # Get the key for the CIRCLE(ra,dec,radius) instruction
+    roikey = [key for key in dskeys if str(header[key]).upper().startswith("CIRCLE")]
+
+    if (len(roikey) == 0):
+        raise RuntimeError("Provided ft1 file does not contain a ROI definition")
+
+    # This is a string like 'CIRCLE(-234.25,+4.7,7.2)'
+    circleDef = str(header[roikey[0]])
+
+    # Extract RA,Dec and radius
+    return [float(x) for x in re.findall('CIRCLE\(([-,+]?[0-9\.]+),([-,+]?[0-9\.]+),([0-9\.]+)\)',
+                                         circleDef, re.IGNORECASE)[0]]
+
+
+def _native(array):
+
+    # FITS data is big-endian
+    array = numpy.asarray(array)
+
+    return array.astype(array.dtype.newbyteorder('='))
+
+
+def iterate_ft2(ft2, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yield the columns needed for the data space (START, STOP, RA_SCZ, DEC_SCZ, LIVETIME) of chunk_size rows
+    at a time, as dictionaries
+
+    :param ft2: the FT2 file, or a FT2Cache (see fits_handling.ft2_cache)
+    """
+
+    if isinstance(ft2, FT2Cache):
+
+        for i1 in range(0, len(ft2), chunk_size):
+
+            yield dict((name, numpy.array(ft2[name][i1:i1 + chunk_size])) for name in _FT2_COLUMNS)
+
+    else:
+
+        import fitsio
+
+        with fitsio.FITS(ft2, 'r') as fits:
+
+            hdu = fits['SC_DATA']
+
+            n_rows = hdu.get_nrows()
+
+            for i1 in range(0, n_rows, chunk_size):
+
+                data = hdu.read(columns=list(_FT2_COLUMNS), rows=numpy.arange(i1, min(i1 + chunk_size, n_rows)))
+
+                yield dict((name, _native(data[name])) for name in _FT2_COLUMNS)
+
+
+def iterate_events(ft1file, columns, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yield the given columns of the events in the FT1 file, chunk_size events at a time, as dictionaries
+    """
+
+    import fitsio
+
+    with fitsio.FITS(ft1file, 'r') as fits:
+
+        hdu = fits['EVENTS']
+
+        n_rows = hdu.get_nrows()
+
+        for i1 in range(0, n_rows, chunk_size):
+
+            data = hdu.read(columns=list(columns), rows=numpy.arange(i1, min(i1 + chunk_size, n_rows)))
+
+            yield dict((name, _native(data[name])) for name in columns)
+
+
+def iterate_event_times(ft1file, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yield the arrival times of the events in the FT1 file, chunk_size events at a time
+    """
+
+    for chunk in iterate_events(ft1file, ['TIME'], chunk_size):
+
+        yield chunk['TIME']
+
+
+def count_events(start, stop, times):
+    """
+    Count the events in each FT2 entry
+
+    :param start: start of the entries (sorted)
+    :param stop: stop of the entries
+    :param times: arrival times of the events (in any order)
+    :return: (number of events in each entry, number of events outside of all the entries)
+    """
+
+    entry = numpy.searchsorted(start, times, side='right') - 1
+
+    inside = (entry >= 0)
+    inside[inside] = times[inside] <= stop[entry[inside]]
+
+    counts = numpy.bincount(entry[inside], minlength=start.shape[0])
+
+    return counts, times.shape[0] - counts.sum()
+
+
+class DataSpace(object):
+    """
+    Off-axis angle, livetime and number of events of each FT2 entry within tstart - tstop, for the ROI
+    centered on ra, dec
+
+    :param ra: R.A. of the center of the ROI
+    :param dec: Dec. of the center of the ROI
+    :param tstart: start of the simulation
+    :param tstop: stop of the simulation
+    :param ft2: the FT2 file, or a FT2Cache
+    :param chunk_size: number of FT2 rows read at once
+    """
+
+    def __init__(self, ra, dec, tstart, tstop, ft2, chunk_size=DEFAULT_CHUNK_SIZE):
+
+        roi_vector = unit_vectors(ra, dec)[0]
+
+        start = []
+        stop = []
+        theta = []
+        livetime = []
+
+        for chunk in iterate_ft2(ft2, chunk_size):
+
+            # Keep only the entries within the simulation
+            idx = (chunk['START'] >= tstart) & (chunk['STOP'] < tstop)
+
+            if not numpy.any(idx):
+
+                continue
+
+            cos = numpy.dot(unit_vectors(chunk['RA_SCZ'][idx], chunk['DEC_SCZ'][idx]), roi_vector)
+
+            start.append(chunk['START'][idx])
+            stop.append(chunk['STOP'][idx])
+            theta.append(numpy.rad2deg(numpy.arccos(numpy.clip(cos, -1, 1))))
+            livetime.append(chunk['LIVETIME'][idx])
+
+        if len(start) == 0:
+
+            raise RuntimeError("Provided FT2 file does not cover FT1 interval")
+
+        self.start = numpy.concatenate(start)
+        self.stop = numpy.concatenate(stop)
+        self.theta = numpy.concatenate(theta)
+        self.livetime = numpy.concatenate(livetime)
+
+        # Make sure that the entries are time-ordered
+        if numpy.any(numpy.diff(self.start) < 0):
+
+            idx = numpy.argsort(self.start, kind='mergesort')
+
+            self.start = self.start[idx]
+            self.stop = self.stop[idx]
+            self.theta = self.theta[idx]
+            self.livetime = self.livetime[idx]
+
+        self.counts = numpy.zeros(self.start.shape[0], dtype=int)
+
+    def add_events(self, times):
+        """
+        Add the given events to the counts of the entries containing them
+
+        :return: the number of events outside of all the entries
+        """
+
+        counts, n_outside = count_events(self.start, self.stop, numpy.asarray(times, dtype=float))
+
+        self.counts += counts
+
+        return n_outside
+
+
+def theta_histogram(theta, counts, livetime, theta_bins):
+    """
+    Return the number of events and the livetime in each bin of off-axis angle
+
+    :param theta: off-axis angle of each FT2 entry
+    :param counts: number of events in each FT2 entry
+    :param livetime: livetime of each FT2 entry
+    :param theta_bins: edges of the bins (increasing)
+    :return: (counts, livetime)
+    """
+
+    cc = numpy.histogram(theta, theta_bins, weights=counts)[0]
+    lt = numpy.histogram(theta, theta_bins, weights=livetime)[0]
+
+    return cc, lt
+
+
+def get_theta_bins(n_theta):
+    """
+    Return the edges of n_theta bins of off-axis angle between 0 and 75 deg, uniform in cos(theta)
+    """
+
+    cosbins = numpy.linspace(numpy.cos(numpy.deg2rad(75)), 1, n_theta + 1)[::-1]
+
+    return numpy.rad2deg(numpy.arccos(cosbins))
+
+
+def rate_histogram(theta, counts, livetime, n_theta):
+    """
+    Return the rate of events as a function of the off-axis angle, from which the lookup tables are made
+
+    :param theta: off-axis angle of each FT2 entry
+    :param counts: number of events in each FT2 entry
+    :param livetime: livetime of each FT2 entry
+    :param n_theta: number of bins (see get_theta_bins)
+    :return: (edges of the bins, rate, error on the rate)
+    """
+
+    theta_bins = get_theta_bins(n_theta)
+
+    cc, lt = theta_histogram(theta, counts, livetime, theta_bins)
+
+    cce = 1 + numpy.sqrt(cc + 0.75)
+
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+
+        rate = cc / lt
+        rate_error = cce / lt
+
+    rate[numpy.isnan(rate)] = 0.0
+    rate_error[numpy.isnan(rate_error)] = 0.0
+
+    return theta_bins, rate, rate_error
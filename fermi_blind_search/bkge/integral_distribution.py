@@ -0,0 +1,373 @@
+"""
+Integral distribution of the expected number of background events.
+
+The expected rate is evaluated on a grid covering all the GTIs at once (see GTIGrid), and its integral is
+kept as a piecewise-linear function (see IntegralDistribution), which converts any number of times to the
+corresponding cumulative number of expected events with one call to numpy.interp.
+"""
+
+import numpy
+
+# Step (deg) of the table of the derivatives of the rate as a function of theta (see make_adaptive_grid)
+_THETA_STEP = 0.05
+
+# Minimum distance (s) between the points of the adaptive grid
+_MIN_STEP = 0.1
+
+# Factor applied to the bound of the second derivative of the rate, which is made of finite-difference
+# estimates of the derivatives of the rate as a function of theta (see make_adaptive_grid)
+_SAFETY_FACTOR = 2.0
+
+
+class IntegralDistribution(object):
+    """
+    A piecewise-linear cumulative distribution, which is zero (its first value) before the first knot and
+    constant after the last one, like a linear InterpolatedUnivariateSpline with ext=3
+    """
+
+    def __init__(self, x, y):
+
+        self.x = numpy.asarray(x, dtype=float)
+        self.y = numpy.asarray(y, dtype=float)
+
+        assert self.x.shape == self.y.shape
+
+    def __call__(self, x):
+
+        return numpy.interp(x, self.x, self.y)
+
+    def get_knots(self):
+
+        return self.x
+
+    def get_total(self):
+        """
+        Return the total (the value after the last knot)
+        """
+
+        return self.y[-1]
+
+
+class GTIGrid(object):
+    """
+    A grid of times covering all the given GTIs, with about one point every binsize seconds (see also
+    make_adaptive_grid, which places the points where they are needed).
+
+    Each GTI is divided in at least one bin of equal width, ending exactly padding seconds before the end
+    of the GTI, so that the last point is never in the SAA.
+
+    :param gti_starts: start of the GTIs (sorted)
+    :param gti_stops: stop of the GTIs
+    :param binsize: approximate distance between two points of the grid
+    :param padding: distance between the last point of each GTI and the end of the GTI
+    """
+
+    def __init__(self, gti_starts, gti_stops, binsize=1.0, padding=0.2):
+
+        self.gti_starts = numpy.atleast_1d(numpy.asarray(gti_starts, dtype=float))
+        self.gti_stops = numpy.atleast_1d(numpy.asarray(gti_stops, dtype=float))
+
+        padded_stops = numpy.maximum(self.gti_stops - padding, self.gti_starts)
+
+        # Number of points and their distance for each GTI (we always have at least 2 points)
+        n_points = numpy.maximum(2, numpy.ceil((padded_stops - self.gti_starts) / binsize)).astype(int)
+
+        steps = (padded_stops - self.gti_starts) / (n_points - 1)
+
+        gti = numpy.repeat(numpy.arange(n_points.shape[0]), n_points)
+        first = numpy.concatenate([[0], numpy.cumsum(n_points)[:-1]]).astype(int)
+
+        times = numpy.empty(gti.shape[0])
+
+        numpy.multiply(numpy.arange(gti.shape[0]) - first[gti], steps[gti], out=times)
+
+        times += self.gti_starts[gti]
+
+        # Avoid rounding errors at the end of each GTI
+        times[first + n_points - 1] = padded_stops
+
+        self._set_points(times, n_points)
+
+    @classmethod
+    def from_times(cls, gti_starts, gti_stops, times, n_points):
+        """
+        Make a grid with the given points
+
+        :param gti_starts: start of the GTIs (sorted)
+        :param gti_stops: stop of the GTIs
+        :param times: the points of all the GTIs, sorted. The last point of each GTI is its padded end
+        :param n_points: the number of points of each GTI
+        """
+
+        grid = cls.__new__(cls)
+
+        grid.gti_starts = numpy.atleast_1d(numpy.asarray(gti_starts, dtype=float))
+        grid.gti_stops = numpy.atleast_1d(numpy.asarray(gti_stops, dtype=float))
+
+        grid._set_points(numpy.asarray(times, dtype=float), numpy.asarray(n_points, dtype=int))
+
+        return grid
+
+    def _set_points(self, times, n_points):
+
+        self.times = times
+        self.n_points = n_points
+
+        # Index of the first and of the last point of each GTI
+        self.first = numpy.concatenate([[0], numpy.cumsum(self.n_points)[:-1]]).astype(int)
+        self.last = self.first + self.n_points - 1
+
+        # GTI of each point
+        self.gti = numpy.repeat(numpy.arange(self.n_points.shape[0]), self.n_points)
+
+        # Width of the bin of each point, such that the sum of values * widths is the integral
+        # computed by the integrate method
+        spacing = numpy.diff(self.times)
+
+        spacing[self.last[:-1]] = 0.0
+
+        self.widths = numpy.zeros_like(self.times)
+
+        self.widths[:-1] += 0.5 * spacing
+        self.widths[1:] += 0.5 * spacing
+
+        self.widths[self.last] += self.gti_stops - self.times[self.last]
+
+    def __len__(self):
+
+        return self.times.shape[0]
+
+    def integrate(self, values):
+        """
+        Integrate a quantity given at each point of the grid (for example the rate), interpolating linearly
+        between the points of the same GTI, and keeping the value of the last point between it and the end
+        of the GTI. The quantity is zero outside of the GTIs.
+
+        :param values: the values at each point of the grid
+        :return: (knots, integral at each knot)
+        """
+
+        values = numpy.asarray(values, dtype=float)
+
+        n_gtis = self.gti_starts.shape[0]
+
+        # The knots are the points of the grid plus the end of each GTI
+        n_knots = len(self) + n_gtis
+
+        points = numpy.arange(len(self)) + self.gti
+        ends = self.last + numpy.arange(n_gtis) + 1
+
+        knots = numpy.empty(n_knots)
+        knots_values = numpy.empty(n_knots)
+
+        knots[points] = self.times
+        knots[ends] = self.gti_stops
+
+        knots_values[points] = values
+        knots_values[ends] = values[self.last]
+
+        # Trapezoids between consecutive knots, except between the end of a GTI
+        # and the start of the next one
+        segments = 0.5 * (knots_values[1:] + knots_values[:-1]) * numpy.diff(knots)
+
+        segments[ends[:-1]] = 0.0
+
+        integral = numpy.empty(n_knots)
+        integral[0] = 0.0
+
+        numpy.cumsum(segments, out=integral[1:])
+
+        return knots, integral
+
+    def integrate_gtis(self, values):
+        """
+        Like integrate, but return the integral separately for each GTI, starting from zero at the start
+        of the GTI
+
+        :return: a list of (knots, integral) for each GTI
+        """
+
+        knots, integral = self.integrate(values)
+
+        # The knots of each GTI are its points plus its end
+        first = self.first + numpy.arange(self.first.shape[0])
+        last = self.last + numpy.arange(self.last.shape[0]) + 1
+
+        return [(knots[i1:i2 + 1], integral[i1:i2 + 1] - integral[i1]) for i1, i2 in zip(first, last)]
+
+
+def _get_rate_derivatives(rate_interpolator):
+
+    # Absolute value of the first and of the second derivative of the rate as a function of theta,
+    # on a fine grid of theta
+    theta = numpy.arange(0, 90.0 + _THETA_STEP, _THETA_STEP)
+
+    first = numpy.gradient(rate_interpolator(theta), _THETA_STEP)
+    second = numpy.gradient(first, _THETA_STEP)
+
+    return numpy.abs(first), numpy.abs(second)
+
+
+def _range_max(table, i1, i2):
+
+    # Maximum of table[i1:i2 + 1] for each pair of i1 and i2
+    padded = numpy.append(table, 0.0)
+
+    indices = numpy.empty(2 * i1.shape[0], dtype=int)
+    indices[0::2] = i1
+    indices[1::2] = i2 + 1
+
+    return numpy.maximum.reduceat(padded, indices)[0::2]
+
+
+def make_adaptive_grid(gti_starts, gti_stops, ft2_times, theta, livetime_fraction, rate_interpolator,
+                       rate_function, max_relative_error=1e-3, padding=0.2):
+    """
+    Make a grid covering the given GTIs with the points where the expected rate changes, so that the
+    integral computed on it (see GTIGrid.integrate) differs from the exact integral by less than
+    max_relative_error times the total.
+
+    The off-axis angle and the livetime fraction are interpolated linearly between the FT2 entries, so the
+    rate f(t) = R(theta(t)) * L(t) is smooth between them. Each interval between two entries is divided in
+    n equal parts, with the smallest n for which the bound of the error of the trapezoidal rule,
+    h^3 max|f''| / (12 n^2), is within the share of the error of the interval. The bound of f'' comes from
+    the derivatives of theta and L in the interval and the maximum of the derivatives of R over the range
+    of theta of the interval. The intervals where the pointing changes slowly get only one point.
+
+    The derivatives of R are finite-difference estimates on a fine grid of theta (see _get_rate_derivatives),
+    so the error is not strictly guaranteed. To keep the bound conservative, their maximum is taken over one
+    more step of the grid on each side of the range, and the bound of f'' is multiplied by _SAFETY_FACTOR.
+
+    :param gti_starts: start of the GTIs (sorted)
+    :param gti_stops: stop of the GTIs
+    :param ft2_times: times of the FT2 entries (the points of the interpolation of theta and L)
+    :param theta: off-axis angle (deg) at ft2_times
+    :param livetime_fraction: livetime fraction at ft2_times
+    :param rate_interpolator: the rate R as a function of theta
+    :param rate_function: the expected rate (counts/s) as a function of time, R(theta(t)) * L(t)
+    :param max_relative_error: maximum relative error on the integral
+    :param padding: distance between the last point of each GTI and the end of the GTI (see GTIGrid)
+    :return: (grid, expected rate at each point of the grid)
+    """
+
+    gti_starts = numpy.atleast_1d(numpy.asarray(gti_starts, dtype=float))
+    gti_stops = numpy.atleast_1d(numpy.asarray(gti_stops, dtype=float))
+
+    ft2_times = numpy.asarray(ft2_times, dtype=float)
+    theta = numpy.asarray(theta, dtype=float)
+    livetime_fraction = numpy.asarray(livetime_fraction, dtype=float)
+
+    n_gtis = gti_starts.shape[0]
+
+    padded_stops = numpy.maximum(gti_stops - padding, gti_starts)
+
+    # The break points are the start and the padded end of each GTI, and the FT2 entries within them
+    entry_gti = numpy.clip(numpy.searchsorted(gti_starts, ft2_times, side='right') - 1, 0, n_gtis - 1)
+
+    inside = (ft2_times > gti_starts[entry_gti]) & (ft2_times < padded_stops[entry_gti])
+
+    breaks = numpy.concatenate([gti_starts, ft2_times[inside], padded_stops])
+    breaks_gti = numpy.concatenate([numpy.arange(n_gtis), entry_gti[inside], numpy.arange(n_gtis)])
+
+    order = numpy.lexsort((breaks, breaks_gti))
+
+    breaks = breaks[order]
+    breaks_gti = breaks_gti[order]
+
+    rate_breaks = numpy.asarray(rate_function(breaks), dtype=float)
+
+    # The intervals between consecutive break points of the same GTI
+    last = numpy.append(breaks_gti[1:] != breaks_gti[:-1], True)
+
+    a = breaks[:-1]
+    b = breaks[1:]
+
+    h = numpy.where(last[:-1], 0.0, b - a)
+
+    # Derivatives of theta and L in the FT2 interval containing each interval
+    j = numpy.clip(numpy.searchsorted(ft2_times, 0.5 * (a + b), side='right') - 1, 0, ft2_times.shape[0] - 2)
+
+    dt = ft2_times[j + 1] - ft2_times[j]
+
+    theta_slope = (theta[j + 1] - theta[j]) / dt
+    livetime_slope = (livetime_fraction[j + 1] - livetime_fraction[j]) / dt
+
+    theta_a = numpy.interp(a, ft2_times, theta)
+    theta_b = numpy.interp(b, ft2_times, theta)
+
+    livetime_max = numpy.maximum(numpy.interp(a, ft2_times, livetime_fraction),
+                                 numpy.interp(b, ft2_times, livetime_fraction))
+
+    # Maximum of the derivatives of R over the range of theta of each interval, extended by one step
+    # on each side
+    first_derivative, second_derivative = _get_rate_derivatives(rate_interpolator)
+
+    n_table = first_derivative.shape[0]
+
+    i1 = numpy.clip(numpy.floor(numpy.minimum(theta_a, theta_b) / _THETA_STEP) - 1, 0, n_table - 1).astype(int)
+    i2 = numpy.clip(numpy.ceil(numpy.maximum(theta_a, theta_b) / _THETA_STEP) + 1, 0, n_table - 1).astype(int)
+
+    # Bound of |f''| = |L R'' theta'^2 + 2 L' R' theta'| in each interval
+    curvature = _SAFETY_FACTOR * (livetime_max * _range_max(second_derivative, i1, i2) * theta_slope ** 2 +
+                                  2 * numpy.abs(livetime_slope * theta_slope) * _range_max(first_derivative, i1, i2))
+
+    error_bounds = h ** 3 * curvature / 12.0
+
+    # Lower bound of the total, from the integral on the break points and the bound of its error
+    total = max(numpy.sum(0.5 * (rate_breaks[1:] + rate_breaks[:-1]) * h) - numpy.sum(error_bounds), 0.0)
+
+    # Share the error among the intervals so that the number of points is minimum
+    weights = h * numpy.power(curvature, 1.0 / 3)
+
+    max_points = numpy.maximum(1, numpy.ceil(h / _MIN_STEP))
+
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+
+        errors = max_relative_error * total * weights / numpy.sum(weights)
+
+        n = numpy.where(error_bounds > 0, numpy.ceil(numpy.sqrt(error_bounds / errors)), 1)
+
+    n = numpy.where(numpy.isfinite(n), numpy.minimum(n, max_points), max_points).astype(int)
+
+    # Points of each interval (the last break point of each GTI is a point by itself)
+    counts = numpy.append(n, 1)
+    counts[last] = 1
+
+    steps = numpy.append(h / n, 0.0)
+    steps[last] = 0.0
+
+    point_break = numpy.repeat(numpy.arange(breaks.shape[0]), counts)
+    k = numpy.arange(point_break.shape[0]) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+
+    times = breaks[point_break] + k * steps[point_break]
+
+    # Evaluate the rate only on the new points
+    rate = rate_breaks[point_break]
+
+    new = (k > 0)
+
+    if numpy.any(new):
+
+        rate[new] = rate_function(times[new])
+
+    n_points = numpy.bincount(breaks_gti[point_break], minlength=n_gtis)
+
+    return GTIGrid.from_times(gti_starts, gti_stops, times, n_points), rate
+
+
+def join_gtis(segments):
+    """
+    Join the integrals of consecutive GTIs (as returned by GTIGrid.integrate_gtis) in one integral
+
+    :param segments: a list of (knots, integral) for each GTI, sorted by time
+    :return: (knots, integral)
+    """
+
+    knots = numpy.concatenate([x[0] for x in segments])
+
+    # Each GTI starts from the total of the previous ones
+    totals = numpy.cumsum([0.0] + [x[1][-1] for x in segments[:-1]])
+
+    integral = numpy.concatenate([x[1] + total for x, total in zip(segments, totals)])
+
+    return knots, integral
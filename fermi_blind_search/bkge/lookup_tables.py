@@ -0,0 +1,502 @@
+import glob
+import os
+import re
+from collections import OrderedDict
+
+import numpy
+import scipy.interpolate
+
+from fermi_blind_search.data_files import get_data_file_path
+from fermi_blind_search.sky_index import SkyIndex
+
+
+def get_theta_lookup_file(ra, dec):
+
+    root_for_interpolator = "ra%.3f-dec%.3f_rateForInterpolator" % (ra, dec)
+
+    path = get_data_file_path('ROIBackgroundEstimator_data')
+
+    return os.path.join(path, '%s.npz' % root_for_interpolator)
+
+
+def find_theta_lookup_file(ra, dec):
+    """
+    Return the lookup table for the given position, coping with the fact that sometimes
+    (I don't know why) the name of the file is slightly different
+    """
+
+    lookup_table_file = get_theta_lookup_file(ra, dec)
+
+    if not os.path.exists(lookup_table_file):
+        # Try with a slightly different RA
+
+        ra = float(os.path.basename(lookup_table_file).split("-")[0].replace("ra", "")[:-2])
+
+        other_tokens = "-".join(os.path.basename(lookup_table_file).split("-")[1:])
+
+        search_expr = os.path.join(get_data_file_path('ROIBackgroundEstimator_data'),
+                                   'ra%s*%s' % (ra, other_tokens))
+
+        files_ = glob.glob(search_expr)
+
+        if len(files_)==0:
+
+            raise RuntimeError("Could not find data files for background estimation (%s)" % (search_expr))
+
+        else:
+
+            lookup_table_file = files_[0]
+
+    return lookup_table_file
+
+
+def read_theta_lookup_table(lookup_table_file):
+    """
+    Read a lookup table, removing the points with infinite weight
+
+    :return: (theta, rate, weights, k, s)
+    """
+
+    if not os.path.exists(lookup_table_file):
+
+        raise IOError("Cannot find lookup table %s" % (lookup_table_file))
+
+    npzfile = numpy.load(lookup_table_file)
+
+    # Rate as function of theta
+
+    sim_theta = npzfile['theta']
+    sim_rate = npzfile['rate']
+    sim_weights = npzfile['weights']
+    k = npzfile['k']
+    s = npzfile['s']
+
+    del npzfile
+
+    # Now make sure there are no infinite weight
+
+    idx = numpy.isfinite(sim_weights)
+
+    return sim_theta[idx], sim_rate[idx], sim_weights[idx], k, s
+
+
+# Name of the archive containing all the lookup tables (see make_lookup_table_archive)
+ARCHIVE_NAME = 'ROIBackgroundEstimator_data.npz'
+
+# The archive, once loaded by this process (see get_lookup_table_archive)
+_archive = None
+
+# Maximum distance (deg) between a ROI and the center of its lookup table. It can be changed with the
+# lookup_table_tolerance option in the [Analysis] section of the configuration file
+DEFAULT_TOLERANCE = 0.01
+
+# Number of lookup tables blended for a ROI off the grid of the tables (see BlendedRateSpline). It can be
+# changed with the lookup_table_neighbours option in the [Analysis] section of the configuration file (0 means
+# that ROIs off the grid cannot be analyzed)
+DEFAULT_NEIGHBOURS = 4
+
+# Number of blended splines kept by the archive (the least recently used ones are dropped first)
+DEFAULT_BLENDED_CACHE_SIZE = 256
+
+
+class RateSpline(object):
+    """
+    A spline with precomputed knots and coefficients, which evaluates like the UnivariateSpline it was
+    taken from
+    """
+
+    def __init__(self, knots, coefficients, k):
+
+        self._tck = (knots, coefficients, int(k))
+
+    def __call__(self, x):
+
+        return scipy.interpolate.splev(x, self._tck)
+
+    def get_knots(self):
+
+        # Like UnivariateSpline.get_knots, only the interior knots
+        k = self._tck[2]
+
+        return self._tck[0][k:-k]
+
+    def get_coeffs(self):
+
+        # Like UnivariateSpline.get_coeffs
+        return self._tck[1][:len(self._tck[0]) - self._tck[2] - 1]
+
+
+class BlendedRateSpline(object):
+    """
+    The rate as a function of the off-axis angle for a position between the centers of the lookup tables: the
+    weighted average of the splines of the closest tables, evaluated like a RateSpline
+
+    :param splines: the splines of the closest tables
+    :param weights: their weights (normalized to 1 here)
+    """
+
+    def __init__(self, splines, weights):
+
+        weights = numpy.asarray(weights, dtype=float)
+
+        self._splines = list(splines)
+        self._weights = weights / weights.sum()
+
+    def __call__(self, x):
+
+        return sum([weight * spline(x) for spline, weight in zip(self._splines, self._weights)])
+
+    def get_knots(self):
+
+        return numpy.unique(numpy.concatenate([spline.get_knots() for spline in self._splines]))
+
+    def get_coeffs(self):
+
+        # The coefficients of all the splines, times their weights
+        return numpy.concatenate([weight * spline.get_coeffs()
+                                  for spline, weight in zip(self._splines, self._weights)])
+
+
+def make_theta_lookup_table(theta_bins, rate, rate_error, k=2, s=None):
+    """
+    Return the lookup table (the points to which the spline of the rate as a function of the off-axis angle
+    is fitted) for the given histogram of the rate
+
+    :param theta_bins: edges of the bins of off-axis angle (deg)
+    :param rate: rate in each bin
+    :param rate_error: error on the rate in each bin
+    :param k: degree of the spline
+    :param s: smoothing factor of the spline (default: number of bins / 1.5)
+    :return: (theta, rate, weights, k, s), as saved in the lookup table files
+    """
+
+    if s is None:
+
+        s = (len(theta_bins) - 1) / 1.5
+
+    center = (theta_bins[:-1] + theta_bins[1:]) / 2
+
+    # Add one point at the beginning to avoid Runge phenomenon at
+    # theta = 0
+    xi = numpy.insert(center, 0, 0.0)
+    yi = numpy.insert(rate, 0, rate[0])
+    wi = numpy.insert(rate_error, 0, rate_error[0])
+
+    # Add one point at the end for the same reason
+    xi = numpy.append(xi, 80.0)
+    yi = numpy.append(yi, 0.0)
+    wi = numpy.append(wi, wi[0])
+
+    with numpy.errstate(divide='ignore'):
+
+        return xi, yi, 1.0 / wi, k, s
+
+
+def _get_full_knots_and_coefficients(spline, k):
+
+    # Full knots and coefficients of a UnivariateSpline, as used by splev (the inverse of RateSpline.get_knots
+    # and RateSpline.get_coeffs). The boundary knots have multiplicity k + 1, and splev needs as many
+    # coefficients as knots (the last k + 1 are not used)
+    interior = spline.get_knots()
+
+    knots = numpy.concatenate([[interior[0]] * k, interior, [interior[-1]] * k])
+
+    coefficients = numpy.zeros(knots.shape[0])
+    coefficients[:knots.shape[0] - k - 1] = spline.get_coeffs()
+
+    return knots, coefficients
+
+
+def write_lookup_table_archive(outfile, ras, decs, tables):
+    """
+    Write the archive of the given lookup tables, together with the knots and the coefficients of their
+    splines (see LookupTableArchive)
+
+    :param outfile: name of the archive
+    :param ras: R.A. of the center of each lookup table
+    :param decs: Dec. of the center of each lookup table
+    :param tables: (theta, rate, weights, k, s) for each lookup table
+    :return: the name of the archive
+    """
+
+    filtered_tables = []
+    splines = []
+
+    for sim_theta, sim_rate, sim_weights, k, s in tables:
+
+        # Remove the points with infinite weight, as read_theta_lookup_table does
+        idx = numpy.isfinite(sim_weights)
+
+        sim_theta, sim_rate, sim_weights = sim_theta[idx], sim_rate[idx], sim_weights[idx]
+
+        rate_interpolator = scipy.interpolate.UnivariateSpline(sim_theta, sim_rate, w=sim_weights, k=k, s=s)
+
+        filtered_tables.append((sim_theta, sim_rate, sim_weights, k, s))
+
+        splines.append(_get_full_knots_and_coefficients(rate_interpolator, int(k)))
+
+    n_points = max([len(x[0]) for x in filtered_tables])
+    n_knots = max([len(x[0]) for x in splines])
+
+    def _pack(arrays, n):
+
+        # Arrays of different lengths in a 2d array, padded with zeros
+        packed = numpy.zeros((len(arrays), n))
+
+        for i, array in enumerate(arrays):
+
+            packed[i, :len(array)] = array
+
+        return packed
+
+    numpy.savez_compressed(outfile,
+                           ra=numpy.array(ras, dtype=float),
+                           dec=numpy.array(decs, dtype=float),
+                           n_points=numpy.array([len(x[0]) for x in filtered_tables]),
+                           theta=_pack([x[0] for x in filtered_tables], n_points),
+                           rate=_pack([x[1] for x in filtered_tables], n_points),
+                           weights=_pack([x[2] for x in filtered_tables], n_points),
+                           k=numpy.array([x[3] for x in filtered_tables]),
+                           s=numpy.array([x[4] for x in filtered_tables]),
+                           n_knots=numpy.array([len(x[0]) for x in splines]),
+                           knots=_pack([x[0] for x in splines], n_knots),
+                           coefficients=_pack([x[1] for x in splines], n_knots))
+
+    return outfile
+
+
+def make_lookup_table_archive(outfile=None):
+    """
+    Pack all the lookup tables in the ROIBackgroundEstimator_data directory in one archive, together with
+    the knots and the coefficients of their splines.
+
+    :param outfile: name of the archive (default: ARCHIVE_NAME in the data directory)
+    :return: the name of the archive
+    """
+
+    if outfile is None:
+
+        outfile = get_data_file_path(ARCHIVE_NAME)
+
+    files_ = sorted(glob.glob(os.path.join(get_data_file_path('ROIBackgroundEstimator_data'),
+                                           'ra*_rateForInterpolator.npz')))
+
+    ras = []
+    decs = []
+    tables = []
+
+    for lookup_table_file in files_:
+
+        ra, dec = re.findall('ra([-0-9\.]+)-dec([-0-9\.]+)_rateForInterpolator',
+                             os.path.basename(lookup_table_file))[0]
+
+        ras.append(float(ra))
+        decs.append(float(dec))
+        tables.append(read_theta_lookup_table(lookup_table_file))
+
+    return write_lookup_table_archive(outfile, ras, decs, tables)
+
+
+class LookupTableArchive(object):
+    """
+    All the lookup tables, with their splines, from the archive made by make_lookup_table_archive
+    """
+
+    def __init__(self, filename, tolerance=DEFAULT_TOLERANCE, blended_cache_size=DEFAULT_BLENDED_CACHE_SIZE):
+
+        with numpy.load(filename) as npzfile:
+
+            self._data = dict((key, npzfile[key]) for key in npzfile.files)
+
+        self.ra = self._data['ra']
+        self.dec = self._data['dec']
+
+        self.tolerance = float(tolerance)
+
+        self._index = SkyIndex(self.ra, self.dec)
+
+        # Blended splines by position, the most recently used last
+        self._blended = OrderedDict()
+        self._blended_cache_size = int(blended_cache_size)
+
+    def __len__(self):
+
+        return self.ra.shape[0]
+
+    def get_index(self, ra, dec, tolerance=None):
+        """
+        Return the index of the lookup table closest to the given position (or positions, if ra and dec
+        are arrays)
+
+        :param ra: R.A. (deg)
+        :param dec: Dec. (deg)
+        :param tolerance: maximum distance (deg) between the position and the center of the lookup table
+        (default: the tolerance of the archive)
+        """
+
+        tolerance = self.tolerance if tolerance is None else tolerance
+
+        index, distance = self._index.query(ra, dec)
+
+        if numpy.any(distance > tolerance):
+
+            raise RuntimeError("Could not find data for background estimation within %s deg from "
+                               "(R.A., Dec.) = (%s, %s)" % (tolerance, ra, dec))
+
+        return index
+
+    def get_table(self, index):
+        """
+        Return the lookup table with the given index, as (theta, rate, weights, k, s)
+        """
+
+        n = self._data['n_points'][index]
+
+        return (self._data['theta'][index, :n], self._data['rate'][index, :n], self._data['weights'][index, :n],
+                self._data['k'][index], self._data['s'][index])
+
+    def get_rate_interpolator(self, index):
+        """
+        Return the spline of the rate as a function of the off-axis angle for the given index
+        """
+
+        n = self._data['n_knots'][index]
+
+        return RateSpline(self._data['knots'][index, :n], self._data['coefficients'][index, :n],
+                          self._data['k'][index])
+
+    def get_blended_rate_interpolator(self, ra, dec, neighbours=DEFAULT_NEIGHBOURS):
+        """
+        Return the rate as a function of the off-axis angle for any position, blending the splines of the
+        closest lookup tables with weights inversely proportional to the square of their angular distance.
+        Within the tolerance from the center of a table, the spline of that table is returned.
+
+        The blended splines are cached by position, so that they are computed only once for each ROI.
+
+        :param ra: R.A. (deg)
+        :param dec: Dec. (deg)
+        :param neighbours: number of tables to blend
+        """
+
+        key = (round(float(ra), 6), round(float(dec), 6), int(neighbours))
+
+        if key in self._blended:
+
+            # Move it to the end, as the most recently used
+            rate_interpolator = self._blended.pop(key)
+
+            self._blended[key] = rate_interpolator
+
+            return rate_interpolator
+
+        indexes, distances = self._index.query_nearest(ra, dec, neighbours)
+
+        if distances[0] <= self.tolerance:
+
+            rate_interpolator = self.get_rate_interpolator(indexes[0])
+
+        else:
+
+            rate_interpolator = BlendedRateSpline([self.get_rate_interpolator(index) for index in indexes],
+                                                  1.0 / distances ** 2)
+
+        self._blended[key] = rate_interpolator
+
+        while len(self._blended) > self._blended_cache_size:
+
+            # Drop the least recently used
+            self._blended.popitem(last=False)
+
+        return rate_interpolator
+
+
+def _get_configured_option(name, default):
+
+    from fermi_blind_search.configuration import get_config
+
+    try:
+
+        configuration = get_config()
+
+    except AssertionError:
+
+        # Configuration not read yet
+        return default
+
+    if configuration.has_option("Analysis", name):
+
+        return type(default)(configuration.get("Analysis", name))
+
+    else:
+
+        return default
+
+
+def get_lookup_table_archive():
+    """
+    Return the archive of the lookup tables, or None if it does not exist. It is read only once per process.
+    """
+
+    global _archive
+
+    if _archive is None:
+
+        filename = get_data_file_path(ARCHIVE_NAME)
+
+        if not os.path.exists(filename):
+
+            return None
+
+        _archive = LookupTableArchive(filename, _get_configured_option('lookup_table_tolerance', DEFAULT_TOLERANCE))
+
+    return _archive
+
+
+def get_rate_interpolator(ra, dec):
+    """
+    Return the spline giving the rate of the simulated background as a function of the off-axis angle for
+    the ROI centered on ra, dec. The spline is taken from the archive of the lookup tables if it exists,
+    otherwise it is fitted to the lookup table file. If there is no lookup table for the ROI, the splines of
+    the closest tables in the archive are blended (see LookupTableArchive.get_blended_rate_interpolator),
+    unless the lookup_table_neighbours option is 0.
+    """
+
+    archive = get_lookup_table_archive()
+
+    if archive is not None:
+
+        try:
+
+            index = archive.get_index(ra, dec)
+
+        except RuntimeError:
+
+            # Not in the archive (for example a lookup table made after the archive)
+            pass
+
+        else:
+
+            return archive.get_rate_interpolator(index)
+
+    try:
+
+        lookup_table_file = find_theta_lookup_file(ra, dec)
+
+    except RuntimeError:
+
+        neighbours = _get_configured_option('lookup_table_neighbours', DEFAULT_NEIGHBOURS)
+
+        if archive is None or neighbours == 0:
+
+            raise
+
+        return archive.get_blended_rate_interpolator(ra, dec, neighbours)
+
+    sim_theta, sim_rate, sim_weights, k, s = read_theta_lookup_table(lookup_table_file)
+
+    rate_interpolator = scipy.interpolate.UnivariateSpline(sim_theta, sim_rate, w=sim_weights, k=k, s=s)
+
+    if numpy.sum(numpy.isnan(rate_interpolator.get_coeffs())) > 0:
+        raise RuntimeError("Rate interpolation failed using %s\n" % lookup_table_file)
+
+    return rate_interpolator
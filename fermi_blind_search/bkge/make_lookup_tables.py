@@ -1,28 +1,299 @@
-import matplotlib
+"""
+Regeneration of the lookup tables of all the reference ROIs.
 
-matplotlib.use('Agg')
+The lookup table of each ROI (see lookup_tables.make_theta_lookup_table) is made in a pool of processes,
+from its data space (see reference_rois.make_reference_data_spaces) or, if there is none, from its simulated
+FT1 file (as made by make_reference_rois.ReferenceROIsMaker.go) and the FT2 file of the simulation.
 
-from fermi_blind_search.bkge import ROIBackgroundEstimator
+The table of each ROI is saved in the working directory as soon as it is done, and a manifest there keeps
+track of the ROIs completed (with the size and modification time of the file they were made from) and of
+the ones that failed (with the error). So an interrupted run can be resumed: the completed ROIs are skipped,
+unless their file has changed since, and the failed ones are tried again. When all the ROIs are completed,
+the tables are written directly in the archive used by the background estimation (see
+lookup_tables.LookupTableArchive).
+"""
 
 import glob
+import json
+import multiprocessing
+import os
+import traceback
 
-simulations = glob.glob("/dev/shm/swap/reference_rois/ra*ref.fits")
+import numpy
 
+from fermi_blind_search.bkge.data_space import (DEFAULT_CHUNK_SIZE, DataSpace, get_roi, iterate_event_times,
+                                                rate_histogram)
+from fermi_blind_search.bkge.lookup_tables import make_theta_lookup_table, write_lookup_table_archive
+from fermi_blind_search.fits_handling.ft2_cache import make_ft2_cache, open_ft2_cache
+from fermi_blind_search.make_directory import make_dir_if_not_exist
 
-import os
+_MANIFEST = "manifest.json"
+
+DEFAULT_SETTINGS = {'n_theta': 40,
+                    'k': 2,
+                    's': None}
+
+
+def _describe_source(filename):
+
+    stat = os.stat(filename)
+
+    return {'file': os.path.abspath(filename), 'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+def find_sources(directory):
+    """
+    Find the data spaces (<root>_lookup.npz) and the simulated FT1 files (<root>.fits) of the reference
+    ROIs in the given directory. If a ROI has both, the data space is used.
+
+    :return: a dictionary root -> file
+    """
+
+    sources = {}
+
+    for ft1file in glob.glob(os.path.join(directory, "ra*_ref.fits")):
+
+        sources[os.path.basename(ft1file)[:-len(".fits")]] = os.path.abspath(ft1file)
+
+    for data_space_file in glob.glob(os.path.join(directory, "ra*_ref_lookup.npz")):
+
+        sources[os.path.basename(data_space_file)[:-len("_lookup.npz")]] = os.path.abspath(data_space_file)
+
+    return sources
+
+
+def _read_data_space(source, ft2_cache_dir, chunk_size):
+
+    if source.endswith(".npz"):
+
+        data = numpy.load(source)
+
+        return float(data['ra']), float(data['dec']), data['theta'], data['counts'], data['livetime']
+
+    if ft2_cache_dir is None:
+
+        raise RuntimeError("The FT2 file of the simulation is needed for %s" % source)
+
+    import fitsio
+
+    header = fitsio.read_header(source, 'EVENTS')
+
+    ra, dec, _ = get_roi(header)
+
+    data_space = DataSpace(ra, dec, float(header['TSTART']), float(header['TSTOP']),
+                           open_ft2_cache(ft2_cache_dir), chunk_size)
+
+    for times in iterate_event_times(source, chunk_size):
+
+        data_space.add_events(times)
+
+    return ra, dec, data_space.theta, data_space.counts, data_space.livetime
+
+
+def _make_table(args):
+
+    root, source, outfile, settings, ft2_cache_dir, chunk_size = args
+
+    try:
+
+        ra, dec, theta, counts, livetime = _read_data_space(source, ft2_cache_dir, chunk_size)
+
+        theta_bins, rate, rate_error = rate_histogram(theta, counts, livetime, settings['n_theta'])
+
+        xi, yi, wi, k, s = make_theta_lookup_table(theta_bins, rate, rate_error, settings['k'], settings['s'])
+
+        # Write and rename, so that an interrupted run never leaves a partial table
+        with open(outfile + ".tmp", "wb") as f:
+
+            numpy.savez(f, ra=ra, dec=dec, theta=xi, rate=yi, weights=wi, k=k, s=s)
+
+        os.rename(outfile + ".tmp", outfile)
+
+    except Exception:
+
+        return root, traceback.format_exc()
+
+    return root, None
+
+
+class LookupTablesManifest(object):
+    """
+    The manifest of a run of make_lookup_tables in the given working directory: the settings of the run
+    (including the FT2 file), the ROIs completed with the description of the file they were made from, and
+    the ROIs that failed, with their error.
+
+    If the directory contains the manifest of a run with different settings, it is started again from scratch.
+    """
+
+    def __init__(self, workdir, settings):
+
+        self.filename = os.path.join(workdir, _MANIFEST)
+        self.settings = settings
+        self.completed = []
+        self.sources = {}
+        self.failed = {}
+
+        if os.path.exists(self.filename):
+
+            with open(self.filename) as f:
+
+                manifest = json.load(f)
+
+            if manifest['settings'] == settings:
+
+                self.completed = manifest['completed']
+                self.sources = manifest['sources']
+                self.failed = manifest['failed']
+
+    def is_completed(self, root, source):
+        """
+        Return whether the ROI was completed from the given source (see _describe_source)
+        """
+
+        return root in self.completed and self.sources.get(root) == source
+
+    def set_result(self, root, source, error):
+
+        if error is None:
+
+            self.failed.pop(root, None)
+
+            if root not in self.completed:
+
+                self.completed.append(root)
+
+            self.sources[root] = source
+
+        else:
+
+            if root in self.completed:
+
+                self.completed.remove(root)
+
+            self.sources.pop(root, None)
+
+            self.failed[root] = error
+
+        self.save()
+
+    def save(self):
+
+        with open(self.filename + ".tmp", "w+") as f:
+
+            json.dump({'settings': self.settings,
+                       'completed': sorted(self.completed),
+                       'sources': self.sources,
+                       'failed': self.failed}, f, indent=2, sort_keys=True)
+
+        os.rename(self.filename + ".tmp", self.filename)
+
+
+def make_lookup_tables(sources, workdir, outfile, ft2file=None, settings=None, ncpus=1,
+                       chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Make the lookup tables of the given reference ROIs, and write them in the archive.
+
+    :param sources: a dictionary root -> data space or simulated FT1 file (see find_sources)
+    :param workdir: working directory, with the tables of the single ROIs and the manifest of the run. Run again
+    with the same working directory to resume an interrupted run, or to retry the failed ROIs. The ROIs whose
+    file has changed since they were completed are made again, and everything is made again if the settings or
+    the FT2 file have changed
+    :param outfile: name of the archive (to update the archive used by the background estimation, give
+    lookup_tables.ARCHIVE_NAME in the data directory explicitly)
+    :param ft2file: the FT2 file of the simulation (needed only for the simulated FT1 files)
+    :param settings: binning and spline settings of the tables (see DEFAULT_SETTINGS)
+    :param ncpus: number of processes to use
+    :param chunk_size: number of rows read at once from the FT1 and the FT2 files
+    :return: the name of the archive
+    """
+
+    complete_settings = dict(DEFAULT_SETTINGS)
+
+    if settings is not None:
+
+        complete_settings.update(settings)
+
+    workdir = os.path.abspath(workdir)
+
+    tables_dir = os.path.join(workdir, "tables")
+
+    make_dir_if_not_exist(tables_dir)
+
+    # The tables depend on the FT2 file too (for the simulated FT1 files)
+    manifest = LookupTablesManifest(workdir, dict(complete_settings,
+                                                  ft2=_describe_source(ft2file) if ft2file is not None else None))
+
+    if len(manifest.completed) > 0 or len(manifest.failed) > 0:
+
+        print("Resuming: %s ROIs completed, %s failed" % (len(manifest.completed), len(manifest.failed)))
+
+    def _table_file(root):
+
+        return os.path.join(tables_dir, "%s.npz" % root)
+
+    roots = sorted(sources.keys())
+
+    descriptions = dict([(root, _describe_source(sources[root])) for root in roots])
+
+    todo = [root for root in roots
+            if not manifest.is_completed(root, descriptions[root]) or not os.path.exists(_table_file(root))]
+
+    ft2_cache_dir = None
+
+    if ft2file is not None and any([not sources[root].endswith(".npz") for root in todo]):
+
+        # The FT2 file is needed for each ROI, so it is read only once in a cache shared by the processes
+        ft2_cache_dir = make_ft2_cache(ft2file, os.path.join(workdir, "__ft2_cache"))
+
+    tasks = [(root, sources[root], _table_file(root), complete_settings, ft2_cache_dir, chunk_size)
+             for root in todo]
+
+    print("Making %s lookup tables (%s already done)" % (len(tasks), len(roots) - len(tasks)))
+
+    def _record(results):
+
+        for i, (root, error) in enumerate(results):
+
+            manifest.set_result(root, descriptions[root], error)
+
+            print("%s of %s: %s %s" % (i + 1, len(tasks), root, "done" if error is None else "FAILED"))
+
+    if ncpus > 1 and len(tasks) > 1:
+
+        pool = multiprocessing.Pool(ncpus)
+
+        try:
+
+            # The results are recorded as they come, so an interruption loses only the ROIs in progress
+            _record(pool.imap_unordered(_make_table, tasks))
+
+        finally:
+
+            pool.close()
+            pool.join()
 
-for i,sim in enumerate(simulations):      
-    
-    print("\n\n%s of %s" %(i+1, len(simulations)))
-    
-    ft1 = ROIBackgroundEstimator.myFT1File(sim)
-    
-    if os.path.exists(ROIBackgroundEstimator.get_theta_lookup_file(ft1.ra, ft1.dec)):
-        
-        continue
-    
     else:
-    
-       dbkge = ROIBackgroundEstimator.ROIBackgroundEstimatorDataMaker(sim, '3fgl_36_months_ft2.fits')
-       dbkge.makeThetaHistogram()
-       
+
+        _record(map(_make_table, tasks))
+
+    failed = [root for root in roots if root in manifest.failed]
+
+    if len(failed) > 0:
+
+        raise RuntimeError("Could not make the lookup tables of %s ROIs (see the errors in %s): %s. Run again "
+                           "with the same working directory to retry them" % (len(failed), manifest.filename,
+                                                                             ", ".join(failed)))
+
+    ras = []
+    decs = []
+    tables = []
+
+    for root in roots:
+
+        data = numpy.load(_table_file(root))
+
+        ras.append(float(data['ra']))
+        decs.append(float(data['dec']))
+        tables.append((data['theta'], data['rate'], data['weights'], int(data['k']), float(data['s'])))
+
+    return write_lookup_table_archive(outfile, ras, decs, tables)
@@ -5,6 +5,8 @@ import subprocess
 
 # from fermi_blind_search.configuration import configuration
 from fermi_blind_search.configuration import get_config
+from fermi_blind_search.bkge.reference_rois import make_reference_data_spaces
+from fermi_blind_search.fits_handling.ft2_cache import make_ft2_cache, open_ft2_cache
 from scripts.ltfsearch import computeSpread
 
 from fermi_blind_search.fits_handling.fits_interface import pyfits
@@ -47,6 +49,29 @@ class ReferenceROIsMaker(object):
             
             raise IOError("File %s does not exist!" % (sim_ft2_file))
     
+    def make_data_spaces(self, directory='reference_rois', chunk_size=100000):
+        """
+        Make the data spaces of all the reference ROIs (see ROIBackgroundEstimatorDataMaker.from_data_space)
+        directly, reading the simulated FT1 file only once, instead of selecting the events of each ROI
+        with go
+
+        :return: the list of the files of the data spaces
+        """
+
+        configuration = get_config()
+
+        # The FT2 file is needed for each ROI, so it is read only once in a cache
+
+        ft2_cache = open_ft2_cache(make_ft2_cache(self.sim_ft2_file, os.path.join(directory, "__ft2_cache")))
+
+        # Same selection as go (no zenith cut, since we are using simulations)
+
+        return make_reference_data_spaces(self.sim_ft1_file, ft2_cache, self.ras, self.decs, self.radius,
+                                          float(configuration.get('Analysis', 'emin')),
+                                          float(configuration.get('Analysis', 'emax')),
+                                          evclass=self.evclass, evtype=3, directory=directory,
+                                          chunk_size=chunk_size)
+
     def go(self):
         
         #####################################################################
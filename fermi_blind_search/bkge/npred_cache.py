@@ -0,0 +1,249 @@
+"""
+Persistent cache of the background of the regions.
+
+In real time the same regions are analyzed again at every cycle, on windows which overlap the previous ones.
+The integral of the expected background is the same for a GTI which was already analyzed, as long as the
+spacecraft data around it, the lookup table and the cuts are the same. So the integral of each GTI is saved
+on disk, in one file for each region and set of cuts (see make_key), together with a digest of the
+spacecraft data it was computed from. A rerun only computes the GTIs which are not in the cache.
+
+The files least recently used are removed when the cache grows larger than its maximum size.
+"""
+
+import hashlib
+import json
+import os
+
+import numpy
+
+from fermi_blind_search.make_directory import make_dir_if_not_exist
+
+# Version of the content of the cache. Change it when the computation of the background changes, so that
+# the old entries are not used anymore
+_VERSION = 1
+
+# Default maximum size of the cache (bytes)
+DEFAULT_MAX_SIZE = 1024 ** 3
+
+
+def make_key(description):
+    """
+    Return the key of the cache for the given description (a dictionary with the position of the region,
+    the version of the lookup table, the cuts...)
+    """
+
+    description = dict(description, version=_VERSION)
+
+    return hashlib.md5(json.dumps(description, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def get_digest(*arrays):
+    """
+    Return a digest of the given arrays
+    """
+
+    md5 = hashlib.md5()
+
+    for array in arrays:
+
+        md5.update(numpy.ascontiguousarray(array, dtype=float).tobytes())
+
+    return md5.hexdigest()
+
+
+class NpredCache(object):
+    """
+    A directory containing the integral of the expected background of the GTIs of each region.
+
+    :param directory: the directory of the cache (created if needed)
+    :param max_size: maximum total size (in bytes) of the files of the cache
+    """
+
+    def __init__(self, directory, max_size=DEFAULT_MAX_SIZE):
+
+        self.directory = os.path.abspath(directory)
+        self.max_size = int(max_size)
+
+        make_dir_if_not_exist(self.directory)
+
+    def _get_filename(self, key):
+
+        return os.path.join(self.directory, "%s.npz" % key)
+
+    def _read(self, key):
+
+        filename = self._get_filename(key)
+
+        try:
+
+            with numpy.load(filename) as npzfile:
+
+                data = dict((name, npzfile[name]) for name in npzfile.files)
+
+        except (IOError, OSError, ValueError):
+
+            # Not in the cache, or removed (or being written) by another process
+            return None
+
+        # Mark the file as recently used
+        try:
+
+            os.utime(filename, None)
+
+        except OSError:
+
+            pass
+
+        return data
+
+    def get(self, key, gti_starts, gti_stops, digests):
+        """
+        Return the integral of each of the given GTIs, or None for the GTIs which are not in the cache
+
+        :param key: the key for the region (see make_key)
+        :param gti_starts: start of the GTIs
+        :param gti_stops: stop of the GTIs
+        :param digests: digest of the spacecraft data used for each GTI (see get_digest)
+        :return: a list with (knots, integral) or None for each GTI
+        """
+
+        segments = [None] * len(digests)
+
+        data = self._read(key)
+
+        if data is None:
+
+            return segments
+
+        bounds = numpy.concatenate([[0], numpy.cumsum(data['n_knots'])])
+
+        entries = dict(((start, stop, str(digest)), i) for i, (start, stop, digest) in
+                       enumerate(zip(data['start'], data['stop'], data['digest'])))
+
+        for j, (start, stop, digest) in enumerate(zip(gti_starts, gti_stops, digests)):
+
+            i = entries.get((start, stop, digest))
+
+            if i is not None:
+
+                segments[j] = (data['knots'][bounds[i]:bounds[i + 1]], data['integral'][bounds[i]:bounds[i + 1]])
+
+        return segments
+
+    def put(self, key, gti_starts, gti_stops, digests, segments):
+        """
+        Add the integral of the given GTIs to the cache. The GTIs already in the cache which overlap them
+        are replaced.
+
+        :param key: the key for the region (see make_key)
+        :param gti_starts: start of the GTIs
+        :param gti_stops: stop of the GTIs
+        :param digests: digest of the spacecraft data used for each GTI (see get_digest)
+        :param segments: (knots, integral) for each GTI
+        """
+
+        gti_starts = numpy.asarray(gti_starts, dtype=float)
+        gti_stops = numpy.asarray(gti_stops, dtype=float)
+
+        starts = list(gti_starts)
+        stops = list(gti_stops)
+        digests = list(digests)
+        segments = list(segments)
+
+        data = self._read(key)
+
+        if data is not None:
+
+            bounds = numpy.concatenate([[0], numpy.cumsum(data['n_knots'])])
+
+            for i, (start, stop, digest) in enumerate(zip(data['start'], data['stop'], data['digest'])):
+
+                # Keep the old GTIs which do not overlap the new ones (for example, a GTI cut at the end
+                # of the previous window is replaced by the complete GTI)
+                if numpy.any((gti_starts < stop) & (gti_stops > start)):
+
+                    continue
+
+                starts.append(start)
+                stops.append(stop)
+                digests.append(str(digest))
+                segments.append((data['knots'][bounds[i]:bounds[i + 1]], data['integral'][bounds[i]:bounds[i + 1]]))
+
+        idx = numpy.argsort(starts, kind='mergesort')
+
+        filename = self._get_filename(key)
+
+        # Write in a temporary file first, so that other processes never read an incomplete file
+        tmp_filename = "%s.tmp%s" % (filename, os.getpid())
+
+        with open(tmp_filename, "wb") as f:
+
+            numpy.savez(f,
+                        start=numpy.array(starts)[idx],
+                        stop=numpy.array(stops)[idx],
+                        digest=numpy.array(digests)[idx],
+                        n_knots=numpy.array([segments[i][0].shape[0] for i in idx], dtype=int),
+                        knots=numpy.concatenate([segments[i][0] for i in idx]),
+                        integral=numpy.concatenate([segments[i][1] for i in idx]))
+
+        os.rename(tmp_filename, filename)
+
+        self.evict()
+
+    def get_size(self):
+        """
+        Return the total size of the files of the cache (bytes)
+        """
+
+        return sum([size for _, size, _ in self._list_files()])
+
+    def _list_files(self):
+
+        files = []
+
+        for name in os.listdir(self.directory):
+
+            if not name.endswith(".npz"):
+
+                continue
+
+            path = os.path.join(self.directory, name)
+
+            try:
+
+                stat = os.stat(path)
+
+            except OSError:
+
+                # Removed by another process
+                continue
+
+            files.append((path, stat.st_size, stat.st_mtime))
+
+        return files
+
+    def evict(self):
+        """
+        Remove the files least recently used until the size of the cache is below its maximum size
+        """
+
+        files = self._list_files()
+
+        total = sum([size for _, size, _ in files])
+
+        # Least recently used first
+        for path, size, _ in sorted(files, key=lambda x: x[2]):
+
+            if total <= self.max_size:
+
+                break
+
+            try:
+
+                os.remove(path)
+
+            except OSError:
+
+                pass
+
+            total -= size
@@ -0,0 +1,185 @@
+"""
+Data spaces of all the reference ROIs in one pass over the simulated FT1 file.
+
+Instead of selecting the events of each reference ROI from the simulation separately (see
+make_reference_rois.ReferenceROIsMaker.go, which reads the whole simulation once per ROI), the simulation is
+read once in chunks. The events of each chunk are assigned to all the ROIs containing them through a
+spatial index, and their arrival times are appended to one file per ROI. Then the data space of each ROI
+(see data_space.DataSpace) is made from its own events only, and saved where
+ROIBackgroundEstimatorDataMaker looks for it.
+"""
+
+import os
+
+import numpy
+
+from fermi_blind_search.bkge.data_space import DEFAULT_CHUNK_SIZE, DataSpace, iterate_events
+from fermi_blind_search.make_directory import make_dir_if_not_exist
+from fermi_blind_search.sky_index import SkyIndex
+
+_EVENT_COLUMNS = ('TIME', 'RA', 'DEC', 'ENERGY', 'EVENT_CLASS', 'EVENT_TYPE')
+
+
+def get_root(ra, dec):
+    """
+    Return the root of the names of the files of the reference ROI centered on ra, dec (the same as the FT1
+    files made by ReferenceROIsMaker.go)
+    """
+
+    return "ra%.3f-dec%.3f_ref" % (ra, dec)
+
+
+def _bits(column):
+
+    # Bit columns can be read as integers or as arrays of booleans (most significant bit first)
+    column = numpy.asarray(column)
+
+    if column.ndim == 2:
+
+        return numpy.dot(column.astype(numpy.int64), 2 ** numpy.arange(column.shape[1] - 1, -1, -1))
+
+    return column.astype(numpy.int64)
+
+
+def select_events(events, emin, emax, evclass, evtype):
+    """
+    Return a boolean mask of the events passing the same cuts as gtselect, apart from the ROI
+
+    :param events: a dictionary with the ENERGY, EVENT_CLASS and EVENT_TYPE columns
+    :param emin: minimum energy (MeV)
+    :param emax: maximum energy (MeV)
+    :param evclass: event class (bit mask, as for gtselect)
+    :param evtype: event type (bit mask, as for gtselect)
+    """
+
+    return ((events['ENERGY'] >= emin) & (events['ENERGY'] <= emax) &
+            ((_bits(events['EVENT_CLASS']) & int(evclass)) != 0) &
+            ((_bits(events['EVENT_TYPE']) & int(evtype)) != 0))
+
+
+class ReferenceEvents(object):
+    """
+    The arrival times of the events of all the reference ROIs, saved in one file per ROI in the given
+    directory
+
+    :param ras: R.A. of the centers of the ROIs
+    :param decs: Dec. of the centers of the ROIs
+    :param radius: radius of the ROIs (deg)
+    :param directory: where to save the files (created if needed)
+    """
+
+    def __init__(self, ras, decs, radius, directory):
+
+        self.ras = numpy.asarray(ras, dtype=float)
+        self.decs = numpy.asarray(decs, dtype=float)
+        self.radius = float(radius)
+        self.directory = os.path.abspath(directory)
+
+        make_dir_if_not_exist(self.directory)
+
+        # Start from empty files
+        for i in range(self.ras.shape[0]):
+
+            open(self.get_times_file(i), "wb").close()
+
+    def get_times_file(self, i):
+
+        return os.path.join(self.directory, "%s_times.bin" % get_root(self.ras[i], self.decs[i]))
+
+    def add_events(self, times, ras, decs):
+        """
+        Append the given events to the files of all the ROIs containing them
+        """
+
+        if len(times) == 0:
+
+            return
+
+        times = numpy.asarray(times, dtype='<f8')
+
+        index = SkyIndex(ras, decs)
+
+        for i, members in enumerate(index.query_radius(self.ras, self.decs, self.radius)):
+
+            if len(members) == 0:
+
+                continue
+
+            with open(self.get_times_file(i), "ab") as f:
+
+                times[members].tofile(f)
+
+    def get_times(self, i):
+        """
+        Return the arrival times of the events of the i-th ROI
+        """
+
+        return numpy.fromfile(self.get_times_file(i), dtype='<f8')
+
+
+def make_reference_data_spaces(sim_ft1_file, ft2, ras, decs, radius, emin, emax, evclass=128, evtype=3,
+                               directory='reference_rois', chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Make the data space of each reference ROI reading the simulated FT1 file only once.
+
+    The data space of each ROI is saved in <directory>/<root>_lookup.npz (see get_root), with the
+    position and the radius of the ROI. ROIBackgroundEstimatorDataMaker.from_data_space reads it.
+
+    :param sim_ft1_file: the simulated FT1 file
+    :param ft2: the FT2 file of the simulation, or a FT2Cache (much faster, as the FT2 is read for each ROI)
+    :param ras: R.A. of the centers of the ROIs
+    :param decs: Dec. of the centers of the ROIs
+    :param radius: radius of the ROIs (deg)
+    :param emin: minimum energy (MeV)
+    :param emax: maximum energy (MeV)
+    :param evclass: event class (as for gtselect)
+    :param evtype: event type (as for gtselect)
+    :param directory: output directory
+    :param chunk_size: number of rows read at once from the FT1 and the FT2 files
+    :return: the list of the files of the data spaces
+    """
+
+    import fitsio
+
+    header = fitsio.read_header(sim_ft1_file, 'EVENTS')
+
+    tstart = float(header['TSTART'])
+    tstop = float(header['TSTOP'])
+
+    reference_events = ReferenceEvents(ras, decs, radius, directory)
+
+    n_events = 0
+
+    for events in iterate_events(sim_ft1_file, _EVENT_COLUMNS, chunk_size):
+
+        idx = select_events(events, emin, emax, evclass, evtype)
+
+        reference_events.add_events(events['TIME'][idx], events['RA'][idx], events['DEC'][idx])
+
+        n_events += events['TIME'].shape[0]
+
+        print("Processed %s events" % n_events)
+
+    outfiles = []
+
+    for i, (ra, dec) in enumerate(zip(reference_events.ras, reference_events.decs)):
+
+        print("\nMaking data space for ROI centered on (%.3f,%.3f) (%s out of %s)" % (ra, dec, i + 1,
+                                                                                      len(reference_events.ras)))
+
+        data_space = DataSpace(ra, dec, tstart, tstop, ft2, chunk_size)
+
+        n_outside = data_space.add_events(reference_events.get_times(i))
+
+        print("%s events, %s outside of the FT2 entries" % (data_space.counts.sum(), n_outside))
+
+        outfile = os.path.join(reference_events.directory, "%s_lookup.npz" % get_root(ra, dec))
+
+        numpy.savez(outfile, theta=data_space.theta, counts=data_space.counts, livetime=data_space.livetime,
+                    ra=ra, dec=dec, rad=reference_events.radius)
+
+        os.remove(reference_events.get_times_file(i))
+
+        outfiles.append(outfile)
+
+    return outfiles
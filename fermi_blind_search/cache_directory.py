@@ -0,0 +1,104 @@
+"""
+Directories of precomputed arrays shared by the processes of a run (the FT2 cache, the partition of the FT1
+file, the GTIs of the grid and the background cube).
+
+Each directory contains .npy files and a manifest, describing where the content comes from, so that a later
+run can reuse the directory if nothing has changed (see read_manifest). The directory is written in a
+temporary directory first and then renamed (see write_cache_directory), so that an interrupted run does not
+leave an incomplete directory behind. Each process opens a directory only once (see open_cache_directory),
+memory-mapping the arrays.
+"""
+
+import contextlib
+import json
+import os
+import shutil
+
+from fermi_blind_search.make_directory import make_dir_if_not_exist
+
+_MANIFEST = "manifest.json"
+
+# Directories already opened by this process, by class and directory
+_open_directories = {}
+
+
+def read_manifest(directory):
+    """
+    Return the manifest of the given directory, or None if the directory does not contain a complete cache
+    """
+
+    manifest = os.path.join(directory, _MANIFEST)
+
+    if not os.path.exists(manifest):
+
+        return None
+
+    with open(manifest) as f:
+
+        return json.load(f)
+
+
+@contextlib.contextmanager
+def write_cache_directory(directory, description):
+    """
+    Context manager returning a temporary directory where to write the content of the given directory. When
+    the block is completed, the manifest is written and the temporary directory replaces the directory (and
+    the instances opened by this process are forgotten). If the block raises, the temporary directory is
+    removed.
+
+    :param directory: the directory (it will be overwritten)
+    :param description: a dictionary describing where the content comes from, saved in the manifest
+    """
+
+    tmp_directory = "%s.tmp%s" % (directory, os.getpid())
+
+    if os.path.exists(tmp_directory):
+
+        shutil.rmtree(tmp_directory)
+
+    make_dir_if_not_exist(tmp_directory)
+
+    try:
+
+        yield tmp_directory
+
+        with open(os.path.join(tmp_directory, _MANIFEST), "w+") as f:
+
+            json.dump(description, f, indent=2, sort_keys=True)
+
+    except:
+
+        shutil.rmtree(tmp_directory, ignore_errors=True)
+
+        raise
+
+    if os.path.exists(directory):
+
+        shutil.rmtree(directory)
+
+    os.rename(tmp_directory, directory)
+
+    key = os.path.abspath(directory)
+
+    for cls, this_directory in list(_open_directories.keys()):
+
+        if this_directory == key:
+
+            _open_directories.pop((cls, this_directory))
+
+
+def open_cache_directory(directory, cls):
+    """
+    Return cls(directory), creating it only once per process for each directory
+
+    :param directory: the directory
+    :param cls: the class reading the directory (it receives the absolute path of the directory)
+    """
+
+    key = (cls, os.path.abspath(directory))
+
+    if key not in _open_directories:
+
+        _open_directories[key] = cls(key[1])
+
+    return _open_directories[key]
@@ -6,6 +6,7 @@ from astropy.io.fits import HDUList, PrimaryHDU, BinTableHDU
 import fitsio
 import numpy as np
 from fermi_blind_search.angular_distance import angular_distance_fast
+from fermi_blind_search.fits_handling.ft2_cache import merge_intervals
 
 
 def make_GTI_from_FT2(ft2filename, filter_expression, gti_filename, overwrite=True,
@@ -35,19 +36,14 @@ def make_GTI_from_FT2(ft2filename, filter_expression, gti_filename, overwrite=Tr
     idx = np.argsort(data['START'])
     data = data[idx]
 
-    start = data['START']
-    stop = data['STOP']
+    gti_starts, gti_stops = merge_intervals(data['START'], data['STOP'], force_start, force_stop)
 
-    gti_starts = np.sort(list(set(start) - set(stop)))
-    gti_stops = np.sort(list(set(stop) - set(start)))
+    write_GTI_file(gti_filename, gti_starts, gti_stops, overwrite)
 
-    assert len(gti_starts) == len(gti_stops)
+    return gti_starts, gti_stops
 
-    # Fix the global start and stop if required
-    if force_start is not None:
 
-        gti_starts[0] = max(gti_starts[0], force_start)
-        gti_stops[-1] = min(gti_stops[-1], force_stop)
+def write_GTI_file(gti_filename, gti_starts, gti_stops, overwrite=True):
 
     if os.path.exists(gti_filename):
 
@@ -66,8 +62,6 @@ def make_GTI_from_FT2(ft2filename, filter_expression, gti_filename, overwrite=Tr
         names = ['START', 'STOP']
         fits.write(array_list, names=names, extname='GTI')
 
-    return gti_starts, gti_stops
-
 
 def update_GTIs(fits_file, gti_starts, gti_stops):
 
@@ -82,12 +76,14 @@ def update_GTIs(fits_file, gti_starts, gti_stops):
 
 class FitsFile(object):
 
-    def __init__(self, filename, extension=None, filter_expr=None, cone=None):
+    def __init__(self, filename, extension=None, filter_expr=None, cone=None, rows=None):
 
-        # If there is a filter to be applied, get the indexes of the elements to keep
+        # If there is a filter to be applied, get the indexes of the elements to keep (or use the
+        # rows provided, for example from a FT1 partition)
         if extension is not None:
 
-            assert filter_expr is not None, "If you provide an extension, you also need to provide a filter for it"
+            assert filter_expr is not None or rows is not None, \
+                "If you provide an extension, you also need to provide a filter or the rows for it"
 
         # Make sure the file exists
         assert os.path.exists(filename), "%s does not exist" % filename
@@ -126,6 +122,14 @@ class FitsFile(object):
 
                         # This is the extension to be filtered
 
+                        if rows is not None:
+
+                            indexes_to_keep = np.sort(np.asarray(rows, dtype=np.int64))
+
+                            self._extensions[key] = BinTableHDU(f[ext_id].data[indexes_to_keep], f[ext_id].header)
+
+                            continue
+
                         with fitsio.FITS(filename, 'r') as fits:
 
                             indexes_to_keep = fits[extension].where(filter_expr)
@@ -0,0 +1,246 @@
+"""
+Partition of the events of the FT1 file among the ROIs of the search grid.
+
+The FT1 file is read once per run (see make_ft1_partition), in chunks: the events passing the energy and
+time cuts are assigned to all the ROIs whose cone contains them through a spatial index on the unit vectors.
+The row numbers of the events of each ROI are saved as .npy files in a directory, which each process
+memory-maps (see open_ft1_partition). So selecting the events of a ROI (see ltf.Selector) only reads its
+own rows from the FT1 file, instead of scanning the whole file.
+"""
+
+import hashlib
+import os
+
+import numpy as np
+
+from fermi_blind_search.cache_directory import open_cache_directory, read_manifest, write_cache_directory
+from fermi_blind_search.sky_index import SkyIndex
+
+# Number of rows read at once from the FT1 file
+DEFAULT_CHUNK_SIZE = 100000
+
+# Maximum distance (deg) between the center of a ROI and the center of the ROI of the partition used for it
+DEFAULT_TOLERANCE = 0.0001
+
+_COLUMNS = ('TIME', 'RA', 'DEC', 'ENERGY')
+
+
+def _describe_source(ft1filename, ras, decs, rad, emin, emax, tstart, tstop):
+
+    stat = os.stat(ft1filename)
+
+    grid = hashlib.md5(np.asarray(ras, dtype=float).tobytes() + np.asarray(decs, dtype=float).tobytes())
+
+    return {'ft1': os.path.abspath(ft1filename), 'size': stat.st_size, 'mtime': stat.st_mtime,
+            'grid': grid.hexdigest(), 'rad': float(rad), 'emin': float(emin), 'emax': float(emax),
+            'tstart': float(tstart), 'tstop': float(tstop)}
+
+
+def partition_events(ras, decs, rad, chunks):
+    """
+    Assign the events to the ROIs containing them
+
+    :param ras: R.A. of the centers of the ROIs
+    :param decs: Dec. of the centers of the ROIs
+    :param rad: radius of the ROIs (deg)
+    :param chunks: an iterable of (row numbers, R.A., Dec.) of the events, as read from the FT1 file
+    :return: (the sorted row numbers of the events of all the ROIs, one after the other, and the offsets of
+    each ROI in them, so that the rows of the i-th ROI are rows[offsets[i]:offsets[i + 1]])
+    """
+
+    n_rois = len(ras)
+
+    rows_per_roi = [[] for _ in range(n_rois)]
+
+    for rows, event_ras, event_decs in chunks:
+
+        if len(rows) == 0:
+
+            continue
+
+        rows = np.asarray(rows, dtype=np.int64)
+
+        index = SkyIndex(event_ras, event_decs)
+
+        for i, members in enumerate(index.query_radius(ras, decs, rad)):
+
+            if len(members) > 0:
+
+                rows_per_roi[i].append(rows[members])
+
+    counts = [sum([x.shape[0] for x in roi_rows]) for roi_rows in rows_per_roi]
+
+    offsets = np.zeros(n_rois + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(counts)
+
+    all_rows = np.zeros(offsets[-1], dtype=np.int64)
+
+    for i, roi_rows in enumerate(rows_per_roi):
+
+        if len(roi_rows) > 0:
+
+            all_rows[offsets[i]:offsets[i + 1]] = np.sort(np.concatenate(roi_rows))
+
+    return all_rows, offsets
+
+
+def write_ft1_partition(ras, decs, rows, offsets, directory, source=None):
+    """
+    Save the partition of the events (see partition_events) in the given directory
+
+    :param ras: R.A. of the centers of the ROIs
+    :param decs: Dec. of the centers of the ROIs
+    :param rows: the row numbers of the events of all the ROIs
+    :param offsets: the offset of each ROI in rows
+    :param directory: the partition directory (it will be overwritten)
+    :param source: a dictionary describing where the partition comes from, saved in the manifest
+    :return: the partition directory
+    """
+
+    with write_cache_directory(directory, source if source is not None else {}) as tmp_directory:
+
+        np.save(os.path.join(tmp_directory, "ra.npy"), np.asarray(ras, dtype=float))
+        np.save(os.path.join(tmp_directory, "dec.npy"), np.asarray(decs, dtype=float))
+        np.save(os.path.join(tmp_directory, "rows.npy"), np.asarray(rows, dtype=np.int64))
+        np.save(os.path.join(tmp_directory, "offsets.npy"), np.asarray(offsets, dtype=np.int64))
+
+    return directory
+
+
+def make_ft1_partition(ft1filename, ras, decs, rad, emin, emax, tstart, tstop, directory,
+                       chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Partition the events of the FT1 file within emin - emax and tstart - tstop among the given ROIs, reading
+    the file only once, unless the directory already contains the partition of the same file with the same
+    ROIs and cuts.
+
+    :return: the partition directory
+    """
+
+    source = _describe_source(ft1filename, ras, decs, rad, emin, emax, tstart, tstop)
+
+    if read_manifest(directory) == source:
+
+        return directory
+
+    import fitsio
+
+    def _chunks():
+
+        with fitsio.FITS(ft1filename, 'r') as fits:
+
+            hdu = fits['EVENTS']
+
+            n_rows = hdu.get_nrows()
+
+            for i1 in range(0, n_rows, chunk_size):
+
+                data = hdu.read(columns=list(_COLUMNS), rows=np.arange(i1, min(i1 + chunk_size, n_rows)))
+
+                # Same cuts as the energy and time filters of ltf.Selector
+                idx = ((data['ENERGY'] >= emin) & (data['ENERGY'] <= emax) &
+                       (data['TIME'] >= tstart) & (data['TIME'] <= tstop))
+
+                yield i1 + np.flatnonzero(idx), data['RA'][idx], data['DEC'][idx]
+
+    rows, offsets = partition_events(ras, decs, rad, _chunks())
+
+    return write_ft1_partition(ras, decs, rows, offsets, directory, source)
+
+
+class FT1Partition(object):
+
+    def __init__(self, directory, tolerance=DEFAULT_TOLERANCE):
+
+        if read_manifest(directory) is None:
+
+            raise IOError("%s does not contain a FT1 partition" % directory)
+
+        self.directory = directory
+        self.tolerance = float(tolerance)
+
+        self._ras = np.load(os.path.join(directory, "ra.npy"))
+        self._decs = np.load(os.path.join(directory, "dec.npy"))
+        self._offsets = np.load(os.path.join(directory, "offsets.npy"))
+
+        # Memory-map the rows (read-only, so each process reads only the rows of its ROIs)
+        self._rows = np.load(os.path.join(directory, "rows.npy"), mmap_mode='r')
+
+        self._index = SkyIndex(self._ras, self._decs)
+
+    def __len__(self):
+
+        return self._ras.shape[0]
+
+    def get_source(self):
+        """
+        Return the description of the FT1 file and of the cuts the partition was made with
+        """
+
+        return read_manifest(self.directory)
+
+    def get_rows(self, ra, dec):
+        """
+        Return the (sorted) row numbers in the FT1 file of the events of the ROI centered on ra, dec, or None
+        if the ROI is not in the partition
+        """
+
+        index, distance = self._index.query(ra, dec)
+
+        if distance > self.tolerance:
+
+            return None
+
+        return np.array(self._rows[self._offsets[index]:self._offsets[index + 1]])
+
+
+def open_ft1_partition(directory):
+    """
+    Return the FT1Partition for the given directory. Each directory is opened only once per process.
+    """
+
+    return open_cache_directory(directory, FT1Partition)
+
+
+def in_gtis(times, gti_starts, gti_stops):
+    """
+    Return a boolean mask of the times within the GTIs (sorted and not overlapping), like gtifilter
+    """
+
+    times = np.asarray(times)
+
+    idx = np.searchsorted(gti_starts, times, side='right') - 1
+
+    inside = (idx >= 0)
+    inside[inside] = times[inside] <= np.asarray(gti_stops)[idx[inside]]
+
+    return inside
+
+
+def select_rows(ft1filename, rows, tstart, tstop, gti_starts, gti_stops):
+    """
+    Return the rows (among the given ones) of the events within tstart - tstop, the given GTIs and the GTIs
+    of the FT1 file, the same selection as the time and GTI filters of ltf.Selector
+    """
+
+    import fitsio
+
+    rows = np.asarray(rows, dtype=np.int64)
+
+    with fitsio.FITS(ft1filename, 'r') as fits:
+
+        gti = fits['GTI'].read(columns=['START', 'STOP'])
+
+        if rows.shape[0] == 0:
+
+            return rows
+
+        times = fits['EVENTS'].read(columns=['TIME'], rows=rows)['TIME']
+
+    ft1_order = np.argsort(gti['START'], kind='mergesort')
+
+    keep = ((times >= tstart) & (times <= tstop) &
+            in_gtis(times, np.asarray(gti_starts), np.asarray(gti_stops)) &
+            in_gtis(times, gti['START'][ft1_order], gti['STOP'][ft1_order]))
+
+    return rows[keep]
@@ -0,0 +1,312 @@
+"""
+Columnar cache of the FT2 file.
+
+The FT2 file is read once per run (see make_ft2_cache) and its columns are saved, sorted by time, as
+.npy files in a directory. Each process then memory-maps them (see open_ft2_cache), so the pages are
+shared among all the processes through the page cache, and analyzing a ROI requires no FT2 I/O.
+"""
+
+import os
+
+import numpy as np
+
+from fermi_blind_search.angular_distance import unit_vectors
+from fermi_blind_search.cache_directory import open_cache_directory, read_manifest, write_cache_directory
+
+# Columns of the SC_DATA extension stored in the cache
+COLUMNS = ('START', 'STOP', 'RA_SCZ', 'DEC_SCZ', 'RA_ZENITH', 'DEC_ZENITH', 'LIVETIME',
+           'DATA_QUAL', 'LAT_CONFIG', 'IN_SAA')
+
+# Maximum number of elements (entries x ROIs) of the masks computed at once by FT2Cache.get_all_gtis
+DEFAULT_MASK_SIZE = 10000000
+
+
+def _describe_source(ft2filename):
+
+    stat = os.stat(ft2filename)
+
+    return {'ft2': os.path.abspath(ft2filename), 'size': stat.st_size, 'mtime': stat.st_mtime,
+            'columns': list(COLUMNS)}
+
+
+def write_ft2_cache(columns, directory, source=None):
+    """
+    Save the given columns (a dictionary name -> array, or a record array) in the cache directory,
+    sorted by START time.
+
+    :param columns: the FT2 columns
+    :param directory: the cache directory (it will be overwritten)
+    :param source: a dictionary describing where the columns come from, saved in the manifest
+    :return: the cache directory
+    """
+
+    idx = np.argsort(columns['START'], kind='mergesort')
+
+    with write_cache_directory(directory, source if source is not None else {}) as tmp_directory:
+
+        for name in COLUMNS:
+
+            # Make sure the data is native-endian, as FITS data is big-endian
+            data = np.asarray(columns[name])[idx]
+
+            data = data.astype(data.dtype.newbyteorder('='))
+
+            np.save(os.path.join(tmp_directory, "%s.npy" % name), data)
+
+    return directory
+
+
+def make_ft2_cache(ft2filename, directory):
+    """
+    Build the cache of the FT2 file in the given directory, unless it already contains the cache of the
+    same file (same path, size and modification time).
+
+    :return: the cache directory
+    """
+
+    source = _describe_source(ft2filename)
+
+    if read_manifest(directory) == source:
+
+        return directory
+
+    import fitsio
+
+    with fitsio.FITS(ft2filename, 'r') as fits:
+
+        data = fits['SC_DATA'].read(columns=list(COLUMNS))
+
+    return write_ft2_cache(data, directory, source)
+
+
+def open_ft2_cache(directory):
+    """
+    Return the FT2Cache for the given cache directory. Each directory is opened only once per process.
+    """
+
+    return open_cache_directory(directory, FT2Cache)
+
+
+class FT2Cache(object):
+
+    def __init__(self, directory):
+
+        if read_manifest(directory) is None:
+
+            raise IOError("%s does not contain a FT2 cache" % directory)
+
+        self.directory = directory
+
+        # Memory-map the columns (read-only, so nothing is copied)
+        self._columns = {}
+
+        for name in COLUMNS:
+
+            self._columns[name] = np.load(os.path.join(directory, "%s.npy" % name), mmap_mode='r')
+
+    def get_source(self):
+        """
+        Return the description of the FT2 file the cache was built from
+        """
+
+        return read_manifest(self.directory)
+
+    def __getitem__(self, item):
+
+        return self._columns[item]
+
+    def __len__(self):
+
+        return self._columns['START'].shape[0]
+
+    def get_slice(self, tstart, tstop):
+        """
+        Return the slice of the entries overlapping the interval tstart - tstop
+        """
+
+        # The entries do not overlap, so both START and STOP are sorted
+        i1 = np.searchsorted(self._columns['STOP'], tstart, side='left')
+        i2 = np.searchsorted(self._columns['START'], tstop, side='left')
+
+        return slice(i1, max(i1, i2))
+
+    def get_good_entries(self, rows=slice(None)):
+        """
+        Return a boolean mask of the entries (within the given slice) with good data quality, nominal
+        configuration, outside of the SAA and with livetime > 0
+        """
+
+        data_qual = self._columns['DATA_QUAL'][rows]
+
+        return (((data_qual > 0) | (data_qual == -1)) &
+                (self._columns['LAT_CONFIG'][rows] == 1) &
+                (~self._columns['IN_SAA'][rows].astype(bool)) &
+                (self._columns['LIVETIME'][rows] > 0))
+
+    def get_gtis(self, ra, dec, zmax, thetamax, rad, tstart=None, tstop=None):
+        """
+        Return the GTIs for a ROI, with the same selection as the filter used by ltf.Selector with
+        make_GTI_from_FT2: good data quality, nominal configuration, outside of the SAA, livetime > 0,
+        and the whole ROI within zmax from the zenith and within thetamax from the LAT boresight.
+
+        :return: (gti_starts, gti_stops)
+        """
+
+        return self.get_all_gtis([ra], [dec], zmax, thetamax, rad, tstart, tstop)[0]
+
+    def get_all_gtis(self, ras, decs, zmax, thetamax, rad, tstart=None, tstop=None, mask_size=DEFAULT_MASK_SIZE):
+        """
+        Return the GTIs for many ROIs at once (see get_gtis). The selection of all the entries for all the
+        ROIs is computed as boolean masks, a block of ROIs at a time, with dot products of unit vectors.
+
+        :param mask_size: maximum number of elements (entries x ROIs) of the masks computed at once
+        :return: a list with (gti_starts, gti_stops) for each ROI
+        """
+
+        if tstart is not None:
+
+            assert tstop is not None
+
+            # Same as (STOP >= tstart) && (START <= tstop)
+            i1 = np.searchsorted(self._columns['STOP'], tstart, side='left')
+            i2 = np.searchsorted(self._columns['START'], tstop, side='right')
+
+            rows = slice(i1, max(i1, i2))
+
+        else:
+
+            rows = slice(None)
+
+        start = self._columns['START'][rows]
+        stop = self._columns['STOP'][rows]
+
+        if start.shape[0] == 0:
+
+            return [([], []) for _ in range(len(ras))]
+
+        good = self.get_good_entries(rows)
+
+        zenith_vectors = unit_vectors(self._columns['RA_ZENITH'][rows], self._columns['DEC_ZENITH'][rows])
+        scz_vectors = unit_vectors(self._columns['RA_SCZ'][rows], self._columns['DEC_SCZ'][rows])
+
+        roi_vectors = unit_vectors(ras, decs)
+
+        # The angle is <= the limit if the cosine is >= the cosine of the limit
+        cos_zmax = _cos_limit(zmax - rad)
+        cos_thetamax = _cos_limit(thetamax - rad)
+
+        n_rois = max(1, int(mask_size) // start.shape[0])
+
+        gtis = []
+
+        for j1 in range(0, roi_vectors.shape[0], n_rois):
+
+            these_vectors = roi_vectors[j1:j1 + n_rois].T
+
+            # Entries (rows) x ROIs (columns)
+            mask = (good[:, np.newaxis] &
+                    (np.dot(zenith_vectors, these_vectors) >= cos_zmax) &
+                    (np.dot(scz_vectors, these_vectors) >= cos_thetamax))
+
+            gtis.extend(mask_to_gtis(start, stop, mask, tstart, tstop))
+
+        return gtis
+
+
+def _cos_limit(angle):
+
+    if angle < 0:
+
+        # Nothing is selected
+        return 2.0
+
+    if angle >= 180:
+
+        # Everything is selected
+        return -2.0
+
+    return np.cos(np.deg2rad(angle))
+
+
+def mask_to_gtis(start, stop, mask, force_start=None, force_stop=None):
+    """
+    Turn the selected entries into GTIs, merging contiguous entries (the stop of one equal to the start of
+    the next), optionally clipping the first and the last GTI to force_start and force_stop
+
+    :param start: start of the entries (sorted, not overlapping)
+    :param stop: stop of the entries
+    :param mask: boolean mask of the selected entries, or a 2d array with one mask per column
+    :return: (gti_starts, gti_stops), or a list of them for each column if mask is 2d
+    """
+
+    start = np.asarray(start)
+    stop = np.asarray(stop)
+    mask = np.asarray(mask, dtype=bool)
+
+    one_dimensional = (mask.ndim == 1)
+
+    if one_dimensional:
+
+        mask = mask[:, np.newaxis]
+
+    n_columns = mask.shape[1]
+
+    # Runs of selected entries, from the changes of the mask (+1 at the beginning of each run, -1 just after
+    # its end), also broken where there is a gap between two entries
+    padded = np.zeros((mask.shape[0] + 2, n_columns), dtype=np.int8)
+    padded[1:-1] = mask
+
+    changes = np.diff(padded, axis=0)
+
+    gap = np.zeros(mask.shape[0] + 1, dtype=bool)
+    gap[1:-1] = start[1:] != stop[:-1]
+
+    begins = (changes[:-1] == 1) | (mask & gap[:-1, np.newaxis])
+    ends = (changes[1:] == -1) | (mask & gap[1:, np.newaxis])
+
+    # Row numbers of the beginnings and of the ends, column by column
+    begin_columns, begin_rows = np.nonzero(begins.T)
+    end_rows = np.nonzero(ends.T)[1]
+
+    splits = np.cumsum(np.bincount(begin_columns, minlength=n_columns))[:-1]
+
+    gtis = []
+
+    for these_begins, these_ends in zip(np.split(begin_rows, splits), np.split(end_rows, splits)):
+
+        if these_begins.shape[0] == 0:
+
+            gtis.append(([], []))
+
+            continue
+
+        gti_starts = start[these_begins].copy()
+        gti_stops = stop[these_ends].copy()
+
+        # Fix the global start and stop if required
+        if force_start is not None:
+
+            gti_starts[0] = max(gti_starts[0], force_start)
+            gti_stops[-1] = min(gti_stops[-1], force_stop)
+
+        gtis.append((gti_starts, gti_stops))
+
+    return gtis[0] if one_dimensional else gtis
+
+
+def merge_intervals(start, stop, force_start=None, force_stop=None):
+    """
+    Merge contiguous intervals (the stop of one equal to the start of the next) into GTIs, optionally
+    clipping the first and the last one to force_start and force_stop
+
+    :return: (gti_starts, gti_stops)
+    """
+
+    if len(start) == 0:
+
+        return [], []
+
+    idx = np.argsort(start, kind='mergesort')
+
+    return mask_to_gtis(np.asarray(start)[idx], np.asarray(stop)[idx], np.ones(len(start), dtype=bool),
+                        force_start, force_stop)
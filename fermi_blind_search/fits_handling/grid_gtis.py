@@ -0,0 +1,150 @@
+"""
+GTIs of all the ROIs of the search grid.
+
+Instead of selecting the FT2 entries separately for each ROI (see make_GTI_from_FT2, which makes cfitsio
+parse the filter and scan the FT2 file for each ROI), the GTIs of all the ROIs are computed at once from the
+FT2 cache (see FT2Cache.get_all_gtis) and saved as .npy files in a directory (see make_grid_gtis), which
+the processes memory-map (see open_grid_gtis).
+"""
+
+import hashlib
+import os
+
+import numpy as np
+
+from fermi_blind_search.cache_directory import open_cache_directory, read_manifest, write_cache_directory
+from fermi_blind_search.fits_handling.ft2_cache import open_ft2_cache
+from fermi_blind_search.sky_index import SkyIndex
+
+# Maximum distance (deg) between the center of a ROI and the center of the ROI of the grid used for it
+DEFAULT_TOLERANCE = 0.0001
+
+
+def write_grid_gtis(ras, decs, gtis, directory, source=None):
+    """
+    Save the GTIs of the ROIs in the given directory
+
+    :param ras: R.A. of the centers of the ROIs
+    :param decs: Dec. of the centers of the ROIs
+    :param gtis: (gti_starts, gti_stops) for each ROI
+    :param directory: the directory (it will be overwritten)
+    :param source: a dictionary describing where the GTIs come from, saved in the manifest
+    :return: the directory
+    """
+
+    offsets = np.zeros(len(gtis) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(gti_starts) for gti_starts, _ in gtis])
+
+    gti_starts = np.zeros(offsets[-1])
+    gti_stops = np.zeros(offsets[-1])
+
+    for i, (these_starts, these_stops) in enumerate(gtis):
+
+        gti_starts[offsets[i]:offsets[i + 1]] = these_starts
+        gti_stops[offsets[i]:offsets[i + 1]] = these_stops
+
+    with write_cache_directory(directory, source if source is not None else {}) as tmp_directory:
+
+        np.save(os.path.join(tmp_directory, "ra.npy"), np.asarray(ras, dtype=float))
+        np.save(os.path.join(tmp_directory, "dec.npy"), np.asarray(decs, dtype=float))
+        np.save(os.path.join(tmp_directory, "gti_starts.npy"), gti_starts)
+        np.save(os.path.join(tmp_directory, "gti_stops.npy"), gti_stops)
+        np.save(os.path.join(tmp_directory, "offsets.npy"), offsets)
+
+    return directory
+
+
+def make_grid_gtis(ft2_cache_dir, ras, decs, zmax, thetamax, rad, tstart, tstop, directory):
+    """
+    Compute the GTIs of all the given ROIs within tstart - tstop from the FT2 cache (see FT2Cache.get_gtis for
+    the selection), unless the directory already contains the GTIs for the same FT2 file, ROIs and cuts.
+
+    :return: the directory
+    """
+
+    ft2 = open_ft2_cache(ft2_cache_dir)
+
+    grid = hashlib.md5(np.asarray(ras, dtype=float).tobytes() + np.asarray(decs, dtype=float).tobytes())
+
+    source = {'ft2': ft2.get_source(), 'grid': grid.hexdigest(), 'zmax': float(zmax),
+              'thetamax': float(thetamax), 'rad': float(rad), 'tstart': float(tstart), 'tstop': float(tstop)}
+
+    if read_manifest(directory) == source:
+
+        return directory
+
+    gtis = ft2.get_all_gtis(ras, decs, zmax, thetamax, rad, tstart, tstop)
+
+    return write_grid_gtis(ras, decs, gtis, directory, source)
+
+
+class GridGTIs(object):
+
+    def __init__(self, directory, tolerance=DEFAULT_TOLERANCE):
+
+        if read_manifest(directory) is None:
+
+            raise IOError("%s does not contain the GTIs of a grid" % directory)
+
+        self.directory = directory
+        self.tolerance = float(tolerance)
+
+        self._ras = np.load(os.path.join(directory, "ra.npy"))
+        self._decs = np.load(os.path.join(directory, "dec.npy"))
+        self._offsets = np.load(os.path.join(directory, "offsets.npy"))
+
+        # Memory-map the GTIs (read-only, so nothing is copied)
+        self._gti_starts = np.load(os.path.join(directory, "gti_starts.npy"), mmap_mode='r')
+        self._gti_stops = np.load(os.path.join(directory, "gti_stops.npy"), mmap_mode='r')
+
+        self._index = SkyIndex(self._ras, self._decs)
+
+    def __len__(self):
+
+        return self._ras.shape[0]
+
+    def get_gtis(self, ra, dec, tstart=None, tstop=None):
+        """
+        Return the GTIs of the ROI centered on ra, dec, or None if the ROI is not in the grid. If tstart and
+        tstop are given, only the GTIs overlapping tstart - tstop are returned, the first and the last one
+        clipped to it (as FT2Cache.get_gtis does).
+
+        :return: (gti_starts, gti_stops)
+        """
+
+        index, distance = self._index.query(ra, dec)
+
+        if distance > self.tolerance:
+
+            return None
+
+        gti_starts = np.array(self._gti_starts[self._offsets[index]:self._offsets[index + 1]])
+        gti_stops = np.array(self._gti_stops[self._offsets[index]:self._offsets[index + 1]])
+
+        if tstart is not None:
+
+            assert tstop is not None
+
+            idx = (gti_stops >= tstart) & (gti_starts <= tstop)
+
+            gti_starts = gti_starts[idx]
+            gti_stops = gti_stops[idx]
+
+            if gti_starts.shape[0] > 0:
+
+                gti_starts[0] = max(gti_starts[0], tstart)
+                gti_stops[-1] = min(gti_stops[-1], tstop)
+
+        if gti_starts.shape[0] == 0:
+
+            return [], []
+
+        return gti_starts, gti_stops
+
+
+def open_grid_gtis(directory):
+    """
+    Return the GridGTIs for the given directory. Each directory is opened only once per process.
+    """
+
+    return open_cache_directory(directory, GridGTIs)
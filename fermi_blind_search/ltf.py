@@ -31,8 +31,14 @@ from fermi_blind_search.configuration import get_config
 from fermi_blind_search.ltfException import ltfException
 from fermi_blind_search.SkyDir import SkyDir
 from fermi_blind_search.bkge import ROIBackgroundEstimator
-from fermi_blind_search.fits_handling.fits import FitsFile, make_GTI_from_FT2, update_GTIs
+from fermi_blind_search.bkge.background_cube import make_background_cube, open_background_cube
+from fermi_blind_search.bkge.npred_cache import NpredCache
+from fermi_blind_search.fits_handling.fits import FitsFile, make_GTI_from_FT2, update_GTIs, write_GTI_file
+from fermi_blind_search.fits_handling.ft1_partition import make_ft1_partition, open_ft1_partition, select_rows
+from fermi_blind_search.fits_handling.ft2_cache import make_ft2_cache, open_ft2_cache
+from fermi_blind_search.fits_handling.grid_gtis import make_grid_gtis, open_grid_gtis
 from fermi_blind_search.fits_handling.fits_interface import pyfits
+from fermi_blind_search.make_directory import make_dir_if_not_exist
 from fermi_blind_search.plot_counts_map import plot_counts_map
 
 
@@ -98,7 +104,20 @@ def getConnectionToResultsStorage():
     return collection
 
 
-def setup_process():
+# Number of workers of the pool which are currently analyzing a ROI, and total number of workers
+# (see setup_process and worker). They are used to give the free cores to the big ROIs analyzed
+# at the end, when the pool is running out of work
+_busy_workers = None
+_n_workers = 1
+
+
+def setup_process(busy_workers=None, n_workers=1):
+
+    global _busy_workers, _n_workers
+
+    _busy_workers = busy_workers
+    _n_workers = int(n_workers)
+
     # Setup the logging
 
     thisLogger = myLogging.log.getLogger(multiprocessing.current_process().name)
@@ -117,6 +136,9 @@ def setup_process():
     # Setup configuration directory for gtburst
     os.environ['GTBURSTCONFDIR'] = os.getcwd()
 
+    # Use the backend of the Bayesian Blocks chosen in the configuration
+    BayesianBlocks.set_backend_from_config(get_config())
+
 
 def figureToString(figure):
     imgdata = StringIO.StringIO()
@@ -131,7 +153,13 @@ class AllSkySearch(object):
         self.ras = ras
         self.decs = decs
         self.rad = rad
-        self.nullHypProb = float(nullHypProb)
+
+        # If more than one null-hyp. probability is given, the candidates are found for all of them in one
+        # pass. The first one is used for the figures and for saving the results
+        self.multipleThresholds = numpy.ndim(nullHypProb) > 0
+        self.nullHypProbs = [float(x) for x in numpy.atleast_1d(nullHypProb)]
+        self.nullHypProb = self.nullHypProbs[0]
+
         self.npoints = ras.shape[0]
         self.timeInterval = timeInterval
         self.analysisDefinition = analysisDefinition
@@ -143,10 +171,79 @@ class AllSkySearch(object):
         thisLogger = myLogging.log.getLogger("AllSkySearch.go")
         configuration = get_config()
 
+        BayesianBlocks.set_backend_from_config(configuration)
+
+        # Directory for the caches of the whole grid, and caches made by this run
+        cache_dir = _get_cache_dir()
+        new_caches = []
+
+        ft2_root = os.path.splitext(os.path.basename(self.timeInterval.ft2))[0]
+        ft1_root = os.path.splitext(os.path.basename(self.timeInterval.ft1))[0]
+
+        # Convert the FT2 file once for all the regions. The workers memory-map it, instead of
+        # reading the FT2 file for each region
+        if _use_cache("ft2_cache") and self.timeInterval.ft2_cache is None:
+
+            thisLogger.info("Caching the FT2 file %s..." % self.timeInterval.ft2)
+
+            self.timeInterval.ft2_cache = make_ft2_cache(self.timeInterval.ft2,
+                                                         os.path.join(cache_dir, "ft2_cache_%s" % ft2_root))
+
+            new_caches.append('ft2_cache')
+
+        # Compute the GTIs of all the regions at once (from the FT2 cache), instead of selecting the FT2
+        # entries for each region
+        if _use_cache("grid_gtis") and self.timeInterval.grid_gtis is None and \
+                self.timeInterval.ft2_cache is not None:
+
+            thisLogger.info("Computing the GTIs of %s regions..." % self.npoints)
+
+            self.timeInterval.grid_gtis = make_grid_gtis(self.timeInterval.ft2_cache, self.ras, self.decs,
+                                                         self.analysisDefinition.zmax,
+                                                         self.analysisDefinition.thetamax, self.rad,
+                                                         self.timeInterval.tstart, self.timeInterval.tstop,
+                                                         os.path.join(cache_dir, "grid_gtis_%s" % ft2_root))
+
+            new_caches.append('grid_gtis')
+
+        # Assign the events to the regions reading the FT1 file once, instead of filtering the whole
+        # FT1 file for each region
+        if _use_cache("ft1_partition") and self.timeInterval.ft1_partition is None:
+
+            thisLogger.info("Partitioning the events of %s among %s regions..." % (self.timeInterval.ft1,
+                                                                                   self.npoints))
+
+            self.timeInterval.ft1_partition = make_ft1_partition(self.timeInterval.ft1, self.ras, self.decs,
+                                                                 self.rad, self.analysisDefinition.emin,
+                                                                 self.analysisDefinition.emax,
+                                                                 self.timeInterval.tstart,
+                                                                 self.timeInterval.tstop,
+                                                                 os.path.join(cache_dir,
+                                                                              "ft1_partition_%s" % ft1_root))
+
+            new_caches.append('ft1_partition')
+
+        # Compute the background for all the regions at once (from the FT2 cache), if requested
+        if configuration.has_option("Analysis", "background_cube") and \
+                configuration.getboolean("Analysis", "background_cube") and \
+                self.timeInterval.background_cube is None and self.timeInterval.ft2_cache is not None:
+
+            thisLogger.info("Computing the background cube for %s regions..." % self.npoints)
+
+            self.timeInterval.background_cube = make_background_cube(self.ras, self.decs,
+                                                                     self.timeInterval.ft2_cache,
+                                                                     os.path.join(cache_dir,
+                                                                                  "background_cube_%s" % ft2_root),
+                                                                     self.analysisDefinition.zmax,
+                                                                     self.analysisDefinition.thetamax,
+                                                                     self.rad)
+
+            new_caches.append('background_cube')
+
         intervals = [self.timeInterval] * self.npoints
         anDefs = [self.analysisDefinition] * self.npoints
         rads = [self.rad] * self.npoints
-        probs = [self.nullHypProb] * self.npoints
+        probs = [self.nullHypProbs if self.multipleThresholds else self.nullHypProb] * self.npoints
 
         start = time.time()
 
@@ -154,7 +251,9 @@ class AllSkySearch(object):
 
         if self.cpus > 1:
 
-            pool = multiprocessing.Pool(self.cpus, setup_process)
+            busy_workers = multiprocessing.Value('i', 0)
+
+            pool = multiprocessing.Pool(self.cpus, setup_process, (busy_workers, self.cpus))
 
             for i, res in enumerate(pool.imap(worker, zip(self.ras, self.decs, rads, anDefs, intervals, probs))):
 
@@ -180,31 +279,27 @@ class AllSkySearch(object):
         stop = time.time()
         thisLogger.info("Elapsed time: %s" % (stop - start))
 
-        interestingRegions = []
-
         self.excludedBecauseOfDuration = 0
 
-        for k in results:
+        if self.multipleThresholds:
 
-            if k == [[]]:
+            # Each result contains the excesses for each threshold
+            self.interestingIntervalsPerThreshold = []
 
-                # This ROI had zero counts, nothing to do
-                continue
+            for i, this_p0 in enumerate(self.nullHypProbs):
 
-            # Get all the time intervals from the excesses for this RA,Dec point
-            intervals = map(lambda x: (x.timeInterval.tstart, x.timeInterval.tstop), k)
+                these_regions = self._getInterestingRegions([k[i] for k in results])
 
-            # If there is more than one block we might have found something
+                thisLogger.info("Null-hyp. probability %s: found %s interesting regions" % (this_p0,
+                                                                                           len(these_regions)))
 
-            if len(intervals) > 1:
+                self.interestingIntervalsPerThreshold.append((this_p0, these_regions))
 
-                interestingRegions.append(k)
+            interestingRegions = self.interestingIntervalsPerThreshold[0][1]
 
-            else:
+        else:
 
-                # Nothing found
-
-                continue
+            interestingRegions = self._getInterestingRegions(results)
 
         thisLogger.info("Found %s interesting regions" % (len(interestingRegions)))
 
@@ -255,20 +350,74 @@ class AllSkySearch(object):
         self.figs = figs
         self.interestingIntervals = interestingRegions
 
+        if configuration.has_option("Analysis", "keep_caches") and \
+                not configuration.getboolean("Analysis", "keep_caches"):
+
+            # Nothing reads the caches anymore
+            for name in new_caches:
+
+                thisLogger.info("Removing %s" % getattr(self.timeInterval, name))
+
+                shutil.rmtree(getattr(self.timeInterval, name), ignore_errors=True)
+
+                setattr(self.timeInterval, name, None)
+
         return interestingRegions, figs
 
     pass
 
+    @staticmethod
+    def _getInterestingRegions(results):
+
+        interestingRegions = []
+
+        for k in results:
+
+            if k == [[]]:
+
+                # This ROI had zero counts, nothing to do
+                continue
+
+            # Get all the time intervals from the excesses for this RA,Dec point
+            intervals = map(lambda x: (x.timeInterval.tstart, x.timeInterval.tstop), k)
+
+            # If there is more than one block we might have found something
+
+            if len(intervals) > 1:
+
+                interestingRegions.append(k)
+
+            else:
+
+                # Nothing found
+
+                continue
+
+        return interestingRegions
+
     def getExcludedBecauseOfDuration(self):
         return self.excludedBecauseOfDuration
 
-    def save_to_file(self, filename, figures=True):
+    def save_to_file(self, filename, figures=True, nullHypProb=None):
+
+        # By default save the candidates for the first null-hyp. probability. The figures are
+        # only available for those
+
+        if nullHypProb is None or float(nullHypProb) == self.nullHypProb:
+
+            interesting_regions = self.interestingIntervals
+
+        else:
+
+            interesting_regions = dict(self.interestingIntervalsPerThreshold)[float(nullHypProb)]
+
+            figures = False
 
         # Each candidate transient corresponds to a row in the output file
 
         candidate_transients = []
 
-        for interesting_region in self.interestingIntervals:
+        for interesting_region in interesting_regions:
 
             this_ra = interesting_region[0].ra
             this_dec = interesting_region[0].dec
@@ -389,26 +538,143 @@ def getID():
     return uuid.uuid4().hex  # .bytes.encode('base64').rstrip('=\n').replace('/', '_')
 
 
+def _get_n_threads(n_events):
+    """
+    Return the number of threads to use for the Bayesian Blocks of a ROI with n_events events. ROIs with
+    more events than the straggler_threshold in the [Hardware] section of the configuration get one
+    thread plus all the cores which are currently free in the pool. Other ROIs get one thread.
+    """
+
+    if _busy_workers is None:
+
+        # Not running in a pool
+        return 1
+
+    configuration = get_config()
+
+    if not configuration.has_option("Hardware", "straggler_threshold"):
+
+        return 1
+
+    if n_events <= int(configuration.get("Hardware", "straggler_threshold")):
+
+        return 1
+
+    with _busy_workers.get_lock():
+
+        busy = _busy_workers.value
+
+    return max(1, _n_workers - busy + 1)
+
+
+def _use_cache(name):
+    """
+    Return whether the cache name (ft2_cache, grid_gtis or ft1_partition) is made once for all the regions.
+    They are all used, unless turned off in the [Analysis] section of the configuration.
+    """
+
+    configuration = get_config()
+
+    if not configuration.has_option("Analysis", name):
+
+        return True
+
+    return configuration.getboolean("Analysis", name)
+
+
+def _get_cache_dir():
+    """
+    Return the directory for the caches of the whole grid (the FT2 cache, the GTIs of the grid, the partition
+    of the FT1 file and the background cube), from the cache_dir option in the [Analysis] section of the
+    configuration (by default __ltf_caches in the working directory)
+    """
+
+    configuration = get_config()
+
+    directory = ''
+
+    if configuration.has_option("Analysis", "cache_dir"):
+
+        directory = configuration.get("Analysis", "cache_dir").strip()
+
+    if directory == '':
+
+        directory = "__ltf_caches"
+
+    directory = os.path.abspath(os.path.expandvars(os.path.expanduser(directory)))
+
+    make_dir_if_not_exist(directory)
+
+    return directory
+
+
+def _get_npred_cache():
+    """
+    Return the persistent cache of the background of the ROIs (see bkge.npred_cache), if the npred_cache
+    option in the [Analysis] section of the configuration is set, otherwise None
+    """
+
+    configuration = get_config()
+
+    if not configuration.has_option("Analysis", "npred_cache"):
+
+        return None
+
+    directory = configuration.get("Analysis", "npred_cache").strip()
+
+    if directory == '':
+
+        return None
+
+    directory = os.path.expandvars(os.path.expanduser(directory))
+
+    if configuration.has_option("Analysis", "npred_cache_max_size"):
+
+        # In MB
+        return NpredCache(directory, float(configuration.get("Analysis", "npred_cache_max_size")) * 1024 ** 2)
+
+    else:
+
+        return NpredCache(directory)
+
+
 def worker(args):
     # sys.stderr.write("Worker start")
 
     r, d, rr, a, t, p = args
 
-    grbRoi = SearchRegion(r, d, rr, a, t)
+    if _busy_workers is not None:
+
+        with _busy_workers.get_lock():
 
-    counts = grbRoi.applySelection()
+            _busy_workers.value += 1
 
-    if counts == 0:
+    try:
 
-        # Nothing to do
+        grbRoi = SearchRegion(r, d, rr, a, t)
 
-        res = [[]]
+        counts = grbRoi.applySelection()
 
-    else:
+        if counts == 0:
 
-        res = grbRoi.searchForExcesses(p)
+            # Nothing to do (for each threshold, if there is more than one)
+
+            res = [[[]] for _ in p] if numpy.ndim(p) > 0 else [[]]
+
+        else:
+
+            res = grbRoi.searchForExcesses(p)
+
+        grbRoi.done()
+
+    finally:
+
+        if _busy_workers is not None:
+
+            with _busy_workers.get_lock():
+
+                _busy_workers.value -= 1
 
-    grbRoi.done()
     # sys.stderr.write("Worker end")
     return res
 
@@ -428,7 +694,8 @@ pass
 
 
 class TimeInterval(object):
-    def __init__(self, tstart, tstop, ft1, ft2, simft1=None):
+    def __init__(self, tstart, tstop, ft1, ft2, simft1=None, ft2_cache=None, background_cube=None,
+                 ft1_partition=None, grid_gtis=None, bb_state_dir=None):
         self.tstart = float(tstart)
         self.tstop = float(tstop)
 
@@ -438,6 +705,23 @@ class TimeInterval(object):
         self.ft1 = os.path.abspath(ft1)
         self.ft2 = os.path.abspath(ft2)
 
+        # Directory containing the cache of the FT2 file (see fits_handling.ft2_cache), if any
+        self.ft2_cache = ft2_cache
+
+        # Directory containing the background cube (see bkge.background_cube), if any
+        self.background_cube = background_cube
+
+        # Directory containing the partition of the events among the regions (see
+        # fits_handling.ft1_partition), if any
+        self.ft1_partition = ft1_partition
+
+        # Directory containing the GTIs of all the regions (see fits_handling.grid_gtis), if any
+        self.grid_gtis = grid_gtis
+
+        # Directory where the state of the Bayesian Blocks of each region is kept between runs on
+        # this window (see BayesianBlocks.IncrementalBlocks), if any
+        self.bb_state_dir = bb_state_dir
+
         if simft1 is not None:
 
             self.simft1 = os.path.abspath(simft1)
@@ -585,8 +869,33 @@ class Selector(object):
 
         gti_file = "__GTI.fit"
 
-        gti_starts, gti_stops = make_GTI_from_FT2(self.timeInterval.ft2, filter_expression, gti_file, overwrite=True,
-                                                  force_start=tstart, force_stop=tstop)
+        gtis = None
+
+        if self.timeInterval.grid_gtis is not None:
+
+            # Same selection, already computed for all the regions at once (if this region is in the grid)
+            gtis = open_grid_gtis(self.timeInterval.grid_gtis).get_gtis(self.ra, self.dec, tstart, tstop)
+
+        if gtis is None and self.timeInterval.ft2_cache is not None:
+
+            # Same selection, using the cache instead of reading the FT2 file
+            gtis = open_ft2_cache(self.timeInterval.ft2_cache).get_gtis(self.ra, self.dec,
+                                                                       self.analysisDef.zmax,
+                                                                       self.analysisDef.thetamax,
+                                                                       self.rad, tstart, tstop)
+
+        if gtis is not None:
+
+            gti_starts, gti_stops = gtis
+
+            if len(gti_starts) > 0:
+
+                write_GTI_file(gti_file, gti_starts, gti_stops, overwrite=True)
+
+        else:
+
+            gti_starts, gti_stops = make_GTI_from_FT2(self.timeInterval.ft2, filter_expression, gti_file,
+                                                      overwrite=True, force_start=tstart, force_stop=tstop)
 
         assert len(gti_starts) == len(gti_stops), "GTI starts and stop out of sync. This is a bug."
 
@@ -596,18 +905,34 @@ class Selector(object):
 
             return "", 0
 
-        gti_filter = "gtifilter('%s') && gtifilter('%s')" % (gti_file, self.timeInterval.ft1)
-        energy_filter = "(ENERGY >= %s) && (ENERGY <= %s)" % (self.analysisDef.emin, self.analysisDef.emax)
-        time_filter = "(TIME >= %s) && (TIME <= %s)" % (tstart, tstop)
-        flt = '(%s) && (%s) && (%s)' % (energy_filter, time_filter, gti_filter)
-
         # Apply filter
         thisEventFile = 'filt_ft1_%s.fit' % self.uid
 
-        fits = FitsFile(self.timeInterval.ft1,
-                        'EVENTS',
-                        flt,
-                        cone=(self.ra, self.dec, self.rad))
+        rows = None
+
+        if self.timeInterval.ft1_partition is not None:
+
+            # The events of this region passing the energy cut (if the region is in the partition)
+            rows = open_ft1_partition(self.timeInterval.ft1_partition).get_rows(self.ra, self.dec)
+
+        if rows is not None:
+
+            # Same selection, reading only the rows of this region
+            fits = FitsFile(self.timeInterval.ft1,
+                            'EVENTS',
+                            rows=select_rows(self.timeInterval.ft1, rows, tstart, tstop, gti_starts, gti_stops))
+
+        else:
+
+            gti_filter = "gtifilter('%s') && gtifilter('%s')" % (gti_file, self.timeInterval.ft1)
+            energy_filter = "(ENERGY >= %s) && (ENERGY <= %s)" % (self.analysisDef.emin, self.analysisDef.emax)
+            time_filter = "(TIME >= %s) && (TIME <= %s)" % (tstart, tstop)
+            flt = '(%s) && (%s) && (%s)' % (energy_filter, time_filter, gti_filter)
+
+            fits = FitsFile(self.timeInterval.ft1,
+                            'EVENTS',
+                            flt,
+                            cone=(self.ra, self.dec, self.rad))
 
         nEvents = len(fits['EVENTS'].data)
 
@@ -841,14 +1166,61 @@ class SearchRegion(Selector):
         expected counts between 0 and t very fast
         '''
 
-        bkge = ROIBackgroundEstimator.ROIBackgroundEstimator(self.selectedEventFile, self.timeInterval.ft2)
+        if self.timeInterval.background_cube is not None:
+
+            # The background of this region is a slice of the cube
+            import fitsio
+
+            gti = fitsio.read(self.selectedEventFile, ext='GTI')
 
-        self.NpredIntegralDistribution = bkge.getIntegralDistribution(self.timeInterval.tstart)
+            cube = open_background_cube(self.timeInterval.background_cube)
+
+            self.NpredIntegralDistribution = cube.get_integral_distribution(cube.get_index(self.ra, self.dec),
+                                                                            self.timeInterval.tstart,
+                                                                            self.timeInterval.tstart,
+                                                                            self.timeInterval.tstop,
+                                                                            zip(gti['START'], gti['STOP']))
+
+            return
+
+        if self.timeInterval.ft2_cache is not None:
+
+            ft2 = open_ft2_cache(self.timeInterval.ft2_cache)
+
+        else:
+
+            ft2 = self.timeInterval.ft2
+
+        bkge = ROIBackgroundEstimator.ROIBackgroundEstimator(self.selectedEventFile, ft2)
+
+        # In real time the GTIs already analyzed by a previous run are taken from the cache, if any
+        cuts = {'irf': self.analysisDef.irf, 'zmax': self.analysisDef.zmax, 'thetamax': self.analysisDef.thetamax,
+                'emin': self.analysisDef.emin, 'emax': self.analysisDef.emax, 'rad': self.rad}
+
+        # Sample the rate adaptively, instead of every second, if a maximum error is given
+        configuration = get_config()
+
+        if configuration.has_option("Analysis", "background_max_error"):
+
+            max_relative_error = float(configuration.get("Analysis", "background_max_error"))
+
+        else:
+
+            max_relative_error = None
+
+        self.NpredIntegralDistribution = bkge.getIntegralDistribution(self.timeInterval.tstart,
+                                                                      cache=_get_npred_cache(), cuts=cuts,
+                                                                      max_relative_error=max_relative_error)
 
     pass
 
     @in_workdir
     def searchForExcesses(self, nullHypProb=1e-05):
+        '''
+        Run the Bayesian Blocks on the selected events and return the list of excesses. If nullHypProb
+        is a list of probabilities, the Bayesian Blocks are run for all of them in one pass, and a list
+        with the excesses for each probability is returned
+        '''
 
         self._createNpredIntegralDistribution()
 
@@ -868,12 +1240,131 @@ class SearchRegion(Selector):
             print("No events in this ROI!")
             return [self.timeInterval.tstart, self.timeInterval.tstop]
 
+        configuration = get_config()
+
+        # Above this number of events use the binned Bayesian Blocks, which is much faster for bright ROIs
+        if configuration.has_option("Analysis", "binned_bb_threshold"):
+
+            binned_threshold = int(configuration.get("Analysis", "binned_bb_threshold"))
+
+        else:
+
+            binned_threshold = None
+
+        # Big ROIs use the free cores, if any
+        nthreads = _get_n_threads(tt.shape[0])
+
+        if nthreads > 1:
+
+            print("Using %s threads for the Bayesian Blocks of %s events" % (nthreads, tt.shape[0]))
+
+        # For quick-look runs the Bayesian Blocks can be approximated, allowing change points
+        # only at some of the events (see BayesianBlocks.bayesian_blocks_approximate)
+        if configuration.has_option("Analysis", "bb_approximation"):
+
+            approximation = configuration.get("Analysis", "bb_approximation")
+
+        else:
+
+            approximation = 'none'
+
+        # Parameters of the approximation (by default the ones of bayesian_blocks_approximate)
+        if configuration.has_option("Analysis", "bb_decimation"):
+
+            decimation_k = int(configuration.get("Analysis", "bb_decimation"))
+
+        else:
+
+            decimation_k = 10
+
+        if configuration.has_option("Analysis", "bb_lattice_size"):
+
+            n_lattice = int(configuration.get("Analysis", "bb_lattice_size"))
+
+        else:
+
+            n_lattice = 1000
+
+        if configuration.has_option("Analysis", "bb_compare_exact"):
+
+            compare_exact = configuration.getboolean("Analysis", "bb_compare_exact")
+
+        else:
+
+            compare_exact = False
+
+        # Maximum relative change of the number of events for which the state of a previous run on
+        # this window is reused (see BayesianBlocks.IncrementalBlocks.resume)
+        if configuration.has_option("Analysis", "bb_incremental_max_change"):
+
+            max_events_change = float(configuration.get("Analysis", "bb_incremental_max_change"))
+
+        else:
+
+            max_events_change = 0.05
+
         try:
 
-            # res = myBB.bayesian_blocks(tt,nullHypProb,self.NpredIntegralDistribution)
-            res = BayesianBlocks.bayesian_blocks(tt, 0.0,
-                                                 self.timeInterval.tstop - self.timeInterval.tstart,
-                                                 nullHypProb, self.NpredIntegralDistribution)
+            if approximation != 'none':
+
+                gti = fitsio.read(self.selectedEventFile, ext='GTI')
+
+                gtis = zip(gti['START'] - self.timeInterval.tstart, gti['STOP'] - self.timeInterval.tstart)
+
+                res, report = BayesianBlocks.bayesian_blocks_approximate(
+                    tt, 0.0, self.timeInterval.tstop - self.timeInterval.tstart,
+                    nullHypProb, self.NpredIntegralDistribution,
+                    decimation=approximation, k=decimation_k, gtis=gtis, n_lattice=n_lattice,
+                    compare_exact=compare_exact)
+
+                print("Approximate Bayesian Blocks (%s): %s" % (approximation, report))
+
+            elif binned_threshold is not None and tt.shape[0] > binned_threshold:
+
+                if configuration.has_option("Analysis", "binned_bb_min_width"):
+
+                    min_bin_width = float(configuration.get("Analysis", "binned_bb_min_width"))
+
+                else:
+
+                    # The default of bayesian_blocks_binned
+                    min_bin_width = 1.0
+
+                print("Using binned Bayesian Blocks for %s events (minimum bin width: %s)" % (tt.shape[0],
+                                                                                             min_bin_width))
+
+                res = BayesianBlocks.bayesian_blocks_binned(tt, 0.0,
+                                                            self.timeInterval.tstop - self.timeInterval.tstart,
+                                                            nullHypProb, self.NpredIntegralDistribution,
+                                                            min_bin_width=min_bin_width, nthreads=nthreads)
+
+            elif self.timeInterval.bb_state_dir is not None:
+
+                state_file = os.path.join(self.timeInterval.bb_state_dir,
+                                          "ra%.3f-dec%.3f_bb_state.npz" % (self.ra, self.dec))
+
+                # The events are relative to the start of the window, so the start in MET identifies the
+                # window: when it moves the state is rebuilt
+                description = {'tstart': self.timeInterval.tstart, 'ra': self.ra, 'dec': self.dec, 'rad': self.rad}
+
+                blocks, n_reused = BayesianBlocks.IncrementalBlocks.resume(state_file, tt, 0.0, nullHypProb,
+                                                                           self.NpredIntegralDistribution,
+                                                                           description=description,
+                                                                           max_events_change=max_events_change,
+                                                                           nthreads=nthreads)
+
+                print("Reused the Bayesian Blocks of %s out of %s events from %s" % (n_reused, tt.shape[0],
+                                                                                    state_file))
+
+                res = blocks.get_edges(self.timeInterval.tstop - self.timeInterval.tstart)
+
+            else:
+
+                # res = myBB.bayesian_blocks(tt,nullHypProb,self.NpredIntegralDistribution)
+                res = BayesianBlocks.bayesian_blocks(tt, 0.0,
+                                                     self.timeInterval.tstop - self.timeInterval.tstart,
+                                                     nullHypProb, self.NpredIntegralDistribution,
+                                                     nthreads=nthreads)
 
         except:
 
@@ -881,29 +1372,58 @@ class SearchRegion(Selector):
 
             raise
 
-        self.excesses = []
+        if numpy.ndim(nullHypProb) == 0:
 
-        for t1, t2 in zip(res[0:], res[1:]):
+            self.excesses = self._getExcesses(tt, res, {})
 
-            print("%s - %s" % (t1, t2))
+            print("Found %s intervals" % (len(self.excesses)))
+
+            return self.excesses
+
+        else:
+
+            # The same interval is often found with more than one probability, so
+            # the excesses are shared among them
+            known_excesses = {}
+
+            self.excessesPerThreshold = []
+
+            for this_p0, this_res in zip(nullHypProb, res):
 
-            tt1 = t1 + self.timeInterval.tstart
-            tt2 = t2 + self.timeInterval.tstart
+                self.excessesPerThreshold.append(self._getExcesses(tt, this_res, known_excesses))
 
-            in_interval_idx = (t > tt1 - 1e-5) & (t < tt2 + 1e-5)
+                print("Found %s intervals with null-hyp. probability %s" % (len(self.excessesPerThreshold[-1]),
+                                                                            this_p0))
 
-            nobs = numpy.sum(in_interval_idx)
+            self.excesses = self.excessesPerThreshold[0]
 
-            # Set the time interval to start just before the first event and just after the
-            # last one. Otherwise, due to the Voronoi cells strategy, we might end up with a
-            # tt1 and a tt2 in the middle of a BTI or a SAA passage
+            return self.excessesPerThreshold
 
-            if nobs >= 2:
-                tt1 = t[in_interval_idx].min() - 1e-5
-                tt2 = t[in_interval_idx].max() + 1e-5
+    def _getExcesses(self, tt, res, known_excesses):
 
-            npred = (self.NpredIntegralDistribution(tt2 - self.timeInterval.tstart)
-                     - self.NpredIntegralDistribution(tt1 - self.timeInterval.tstart))
+        excesses = []
+
+        configuration = get_config()
+
+        # Number of observed and expected events in each block, computed all at once. The interval of
+        # each block is set to start just before the first event and just after the
+        # last one. Otherwise, due to the Voronoi cells strategy, we might end up with a
+        # tt1 and a tt2 in the middle of a BTI or a SAA passage
+
+        blocks = BayesianBlocks.blocks_from_edges(tt, res, self.NpredIntegralDistribution, event_padding=1e-5)
+
+        min_counts = int(configuration.get("Analysis", "Min_counts"))
+
+        for t1, t2, block in zip(res[0:], res[1:], blocks):
+
+            print("%s - %s" % (t1, t2))
+
+            tt1 = block.tstart + self.timeInterval.tstart
+            tt2 = block.tstop + self.timeInterval.tstart
+
+            nobs = block.nobs
+
+            npred = block.npred
 
             print("Nobs: %s, Npred: %s" % (nobs, npred))
             if (npred <= 0):
@@ -915,8 +1435,7 @@ class SearchRegion(Selector):
                         "Zero or negative npred (%s) while observed are %s for region centered in %s,%s in time interval %s - %s" % (
                         npred, nobs, self.ra, self.dec, t1, t2))
 
-            configuration = get_config()
-            if (nobs < int(configuration.get("Analysis", "Min_counts"))):
+            if (nobs < min_counts):
                 sys.stderr.write(
                     "WARNING: too few counts (%s) in interval %.3f-%.3f (npred = %s)" % (nobs, t1, t2, npred))
 
@@ -927,20 +1446,31 @@ class SearchRegion(Selector):
                 sys.stderr.write("Results from BB were: %s" % (res))
             pass
 
+            if (tt1, tt2) in known_excesses:
+
+                excesses.append(known_excesses[(tt1, tt2)])
+
+                continue
+
             thisTimeInterval = TimeInterval(tt1,
                                             tt2,
                                             self.timeInterval.ft1,
                                             self.timeInterval.ft2,
-                                            self.timeInterval.simft1)
-            self.excesses.append(Excess(self.ra, self.dec, self.rad, self.analysisDef, thisTimeInterval))
+                                            self.timeInterval.simft1,
+                                            self.timeInterval.ft2_cache,
+                                            self.timeInterval.background_cube,
+                                            self.timeInterval.ft1_partition,
+                                            self.timeInterval.grid_gtis)
+            excesses.append(Excess(self.ra, self.dec, self.rad, self.analysisDef, thisTimeInterval))
 
             # Now set nobs and npred, and compute the probability
-            self.excesses[-1].setNpred(npred)
-            self.excesses[-1].setNobs(nobs)
-            self.excesses[-1].computeProbability()
+            excesses[-1].setNpred(npred)
+            excesses[-1].setNobs(nobs)
+            excesses[-1].computeProbability()
+
+            known_excesses[(tt1, tt2)] = excesses[-1]
 
-        print("Found %s intervals" % (len(self.excesses)))
-        return self.excesses
+        return excesses
 
 
 def plotFitsCountsmap(fitsfile, title=''):
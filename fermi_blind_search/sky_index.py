@@ -0,0 +1,63 @@
+import numpy as np
+import scipy.spatial
+
+from fermi_blind_search.angular_distance import unit_vectors
+
+
+def _chord_to_angle(chord):
+
+    # Angle (deg) corresponding to the distance between two unit vectors
+    return np.rad2deg(2 * np.arcsin(np.minimum(np.asarray(chord) / 2.0, 1.0)))
+
+
+class SkyIndex(object):
+    """
+    Nearest-neighbour index of a set of positions in the sky, built as a KD-tree on their unit vectors
+    """
+
+    def __init__(self, ras, decs):
+
+        self._tree = scipy.spatial.cKDTree(unit_vectors(ras, decs))
+
+    def __len__(self):
+
+        return self._tree.n
+
+    def query(self, ras, decs):
+        """
+        Find the nearest position for each of the given ones
+
+        :return: (indexes, angular distances in deg). If ras and decs are scalars, these are scalars too
+        """
+
+        chord, indexes = self._tree.query(unit_vectors(ras, decs))
+
+        if np.ndim(ras) == 0:
+
+            return int(indexes[0]), float(_chord_to_angle(chord[0]))
+
+        return indexes, _chord_to_angle(chord)
+
+    def query_radius(self, ras, decs, radius):
+        """
+        Find the positions within radius (deg) from each of the given ones
+
+        :return: a list with the (sorted) indexes of the positions within radius for each of the given ones
+        """
+
+        chord = 2 * np.sin(np.deg2rad(radius) / 2.0)
+
+        return [sorted(indexes) for indexes in self._tree.query_ball_point(unit_vectors(ras, decs), chord)]
+
+    def query_nearest(self, ra, dec, n):
+        """
+        Find the n positions closest to the given one
+
+        :return: (indexes, angular distances in deg), sorted by distance
+        """
+
+        n = min(int(n), len(self))
+
+        chord, indexes = self._tree.query(unit_vectors(ra, dec), k=n)
+
+        return np.atleast_1d(indexes[0]), np.atleast_1d(_chord_to_angle(chord[0]))
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+import argparse
+import sys
+
+from fermi_blind_search import bb_benchmark
+from fermi_blind_search import myLogging
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="""Benchmark the Bayesian Blocks, optionally comparing
+                                     with a baseline from a previous run""")
+    parser.add_argument('--sizes', help='Comma-separated list of number of events',
+                        type=str, required=False, default=",".join(map(str, bb_benchmark.DEFAULT_SIZES)))
+    parser.add_argument('--repeat', help='Number of times each case is run (the fastest time is kept)',
+                        type=int, required=False, default=1)
+    parser.add_argument('--save_baseline', help='Save the results as a baseline in this file',
+                        type=str, required=False, default=None)
+    parser.add_argument('--baseline', help='Compare the results with the baseline in this file',
+                        type=str, required=False, default=None)
+    parser.add_argument('--reference', help='Compare the results with the reference baseline shipped with the '
+                                            'package (the times are meaningful only on a machine similar to the '
+                                            'one described in it)', action='store_true')
+    parser.add_argument('--tolerance', help='A case is a regression if it is slower than this factor times '
+                                            'the baseline', type=float, required=False, default=1.5)
+
+    args = parser.parse_args()
+
+    myLogging.set_level("INFO")
+
+    logger = myLogging.log.getLogger("ltf_benchmark_bayesian_blocks")
+
+    sizes = [int(x) for x in args.sizes.split(",")]
+
+    results = bb_benchmark.run_benchmarks(sizes, repeat=args.repeat)
+
+    print(bb_benchmark.format_results(results))
+
+    # Some cases must be faster than others on any machine
+    failures = bb_benchmark.compare_speedups(results)
+
+    if len(failures) > 0:
+
+        logger.error("Found %s cases slower than expected:" % len(failures))
+
+        for failure in failures:
+
+            logger.error(failure)
+
+    if args.save_baseline is not None:
+
+        logger.info("Saving baseline in %s" % args.save_baseline)
+
+        bb_benchmark.save_baseline(results, args.save_baseline)
+
+    if args.baseline is not None or args.reference:
+
+        baseline_name = args.baseline if args.baseline is not None else "the reference baseline"
+
+        baseline = bb_benchmark.load_baseline(args.baseline)
+
+        logger.info("Baseline made on: %s" % baseline['machine'])
+        logger.info("This machine: %s" % bb_benchmark.describe_machine())
+
+        regressions = bb_benchmark.compare_with_baseline(results, baseline, time_tolerance=args.tolerance)
+
+        if len(regressions) > 0:
+
+            logger.error("Found %s regressions with respect to %s:" % (len(regressions), baseline_name))
+
+            for regression in regressions:
+
+                logger.error(regression)
+
+            sys.exit(1)
+
+        else:
+
+            logger.info("No regressions with respect to %s" % baseline_name)
+
+    if len(failures) > 0:
+
+        sys.exit(1)
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+import argparse
+
+from fermi_blind_search import BayesianBlocks
+from fermi_blind_search import bb_calibration
+from fermi_blind_search import myLogging
+from fermi_blind_search.configuration import get_config
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="""Measure the false-positive rate of the Bayesian Blocks as a
+                                     function of the null-hyp. probability, with simulations of the background.
+                                     The results are cached in a directory, and reused by later runs""")
+    parser.add_argument('--config', help="Path to configuration file (the theta cut, the choice of the "
+                                         "Bayesian Blocks algorithm and the number of CPUs are read from it)",
+                        type=get_config, required=True)
+    parser.add_argument('--n_events', help='Comma-separated list of expected number of events',
+                        type=str, required=True)
+    parser.add_argument('--p0s', help='Comma-separated list of null-hyp. probabilities', type=str, required=False,
+                        default=",".join(map(str, bb_calibration.DEFAULT_P0S)))
+    parser.add_argument('--n_simulations', help='Number of simulations for each number of events',
+                        type=int, required=False, default=1000)
+    parser.add_argument('--duration', help='Duration of the simulated time interval (s)',
+                        type=float, required=False, default=bb_calibration.DEFAULT_SETTINGS['duration'])
+    parser.add_argument('--cache_dir', help='Directory for the calibration tables',
+                        type=str, required=False, default='bb_calibration')
+    parser.add_argument('--seed', help='Seed of the first simulation', type=int, required=False, default=0)
+
+    args = parser.parse_args()
+
+    myLogging.set_level("INFO")
+
+    configuration = args.config
+
+    BayesianBlocks.set_backend_from_config(configuration)
+
+    ncpus = int(configuration.get("Hardware", "ncpus"))
+
+    settings = bb_calibration.settings_from_config(configuration, duration=args.duration)
+
+    p0s = [float(x) for x in args.p0s.split(",")]
+
+    for n_events in [int(x) for x in args.n_events.split(",")]:
+
+        table = bb_calibration.get_calibration(n_events, args.cache_dir, p0s, args.n_simulations, settings,
+                                               ncpus=ncpus, seed=args.seed)
+
+        print(bb_calibration.format_table(table))
@@ -10,7 +10,8 @@ default_config = '''
 # Instrument Response Function
 irf = P8R2_SOURCE_V6
 
-# Null-hyp probability
+# Null-hyp probability. A comma-separated list (for example 1e-5,1e-6) runs the
+# search for all the values in one pass
 nullp = 1e-5
 
 # Zenith cut for gtmktime
@@ -29,6 +30,69 @@ Max_duration = 21600
 # Minimum number of counts in excess
 Min_counts = 3
 
+# ROIs with more events than this are searched with the binned Bayesian Blocks
+# (comment out to always use the unbinned algorithm)
+binned_bb_threshold = 20000
+
+# Minimum bin width for the binned Bayesian Blocks, in units of expected background counts
+binned_bb_min_width = 1.0
+
+# Approximate Bayesian Blocks for quick-look runs: none (exact), every (change points allowed
+# only every bb_decimation events), gti (only at GTI boundaries) or log (at bb_lattice_size
+# points log-spaced in time, finer towards the end of the interval). GTI boundaries are always
+# allowed change points in the approximate modes
+bb_approximation = none
+bb_decimation = 10
+bb_lattice_size = 1000
+
+# Also run the exact Bayesian Blocks and report the fitness difference and the edge
+# displacement of the approximate solution (slower than the exact run alone)
+bb_compare_exact = no
+
+# Keep the state of the exact Bayesian Blocks of each region when a window is analyzed again with more
+# events (ltf_rerun_analysis.py), so that only the new events are processed. The prior of the state is
+# the one for the number of events of the run which built it, so the state is rebuilt when the number of
+# events changes by more than the fraction bb_incremental_max_change (a 5% change is like using a
+# null-hyp probability 2.4% larger than nullp)
+bb_incremental = no
+bb_incremental_max_change = 0.05
+
+# Make these once for all the regions, instead of reading the FT1 and FT2 files for each region: a
+# cache of the FT2 file (ft2_cache), the GTIs of all the regions (grid_gtis, needs ft2_cache) and the
+# partition of the events of the FT1 file among the regions (ft1_partition). Set to no to turn one off
+ft2_cache = yes
+grid_gtis = yes
+ft1_partition = yes
+
+# Directory for the caches above and for the background cube. They are reused by later runs with the
+# same files and selection. Leave it empty to use __ltf_caches in the working directory
+cache_dir =
+# Keep the caches made by a run after it has finished (set to no to remove them)
+keep_caches = yes
+
+# Compute the background of all the regions at once from the FT2 file and the lookup tables
+# (the background cube), instead of separately for each region. It is faster but coarser: it takes the
+# off-axis angle and the livetime fraction at the start of each FT2 entry instead of interpolating them
+# (about 1% of the expected events), so it is off by default
+background_cube = no
+
+# Maximum distance (deg) between the center of a region and the center of the lookup table used
+# for its background
+lookup_table_tolerance = 0.01
+# Number of lookup tables blended (weighted by the inverse of the square of their distance) for regions
+# farther than lookup_table_tolerance from all the tables (0 to refuse to analyze them)
+lookup_table_neighbours = 4
+# Maximum relative error on the expected number of background events of each region when the
+# background cube is off. The rate is computed only where it changes enough, instead of every second
+# (comment out to compute it every second)
+background_max_error = 0.001
+# Directory for a persistent cache of the background of each region, so that the following runs (in real
+# time) only compute it for the new GTIs. It is used when the background cube is off. Leave it empty to
+# disable the cache
+npred_cache =
+# Maximum size of the cache (in MB). The files least recently used are removed above this size
+npred_cache_max_size = 1024
+
 [Post processing]
 # Candidate transients within this distance from each other (in deg) will
 # be checked and marked as the same transient if they overlap in time
@@ -113,6 +177,15 @@ at_slac = False
 
 [Hardware]
 ncpus = 10
+
+# Backend for the Bayesian Blocks loop: numexpr, numba (compiled, needs numba installed) or
+# auto (numba if available, numexpr otherwise). All give the same results. The ROIs using more than one
+# core (see below) always use numexpr, since the compiled loop runs in one thread
+bb_backend = auto
+
+# ROIs with more events than this use all the free cores for the Bayesian Blocks, when
+# the other cores have finished their work (comment out to always use one core per ROI)
+straggler_threshold = 50000
 '''
 
 
@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+import argparse
+
+from fermi_blind_search import myLogging
+from fermi_blind_search.bkge import make_lookup_tables
+from fermi_blind_search.configuration import get_config
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="""Make the lookup tables of the background for all the
+                                     reference ROIs, in parallel, and write them in the archive used by the
+                                     background estimation. An interrupted run is resumed by running again
+                                     with the same working directory""")
+    parser.add_argument('--config', help="Path to configuration file (the number of CPUs is read from it)",
+                        type=get_config, required=True)
+    parser.add_argument('--reference_rois', help='Directory with the data spaces or the simulated FT1 files of '
+                                                 'the reference ROIs', type=str, required=True)
+    parser.add_argument('--ft2', help='FT2 file of the simulation (needed only for the simulated FT1 files)',
+                        type=str, required=False, default=None)
+    parser.add_argument('--workdir', help='Working directory, with the tables of the single ROIs and the manifest '
+                                          'of the run', type=str, required=False, default='lookup_tables')
+    parser.add_argument('--outfile', help='Name of the archive (to update the archive used by the background '
+                                         'estimation, give the path of the one in the data directory)',
+                        type=str, required=True)
+    parser.add_argument('--n_theta', help='Number of bins of off-axis angle', type=int, required=False,
+                        default=make_lookup_tables.DEFAULT_SETTINGS['n_theta'])
+
+    args = parser.parse_args()
+
+    myLogging.set_level("INFO")
+
+    configuration = args.config
+
+    ncpus = int(configuration.get("Hardware", "ncpus"))
+
+    sources = make_lookup_tables.find_sources(args.reference_rois)
+
+    if len(sources) == 0:
+
+        raise IOError("No data spaces or simulated FT1 files in %s" % args.reference_rois)
+
+    archive = make_lookup_tables.make_lookup_tables(sources, args.workdir, outfile=args.outfile, ft2file=args.ft2,
+                                                    settings={'n_theta': args.n_theta}, ncpus=ncpus)
+
+    print("Lookup tables archived in %s" % archive)
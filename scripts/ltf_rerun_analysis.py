@@ -74,7 +74,7 @@ def get_data(data_path, met_start, met_stop, config, logger):
     subprocess.check_call(mdcget_cmd_line, shell=True)
 
 
-def run_ltf_search(workdir, outfile, logfile, logger):
+def run_ltf_search(workdir, outfile, logfile, logger, bb_state_dir=None):
 
     # get the path to execute ltf_search_for_transients.py
     ltf_search_for_transients_path = which("ltf_search_for_transients.py")
@@ -87,6 +87,11 @@ def run_ltf_search(workdir, outfile, logfile, logger):
                            (ltf_search_for_transients_path,
                             fit_file_path, configuration.config_file, outfile, logfile, workdir))
 
+    if bb_state_dir is not None:
+
+        # Reuse the Bayesian Blocks of the previous run on this window (see IncrementalBlocks)
+        ltf_search_cmd_line += ' --bb_state_dir %s' % bb_state_dir
+
     logger.info("ltf_search_for_transients command line: %s" % ltf_search_cmd_line)
 
     try:
@@ -158,6 +163,19 @@ if __name__ == "__main__":
     # if the directory does not exist, create it
     make_dir_if_not_exist(analysis_path)
 
+    # The state of the Bayesian Blocks of each region is kept in the directory of the analysis, so that
+    # the next rerun only processes the new events (the work directory is removed at the end)
+    if configuration.has_option("Analysis", "bb_incremental") and \
+            configuration.getboolean("Analysis", "bb_incremental"):
+
+        bb_state_dir = os.path.join(os.path.abspath(analysis_path), "bb_state")
+
+        logger.info("The state of the Bayesian Blocks will be kept in %s" % bb_state_dir)
+
+    else:
+
+        bb_state_dir = None
+
     # directory we will use to store data from mdcget.py
     unique_id = 0
     at_slac = configuration.get("Remote access", "at_slac")
@@ -234,7 +252,7 @@ if __name__ == "__main__":
                 get_data(workdir, met_start, met_stop, configuration, logger)
 
                 # run ltf_search_for_transients
-                run_ltf_search(workdir, outfile, logfile, logger)
+                run_ltf_search(workdir, outfile, logfile, logger, bb_state_dir)
 
                 # if we make it this far, the analysis has been successful and we want to copy the results back
                 # we do this here so that if process_results fails, we still have the results files where we want them
@@ -40,6 +40,8 @@ if __name__ == "__main__":
     parser.add_argument("--loglevel", help="Level of log detail (DEBUG, INFO)", default='info')
     parser.add_argument("--logfile", help="Name of logfile for the ltfsearch.py script", default='ltfsearch.log')
     parser.add_argument("--workdir", help="Path of work directory", default=os.getcwd())
+    parser.add_argument("--bb_state_dir", help="Directory where the state of the Bayesian Blocks is kept between "
+                                               "runs on the same window (default: do not keep it)", default=None)
 
     # (The Zenith cut is defined in the configuration.txt file of ltfsearch)
 
@@ -100,6 +102,13 @@ if __name__ == "__main__":
 
         #execute_command(cmd_line)
 
+    if args.bb_state_dir is not None:
+
+        # ltfsearch.py moves to the work directory before using it
+        bb_state_dir = os.path.abspath(os.path.expandvars(os.path.expanduser(args.bb_state_dir)))
+
+        extra_args.extend(['--bb_state_dir', bb_state_dir])
+
     cmd_line = 'ltfsearch.py --date %s --duration %s --config %s --loglevel %s --logfile %s ' \
                '--workdir %s --outfile %s %s' % (date, duration, args.config.config_file, args.loglevel,
                                                  args.logfile, args.workdir, temp_file,
@@ -48,6 +48,9 @@ if __name__ == '__main__':
     parser.add_argument('--ft2', help='User-provided ft2 file (default: download from data catalog at Stanford)',
                         required=False, default=None)
     parser.add_argument('--config', help="Path to configuration file", type=get_config, required=True)
+    parser.add_argument('--bb_state_dir', help='Directory where the state of the Bayesian Blocks of each region is '
+                                               'kept between runs on the same window (default: do not keep it)',
+                        required=False, default=None)
 
     args = parser.parse_args()
 
@@ -220,10 +223,20 @@ if __name__ == '__main__':
                                     met_start + args.duration,
                                     cleaned_ft1,
                                     ft2file,
-                                    simft1=None)
+                                    simft1=None,
+                                    bb_state_dir=args.bb_state_dir)
+
+    if args.bb_state_dir is not None and not os.path.exists(args.bb_state_dir):
+
+        os.makedirs(args.bb_state_dir)
 
-    # Null-hyp probability for Bayesian Blocks
-    nullp = float(configuration.get("Analysis","nullp"))
+    # Null-hyp probability for Bayesian Blocks. More than one can be given as a comma-separated list,
+    # in which case the candidates are found for all of them in one pass
+    nullp = [float(x) for x in configuration.get("Analysis","nullp").split(",")]
+
+    if len(nullp) == 1:
+
+        nullp = nullp[0]
 
     ltf = ltf.AllSkySearch(ras,
                            decs,
@@ -254,6 +267,19 @@ if __name__ == '__main__':
 
         ltf.save_to_file(args.outfile, figures=True)
 
+        if ltf.multipleThresholds:
+
+            # Save the candidates for the other probabilities in separate files
+            root, ext = os.path.splitext(args.outfile)
+
+            for this_nullp in ltf.nullHypProbs[1:]:
+
+                this_outfile = "%s_nullp_%g%s" % (root, this_nullp, ext)
+
+                logger.info("Saving candidates for null-hyp. probability %g in %s" % (this_nullp, this_outfile))
+
+                ltf.save_to_file(this_outfile, figures=False, nullHypProb=this_nullp)
+
     logger.info("done")
 
     logger.info("Finished")
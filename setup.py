@@ -2,7 +2,8 @@ from setuptools import setup
 
 import glob
 
-data_files = ['data/grid.fits', 'data/logging.yaml']
+data_files = ['data/grid.fits', 'data/logging.yaml', 'data/ROIBackgroundEstimator_data.npz',
+              'data/bb_benchmark_baseline.json']
 
 # Add all ROI data files
 data_files.extend(glob.glob('fermi_blind_search/data/ROIBackgroundEstimator_data/*.npz'))
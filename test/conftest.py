@@ -1,6 +1,31 @@
 import pytest
 import os
+
+import numpy as np
+
 from fermi_blind_search.configuration import get_config
+from fermi_blind_search.fits_handling import ft2_cache
+
+
+def pytest_configure(config):
+
+    config.addinivalue_line("markers", "benchmark: a timing test, run only if LTF_RUN_BENCHMARKS is set")
+
+
+def pytest_collection_modifyitems(config, items):
+
+    # The timing tests are slow and depend on the load of the machine, so they are opt-in
+    if os.environ.get('LTF_RUN_BENCHMARKS'):
+
+        return
+
+    skip = pytest.mark.skip(reason="benchmark (set LTF_RUN_BENCHMARKS=1 to run it)")
+
+    for item in items:
+
+        if 'benchmark' in item.keywords:
+
+            item.add_marker(skip)
 
 
 @pytest.fixture(scope='session')
@@ -9,4 +34,80 @@ def configuration():
     config_path = os.environ['LTF_BLIND_TEST_CONFIG']
     configuration = get_config(config_path)
 
-    return configuration
\ No newline at end of file
+    return configuration
+
+
+def _simulate_ft2(n=2000, slew=4.0, period=30.0, short_every=0, dead_every=0, bad_fraction=0.0, saa=True,
+                  fits_like=False, seed=0):
+    """
+    Simulate the columns of a FT2 file with entries of 30 s, starting at 1000 s
+
+    :param n: number of entries
+    :param slew: change of R.A. of the pointing and of the zenith in each entry (deg)
+    :param period: period (in entries) of the oscillation in Dec. of the pointing and of the zenith
+    :param short_every: if not zero, one entry every short_every ends 10 s early (leaving a gap)
+    :param dead_every: if not zero, one entry every dead_every has no livetime
+    :param bad_fraction: fraction of entries with no livetime, and fraction of entries with bad data quality
+    (chosen randomly)
+    :param saa: whether 20 entries every 190 are in the SAA
+    :param fits_like: shuffle the entries and use big-endian data, like in a FITS file
+    :param seed: seed for the random choices
+    :return: a dictionary name -> column
+    """
+
+    rng = np.random.RandomState(seed)
+
+    i = np.arange(n)
+
+    start = 1000.0 + 30.0 * i
+
+    short = (i % short_every == 0) if short_every > 0 else np.zeros(n, dtype=bool)
+    dead = (i % dead_every == 0) if dead_every > 0 else np.zeros(n, dtype=bool)
+
+    livetime = np.where(dead, 0.0, 27.0)
+    data_qual = np.ones(n, dtype=np.int16)
+
+    if bad_fraction > 0:
+
+        livetime[rng.uniform(size=n) < bad_fraction] = 0.0
+        data_qual[rng.uniform(size=n) < bad_fraction] = 0
+
+    columns = {'START': start,
+               'STOP': np.where(short, start + 20.0, start + 30.0),
+               'RA_SCZ': (i * slew) % 360,
+               'DEC_SCZ': 50.0 * np.sin(i / period),
+               'RA_ZENITH': (i * slew + 20) % 360,
+               'DEC_ZENITH': 30.0 * np.sin(i / period),
+               'LIVETIME': livetime,
+               'DATA_QUAL': data_qual,
+               'LAT_CONFIG': np.ones(n, dtype=np.int16),
+               'IN_SAA': ((i % 190) < 20) if saa else np.zeros(n, dtype=bool)}
+
+    if fits_like:
+
+        idx = rng.permutation(n)
+
+        columns = dict((key, value[idx].astype(value.dtype.newbyteorder('>'))) for key, value in columns.items())
+
+    return columns
+
+
+@pytest.fixture
+def ft2_columns(request):
+    """
+    Simulated FT2 columns (see _simulate_ft2). Its parameters can be changed with an indirect
+    parametrization, for example:
+
+        @pytest.mark.parametrize('ft2_columns', [{'n': 5000}], indirect=True)
+    """
+
+    return _simulate_ft2(**getattr(request, 'param', {}))
+
+
+@pytest.fixture
+def ft2_cache_dir(ft2_columns, tmpdir):
+    """
+    Directory of the FT2 cache of the simulated FT2 columns (see ft2_columns)
+    """
+
+    return ft2_cache.write_ft2_cache(ft2_columns, str(tmpdir.join("ft2_cache")), {'ft2': 'test'})
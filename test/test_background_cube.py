@@ -0,0 +1,139 @@
+import os
+
+import numpy as np
+import pytest
+
+from fermi_blind_search.angular_distance import angular_distance_fast
+from fermi_blind_search.bkge import background_cube
+from fermi_blind_search.bkge.lookup_tables import get_rate_interpolator
+from fermi_blind_search.fits_handling import ft2_cache
+
+# Grid points with a lookup table
+_RAS = np.array([0.039, 0.256, 1.207])
+_DECS = np.array([29.138, -23.391, 41.507])
+
+
+@pytest.mark.parametrize('ft2_columns', [{'n': 3000, 'slew': 2.0, 'period': 90.0, 'dead_every': 50}],
+                         indirect=True)
+def test_background_cube(ft2_cache_dir, tmpdir):
+
+    ft2 = ft2_cache.open_ft2_cache(ft2_cache_dir)
+
+    directory = background_cube.make_background_cube(_RAS, _DECS, ft2_cache_dir, str(tmpdir.join("cube")),
+                                                     zmax=95.0, thetamax=60.0, rad=10.0, chunk_size=700)
+
+    cube = background_cube.open_background_cube(directory)
+
+    assert cube.rate.dtype == np.float32
+    assert cube.rate.shape == (3, len(ft2))
+
+    # Compare with a direct computation for each grid point
+    duration = ft2['STOP'] - ft2['START']
+
+    for ra, dec in zip(_RAS, _DECS):
+
+        i = cube.get_index(ra, dec)
+
+        theta = angular_distance_fast(ft2['RA_SCZ'], ft2['DEC_SCZ'], ra, dec)
+
+        selected = (ft2.get_good_entries() & (theta <= 50.0) &
+                    (angular_distance_fast(ft2['RA_ZENITH'], ft2['DEC_ZENITH'], ra, dec) <= 85.0))
+
+        expected = np.where(selected, get_rate_interpolator(ra, dec)(theta) * ft2['LIVETIME'] / duration, 0)
+
+        assert np.sum(selected) > 0
+        assert np.allclose(cube.rate[i], expected, rtol=1e-5, atol=1e-9)
+        assert np.allclose(cube.npred[i], np.cumsum(expected * duration), rtol=1e-5)
+
+        # Integral distribution between two entry boundaries
+        t1, t2 = ft2['START'][100], ft2['STOP'][2000]
+
+        integral_distribution = cube.get_integral_distribution(i, 500.0, t1, t2)
+
+        expected_npred = np.sum((expected * duration)[100:2001])
+
+        assert np.isclose(integral_distribution(t2 - 500.0) - integral_distribution(t1 - 500.0), expected_npred,
+                          rtol=1e-5)
+
+        # With GTIs covering everything the result is the same
+        with_gtis = cube.get_integral_distribution(i, 500.0, t1, t2, [(t1, t2)])
+
+        tt = np.linspace(t1, t2, 1000) - 500.0
+
+        assert np.allclose(with_gtis(tt) - with_gtis(t1 - 500.0),
+                           integral_distribution(tt) - integral_distribution(t1 - 500.0), rtol=1e-5, atol=1e-6)
+
+        # With GTIs covering the first half of each entry the number of expected events is halved
+        half = [(t, t + 15.0) for t in ft2['START'][100:2001]]
+
+        with_gtis = cube.get_integral_distribution(i, 500.0, t1, t2, half)
+
+        assert np.isclose(with_gtis(t2 - 500.0) - with_gtis(t1 - 500.0), expected_npred / 2.0, rtol=1e-5)
+
+        # Flat in the second half
+        assert np.isclose(with_gtis(ft2['START'][500] + 20.0 - 500.0), with_gtis(ft2['STOP'][500] - 500.0))
+
+    # The cube is reused if it exists
+    mtime = os.path.getmtime(os.path.join(directory, "rate.npy"))
+
+    assert background_cube.make_background_cube(_RAS, _DECS, ft2_cache_dir, directory, 95.0, 60.0, 10.0) == directory
+    assert os.path.getmtime(os.path.join(directory, "rate.npy")) == mtime
+
+
+def _write_ft1(filename, ra, dec, rad, tstart, tstop, gti_starts, gti_stops):
+
+    from fermi_blind_search.fits_handling.fits_interface import pyfits
+
+    # Only what ROIBackgroundEstimator reads: the ROI, the interval and the GTIs (no events)
+    events = pyfits.BinTableHDU.from_columns([pyfits.Column(name='TIME', format='D', array=np.zeros(0))],
+                                             name='EVENTS')
+
+    events.header['TSTART'] = tstart
+    events.header['TSTOP'] = tstop
+    events.header['DSTYP1'] = 'POS(RA,DEC)'
+    events.header['DSVAL1'] = 'CIRCLE(%s,%s,%s)' % (ra, dec, rad)
+
+    gti = pyfits.BinTableHDU.from_columns([pyfits.Column(name='START', format='D', array=gti_starts),
+                                           pyfits.Column(name='STOP', format='D', array=gti_stops)], name='GTI')
+
+    pyfits.HDUList([pyfits.PrimaryHDU(), events, gti]).writeto(filename)
+
+
+@pytest.mark.parametrize('ft2_columns', [{'n': 3000, 'slew': 2.0, 'period': 90.0, 'dead_every': 50}],
+                         indirect=True)
+def test_same_as_roi_background_estimator(ft2_cache_dir, tmpdir):
+
+    pytest.importorskip("matplotlib")
+    pytest.importorskip("astropy.io.fits")
+
+    from fermi_blind_search.bkge.ROIBackgroundEstimator import ROIBackgroundEstimator
+
+    ft2 = ft2_cache.open_ft2_cache(ft2_cache_dir)
+
+    directory = background_cube.make_background_cube(_RAS, _DECS, ft2_cache_dir, str(tmpdir.join("cube")),
+                                                     zmax=95.0, thetamax=60.0, rad=10.0)
+
+    cube = background_cube.open_background_cube(directory)
+
+    tstart, tstop = ft2['START'][0], ft2['STOP'][-1]
+
+    for ra, dec in zip(_RAS, _DECS):
+
+        gti_starts, gti_stops = ft2.get_gtis(ra, dec, 95.0, 60.0, 10.0)
+
+        ft1 = str(tmpdir.join("ft1_%s_%s.fits" % (ra, dec)))
+
+        _write_ft1(ft1, ra, dec, 10.0, tstart, tstop, gti_starts, gti_stops)
+
+        expected = ROIBackgroundEstimator(ft1, ft2).getIntegralDistribution(500.0)
+
+        integral_distribution = cube.get_integral_distribution(cube.get_index(ra, dec), 500.0, tstart, tstop,
+                                                               list(zip(gti_starts, gti_stops)))
+
+        # The cube takes the off-axis angle and the livetime fraction at the start of each FT2 entry, instead
+        # of interpolating them, and keeps the rate in single precision: with the pointing moving by 2 deg
+        # in each entry and a dead entry every 50, the integral distributions differ by about 1% of the total
+        tt = np.linspace(tstart, tstop, 5000) - 500.0
+
+        assert expected.get_total() > 0
+        assert np.max(np.abs(integral_distribution(tt) - expected(tt))) <= 0.02 * expected.get_total()
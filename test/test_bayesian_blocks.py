@@ -0,0 +1,501 @@
+import numpy as np
+import pytest
+
+from fermi_blind_search import BayesianBlocks
+from fermi_blind_search.BayesianBlocks import bayesian_blocks, bayesian_blocks_not_unique, bayesian_blocks_binned, \
+    bayesian_blocks_batch, bayesian_blocks_approximate, IncrementalBlocks, blocks_from_edges, BlocksWorkspace
+
+
+def _simulate_events(seed, n=2000, tstop=1000.0):
+
+    rng = np.random.RandomState(seed)
+
+    # Flat background plus a short flare
+    t = np.concatenate([rng.uniform(0, tstop, n),
+                        rng.normal(0.4 * tstop, 0.005 * tstop, n // 20)])
+
+    t = t[(t > 0) & (t < tstop)]
+
+    return np.sort(t)
+
+
+def _integral_distribution(x):
+
+    # A background rate increasing linearly with time
+    return 1000.0 * (np.asarray(x) / 1000.0) ** 2
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+@pytest.mark.parametrize("p0", [1e-1, 1e-5])
+def test_pelt_solver_gives_same_edges_as_reference(seed, p0):
+
+    t = _simulate_events(seed)
+
+    reference = bayesian_blocks(t, 0, 1000.0, p0, solver='reference')
+    pruned = bayesian_blocks(t, 0, 1000.0, p0, solver='pelt')
+
+    assert np.array_equal(reference, pruned)
+
+
+def test_pelt_solver_with_background_integral_distribution():
+
+    t = _simulate_events(3)
+
+    reference = bayesian_blocks(t, 0, 1000.0, 1e-3, _integral_distribution, solver='reference')
+    pruned = bayesian_blocks(t, 0, 1000.0, 1e-3, _integral_distribution, solver='pelt')
+
+    assert np.array_equal(reference, pruned)
+
+
+def test_pelt_solver_not_unique():
+
+    # Rounding creates many events with the same arrival time
+    t = np.round(_simulate_events(4), 0)
+
+    reference = bayesian_blocks_not_unique(t, 0, 1000.0, 1e-3, solver='reference')
+    pruned = bayesian_blocks_not_unique(t, 0, 1000.0, 1e-3, solver='pelt')
+
+    assert np.array_equal(reference, pruned)
+
+
+@pytest.mark.parametrize("solver", ['pelt', 'reference'])
+def test_several_priors_in_one_pass(solver):
+
+    t = _simulate_events(11)
+
+    p0s = [1e-1, 1e-3, 1e-6]
+
+    results = bayesian_blocks(t, 0, 1000.0, p0s, _integral_distribution, solver=solver)
+
+    assert len(results) == len(p0s)
+
+    for p0, edges in zip(p0s, results):
+
+        assert np.array_equal(edges, bayesian_blocks(t, 0, 1000.0, p0, _integral_distribution, solver=solver))
+
+    binned = bayesian_blocks_binned(t, 0, 1000.0, p0s, _integral_distribution, min_bin_width=0.5, solver=solver)
+
+    for p0, edges in zip(p0s, binned):
+
+        assert np.array_equal(edges, bayesian_blocks_binned(t, 0, 1000.0, p0, _integral_distribution,
+                                                            min_bin_width=0.5, solver=solver))
+
+
+def test_shared_pelt_pass_on_many_events():
+
+    # (the time of the shared pass with respect to separate passes is checked by the benchmarks, see
+    # bb_benchmark.SPEEDUPS)
+    t = _simulate_events(15, n=10000)
+
+    p0s = [1e-1, 1e-3, 1e-6]
+
+    shared = bayesian_blocks(t, 0, 1000.0, p0s, _integral_distribution)
+
+    for p0, edges in zip(p0s, shared):
+
+        assert np.array_equal(edges, bayesian_blocks(t, 0, 1000.0, p0, _integral_distribution))
+
+
+@pytest.mark.parametrize("solver", ['pelt', 'reference'])
+def test_threads_give_same_edges(solver):
+
+    t = _simulate_events(14, n=5000)
+
+    expected = bayesian_blocks(t, 0, 1000.0, 1e-3, _integral_distribution, solver=solver)
+
+    assert np.array_equal(bayesian_blocks(t, 0, 1000.0, 1e-3, _integral_distribution, solver=solver, nthreads=4),
+                          expected)
+
+
+def test_flare_is_detected():
+
+    edges = bayesian_blocks(_simulate_events(5), 0, 1000.0, 1e-5)
+
+    assert edges[0] == 0
+    assert edges[-1] == 1000.0
+
+    # The flare at t = 400 must be isolated in its own block(s)
+    assert np.any((edges > 380) & (edges < 400))
+    assert np.any((edges > 400) & (edges < 420))
+
+
+@pytest.mark.parametrize("event_padding", [None, 1e-5])
+def test_blocks_from_edges(event_padding):
+
+    t = _simulate_events(10)
+
+    edges = bayesian_blocks(t, 0, 1000.0, 1e-3, _integral_distribution)
+
+    blocks = blocks_from_edges(t, edges, _integral_distribution, event_padding=event_padding)
+
+    assert blocks.shape[0] == edges.shape[0] - 1
+    assert np.sum(blocks.nobs) == t.shape[0]
+
+    for t1, t2, block in zip(edges[:-1], edges[1:], blocks):
+
+        in_block = (t >= t1) & (t < t2)
+
+        assert block.nobs == np.sum(in_block)
+        assert np.all(t[block.start:block.stop] == t[in_block])
+
+        if event_padding is not None and block.nobs >= 2:
+
+            t1 = t[in_block].min() - event_padding
+            t2 = t[in_block].max() + event_padding
+
+        assert block.tstart == t1
+        assert block.tstop == t2
+        assert np.isclose(block.npred, _integral_distribution(t2) - _integral_distribution(t1))
+
+
+@pytest.mark.parametrize("solver", ['pelt', 'reference'])
+def test_workspace_is_reused(solver):
+
+    workspace = BlocksWorkspace()
+
+    t = _simulate_events(7)
+
+    first = bayesian_blocks(t, 0, 1000.0, 1e-3, solver=solver, workspace=workspace)
+
+    assert workspace.bytes_allocated > 0
+
+    # A smaller problem must fit in the buffers allocated for the first one
+    second = bayesian_blocks(t[:1000], 0, t[1000], 1e-3, solver=solver, workspace=workspace)
+
+    assert workspace.bytes_allocated == 0
+
+    # The workspace must not retain anything between calls
+    assert np.array_equal(first, bayesian_blocks(t, 0, 1000.0, 1e-3, solver=solver, workspace=workspace))
+    assert np.array_equal(second, bayesian_blocks(t[:1000], 0, t[1000], 1e-3, solver=solver))
+
+
+@pytest.mark.parametrize("bkg", [None, _integral_distribution])
+def test_binned_blocks(bkg):
+
+    t = _simulate_events(9, n=20000)
+
+    # With bins much smaller than the distance between events the result is the same as the unbinned one
+    unbinned = bayesian_blocks(t, 0.0, 1000.0, 1e-3, bkg)
+
+    assert np.array_equal(bayesian_blocks_binned(t, 0.0, 1000.0, 1e-3, bkg, min_bin_width=1e-9), unbinned)
+
+    # With larger bins the edges are still edges of the Voronoi cells, and the flare is still found
+    binned = bayesian_blocks_binned(t, 0.0, 1000.0, 1e-3, bkg, min_bin_width=2.0)
+
+    assert np.all(np.in1d(binned, np.concatenate([[0.0], 0.5 * (t[1:] + t[:-1]), [1000.0]])))
+
+    assert np.any((binned > 380) & (binned < 400))
+    assert np.any((binned > 400) & (binned < 420))
+
+
+@pytest.mark.parametrize("decimation", ['every', 'gti', 'log'])
+def test_approximate_blocks(decimation):
+
+    t = _simulate_events(15, n=5000)
+
+    gtis = [(0.0, 300.0), (350.0, 700.0), (720.0, 1000.0)]
+
+    edges, report = bayesian_blocks_approximate(t, 0, 1000.0, 1e-3, _integral_distribution, decimation=decimation,
+                                                k=5, gtis=gtis, n_lattice=500, compare_exact=True)
+
+    voronoi_edges = np.concatenate([[0.0], 0.5 * (t[1:] + t[:-1]), [1000.0]])
+
+    # The edges are a subset of the Voronoi edges
+    assert np.all(np.in1d(edges, voronoi_edges))
+    assert report['n_candidates'] < t.shape[0]
+    assert report['resolution'] > 0
+
+    # The exact solution can only be better
+    assert report['fitness_difference'] >= -1e-6
+    assert report['edge_displacement'] >= 0
+
+    exact = bayesian_blocks(t, 0, 1000.0, 1e-3, _integral_distribution)
+
+    # With all the events allowed the result is exact
+    edges, report = bayesian_blocks_approximate(t, 0, 1000.0, 1e-3, _integral_distribution, decimation='every',
+                                                k=1, compare_exact=True)
+
+    assert np.array_equal(edges, exact)
+    assert report['fitness_difference'] == 0
+    assert report['edge_displacement'] == 0
+
+
+@pytest.mark.parametrize("with_background", [False, True])
+def test_batch_gives_same_edges_as_single_runs(with_background):
+
+    # Lists of events of many different sizes, including an empty one and
+    # one large enough not to be batched
+    sizes = [0, 5, 50, 60, 80, 200, 210, 400, 2500]
+
+    tts = [_simulate_events(i, n=n) for i, n in enumerate(sizes)]
+    ttstarts = [0.0] * len(tts)
+    ttstops = [1000.0] * len(tts)
+
+    bkgs = [_integral_distribution] * len(tts) if with_background else None
+
+    results = bayesian_blocks_batch(tts, ttstarts, ttstops, 1e-3, bkgs)
+
+    for i, t in enumerate(tts):
+
+        if len(t) == 0:
+
+            assert np.array_equal(results[i], [0.0, 1000.0])
+
+        else:
+
+            single = bayesian_blocks(t, 0.0, 1000.0, 1e-3, _integral_distribution if with_background else None)
+
+            assert np.array_equal(results[i], single)
+
+
+@pytest.mark.parametrize("bkg", [None, _integral_distribution])
+def test_incremental_blocks(bkg, tmpdir):
+
+    t = _simulate_events(8)
+
+    blocks = IncrementalBlocks(0.0, 1e-3, t.shape[0], bkg)
+
+    # Add the events in chunks, saving and restoring the state in between
+    for i, chunk in enumerate(np.array_split(t, 5)):
+
+        blocks.extend(chunk)
+
+        filename = str(tmpdir.join("state_%i.npz" % i))
+
+        blocks.save(filename)
+
+        blocks = IncrementalBlocks.load(filename, bkg)
+
+    assert np.array_equal(blocks.get_edges(1000.0), bayesian_blocks(t, 0.0, 1000.0, 1e-3, bkg))
+
+    # Partial results are also available
+    partial = IncrementalBlocks(0.0, 1e-3, 1000, bkg)
+
+    partial.extend(t[:1000])
+
+    stop = 0.5 * (t[999] + t[1000])
+
+    assert np.array_equal(partial.get_edges(stop), bayesian_blocks(t[:1000], 0.0, stop, 1e-3, bkg))
+
+    with pytest.raises(RuntimeError):
+
+        partial.extend(t[:10])
+
+
+@pytest.mark.parametrize("bkg", [None, _integral_distribution])
+def test_incremental_blocks_resume(bkg, tmpdir):
+
+    t = _simulate_events(9)
+
+    p0 = [1e-3, 1e-5]
+
+    filename = str(tmpdir.join("state.npz"))
+
+    blocks, n_reused = IncrementalBlocks.resume(filename, t, 0.0, p0, bkg, description={'tstart': 0.0})
+
+    assert n_reused == 0
+
+    # An event changed in the middle of the window (for example, a late event inserted before
+    # the last ones): only the events before it are reused
+    t2 = t.copy()
+    t2[500] = 0.5 * (t[500] + t[501])
+
+    blocks, n_reused = IncrementalBlocks.resume(filename, t2, 0.0, p0, bkg, description={'tstart': 0.0})
+
+    assert n_reused == 500
+
+    for edges, expected in zip(blocks.get_edges(1000.0), bayesian_blocks(t2, 0.0, 1000.0, p0, bkg)):
+
+        assert np.array_equal(edges, expected)
+
+    # The start of the window moved: the state is rebuilt
+    _, n_reused = IncrementalBlocks.resume(filename, t2, 0.0, p0, bkg, description={'tstart': 100.0})
+
+    assert n_reused == 0
+
+    # A different number of events is accepted only within the tolerance, keeping the prior
+    _, n_reused = IncrementalBlocks.resume(filename, t2[:-10], 0.0, p0, bkg, description={'tstart': 100.0})
+
+    assert n_reused == 0
+
+    blocks, n_reused = IncrementalBlocks.resume(filename, t2, 0.0, p0, bkg, description={'tstart': 100.0},
+                                                max_events_change=0.01)
+
+    assert n_reused == t2.shape[0] - 10
+    assert blocks.n_events == t2.shape[0] - 10
+
+
+def test_incremental_blocks_restore_threads(monkeypatch):
+
+    import numexpr
+
+    t = _simulate_events(10)
+
+    blocks = IncrementalBlocks(0.0, 1e-3, t.shape[0])
+
+    old_threads = numexpr.set_num_threads(3)
+
+    try:
+
+        blocks.extend(t[:1000], nthreads=2)
+
+        assert numexpr.set_num_threads(3) == 3
+
+        def failing_solver(*args, **kwargs):
+
+            raise ValueError("failure")
+
+        monkeypatch.setattr(BayesianBlocks, '_find_last_pelt', failing_solver)
+
+        with pytest.raises(ValueError):
+
+            blocks.extend(t[1000:], nthreads=2)
+
+        assert numexpr.set_num_threads(3) == 3
+
+    finally:
+
+        numexpr.set_num_threads(old_threads)
+
+
+def test_stale_workspace_content_is_ignored():
+
+    t = _simulate_events(12)
+
+    workspace = BlocksWorkspace(t.shape[0] + 1)
+
+    # Fill the buffers with garbage, as left over by a previous call
+    for buffer in workspace._buffers.values():
+
+        buffer[:] = np.nan if buffer.dtype == float else 10 ** 6
+
+    for solver in ['pelt', 'reference']:
+
+        assert np.array_equal(bayesian_blocks(t, 0, 1000.0, 1e-1, solver=solver, workspace=workspace),
+                              bayesian_blocks(t, 0, 1000.0, 1e-1, solver='reference', workspace=BlocksWorkspace()))
+
+
+@pytest.mark.parametrize("solver", ['pelt', 'reference'])
+def test_numba_backend_gives_same_edges(solver):
+
+    pytest.importorskip("numba")
+
+    t = _simulate_events(13)
+
+    try:
+
+        BayesianBlocks.set_backend('numexpr')
+
+        expected = bayesian_blocks(t, 0, 1000.0, 1e-3, _integral_distribution, solver=solver)
+
+        assert BayesianBlocks.set_backend('numba') == 'numba'
+
+        assert np.array_equal(bayesian_blocks(t, 0, 1000.0, 1e-3, _integral_distribution, solver=solver), expected)
+
+    finally:
+
+        BayesianBlocks.set_backend('auto')
+
+
+@pytest.mark.parametrize("backend", ['numexpr', 'numba'])
+@pytest.mark.parametrize("solver", ['pelt', 'reference'])
+def test_threads_with_each_backend(backend, solver, monkeypatch):
+
+    t = _simulate_events(14, n=3000)
+
+    expected = bayesian_blocks(t, 0, 1000.0, 1e-3, _integral_distribution, solver=solver)
+
+    # The threads split the fitness of the numexpr loop, whatever the backend (the compiled
+    # kernels would ignore them)
+    calls = []
+
+    def _find_last_pelt(*args, **kwargs):
+
+        calls.append(kwargs.get('steps_per_pass'))
+
+        return BayesianBlocks._FIND_LAST['numexpr']['pelt'](*args, **kwargs)
+
+    def _find_last_reference(*args):
+
+        calls.append(None)
+
+        return BayesianBlocks._FIND_LAST['numexpr']['reference'](*args)
+
+    monkeypatch.setattr(BayesianBlocks, '_find_last_pelt', _find_last_pelt)
+    monkeypatch.setattr(BayesianBlocks, '_find_last_reference', _find_last_reference)
+
+    try:
+
+        BayesianBlocks.set_backend(backend)
+
+        edges = bayesian_blocks(t, 0, 1000.0, 1e-3, _integral_distribution, solver=solver, nthreads=4)
+
+    finally:
+
+        BayesianBlocks.set_backend('auto')
+
+    assert np.array_equal(edges, expected)
+    assert calls == [64 if solver == 'pelt' else None]
+
+
+def test_backend_fallback():
+
+    try:
+
+        expected = 'numba' if BayesianBlocks.has_numba else 'numexpr'
+
+        assert BayesianBlocks.set_backend('numba') == expected
+        assert BayesianBlocks.get_backend() == expected
+
+        with pytest.raises(ValueError):
+
+            BayesianBlocks.set_backend('does_not_exist')
+
+    finally:
+
+        BayesianBlocks.set_backend('auto')
+
+
+def test_backend_from_config():
+
+    try:
+
+        import ConfigParser as configparser
+
+    except ImportError:
+
+        import configparser
+
+    configuration = configparser.SafeConfigParser()
+    configuration.add_section("Hardware")
+
+    expected = 'numba' if BayesianBlocks.has_numba else 'numexpr'
+
+    try:
+
+        # Without the option, the best backend available is used
+        assert BayesianBlocks.set_backend_from_config(configuration) == expected
+
+        configuration.set("Hardware", "bb_backend", "numexpr")
+
+        assert BayesianBlocks.set_backend_from_config(configuration) == 'numexpr'
+        assert BayesianBlocks.get_backend() == 'numexpr'
+
+    finally:
+
+        BayesianBlocks.set_backend('auto')
+
+
+def test_every_cell_is_a_block():
+
+    from fermi_blind_search.BayesianBlocks import _find_change_points
+
+    # Each cell starts a new block, so there are N + 1 change points
+    assert np.array_equal(_find_change_points(np.arange(5)), np.arange(6))
+
+
+def test_unknown_solver():
+
+    with pytest.raises(ValueError):
+
+        bayesian_blocks(_simulate_events(6), 0, 1000.0, 1e-3, solver='does_not_exist')
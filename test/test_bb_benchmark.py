@@ -0,0 +1,148 @@
+import copy
+
+import numpy as np
+import pytest
+
+from fermi_blind_search import bb_benchmark
+
+
+def _make_results(sizes=(300, 600, 1200)):
+
+    # Results like the ones of run_benchmarks, with times scaling as n^1 and n^2
+    results = {}
+
+    for name, exponent in [('bayesian_blocks_background_bursty', 2.0),
+                           ('bayesian_blocks_nobackground_bursty', 1.0)]:
+
+        times = [1e-6 * n_events ** exponent for n_events in sizes]
+
+        results[name] = {'sizes': list(sizes),
+                         'times': times,
+                         'peak_memory': [1024 * n_events for n_events in sizes],
+                         'exponent': bb_benchmark.fit_scaling_exponent(sizes, times)}
+
+    return results
+
+
+def test_baseline(tmpdir):
+
+    results = _make_results()
+
+    filename = str(tmpdir.join("baseline.json"))
+
+    bb_benchmark.save_baseline(results, filename)
+
+    baseline = bb_benchmark.load_baseline(filename)
+
+    assert 'cpu' in baseline['machine']
+    assert baseline['cases'] == results
+
+    assert bb_benchmark.compare_with_baseline(results, baseline) == []
+
+    # A slower run must be flagged
+    slower = copy.deepcopy(results)
+
+    slower['bayesian_blocks_background_bursty']['times'][-1] *= 2
+
+    regressions = bb_benchmark.compare_with_baseline(slower, baseline)
+
+    # (the time of the largest size, and so the scaling exponent)
+    assert len(regressions) == 2
+    assert regressions[0].find("bayesian_blocks_background_bursty with 1200 events") == 0
+    assert regressions[1].find("bayesian_blocks_background_bursty: scaling exponent") == 0
+
+    # Comparing only the scaling, a uniformly slower machine is fine
+    uniformly_slower = copy.deepcopy(results)
+
+    for this in uniformly_slower.values():
+
+        this['times'] = [3 * x for x in this['times']]
+
+    assert len(bb_benchmark.compare_with_baseline(uniformly_slower, baseline)) == 6
+    assert bb_benchmark.compare_with_baseline(uniformly_slower, baseline, time_tolerance=None) == []
+
+    # The exponents are compared over the sizes in common
+    assert bb_benchmark.compare_with_baseline(_make_results((600, 1200)), baseline) == []
+
+
+def test_reference_baseline_is_shipped():
+
+    baseline = bb_benchmark.load_baseline()
+
+    assert 'cpu' in baseline['machine']
+
+    for this in baseline['cases'].values():
+
+        assert len(this['sizes']) == len(this['times'])
+
+
+def test_scaling_exponent():
+
+    sizes = np.array([1e3, 1e4, 1e5])
+
+    assert np.isclose(bb_benchmark.fit_scaling_exponent(sizes, 1e-6 * sizes ** 2), 2.0)
+
+
+def test_speedups():
+
+    results = {}
+
+    for function, factor in [('bayesian_blocks_priors', 1.0), ('bayesian_blocks_priors_separate', 2.0)]:
+
+        results[function + '_background_flat'] = {'sizes': [100, 1000], 'times': [factor * 0.1, factor * 1.0]}
+
+    assert bb_benchmark.compare_speedups(results) == []
+
+    # The shared pass much slower than the separate ones with 1000 events
+    results['bayesian_blocks_priors_background_flat']['times'][1] = 3.0
+
+    failures = bb_benchmark.compare_speedups(results)
+
+    assert len(failures) == 1
+    assert failures[0].find("bayesian_blocks_priors_background_flat with 1000 events") == 0
+
+
+@pytest.mark.benchmark
+def test_speedups_hold():
+
+    functions = [function for pair in bb_benchmark.SPEEDUPS for function in pair[:2]]
+
+    results = bb_benchmark.run_benchmarks(sizes=[10000], functions=functions, kinds=['bursty'], repeat=3)
+
+    assert bb_benchmark.compare_speedups(results) == []
+
+
+@pytest.mark.benchmark
+def test_run_benchmarks():
+
+    results = bb_benchmark.run_benchmarks(sizes=[300, 600, 1200], kinds=['bursty'])
+
+    assert sorted(results.keys()) == ['bayesian_blocks_background_bursty',
+                                      'bayesian_blocks_batch_background_bursty',
+                                      'bayesian_blocks_batch_nobackground_bursty',
+                                      'bayesian_blocks_batch_separate_background_bursty',
+                                      'bayesian_blocks_batch_separate_nobackground_bursty',
+                                      'bayesian_blocks_nobackground_bursty',
+                                      'bayesian_blocks_not_unique_nobackground_bursty',
+                                      'bayesian_blocks_priors_background_bursty',
+                                      'bayesian_blocks_priors_nobackground_bursty',
+                                      'bayesian_blocks_priors_separate_background_bursty',
+                                      'bayesian_blocks_priors_separate_nobackground_bursty']
+
+    for this in results.values():
+
+        assert len(this['times']) == 3
+        assert np.isfinite(this['exponent'])
+
+
+@pytest.mark.benchmark
+def test_reference_baseline():
+
+    baseline = bb_benchmark.load_baseline()
+
+    results = bb_benchmark.run_benchmarks(sizes=[1000, 3000, 10000])
+
+    assert sorted(results.keys()) == sorted(baseline['cases'].keys())
+
+    # The times depend on the machine, but the scaling must not be worse than in the reference baseline
+    assert bb_benchmark.compare_with_baseline(results, baseline, time_tolerance=None, exponent_tolerance=0.5) == []
@@ -0,0 +1,73 @@
+import os
+
+import numpy as np
+import pytest
+
+from fermi_blind_search import bb_calibration
+
+
+def test_null_events_follow_the_background():
+
+    t, duration, integral_distribution, gtis = bb_calibration.simulate_null_events(2000, seed=1)
+
+    assert np.isclose(integral_distribution(duration), 2000)
+
+    # All the events are within the GTIs
+    starts, stops = np.array(gtis).T
+
+    idx = np.searchsorted(starts, t, side='right') - 1
+
+    assert np.all(t < stops[idx])
+
+    # The background integral distribution is flat outside of the GTIs
+    assert np.isclose(integral_distribution(stops[0]), integral_distribution(starts[1]))
+
+
+def test_calibration_is_cached(tmpdir, monkeypatch):
+
+    cache_dir = str(tmpdir.join("cache"))
+
+    p0s = [1e-3, 0.5]
+
+    table = bb_calibration.get_calibration(300, cache_dir, p0s, n_simulations=12, ncpus=2)
+
+    assert table['p0s'] == [0.5, 1e-3]
+
+    # Larger p0 cannot give fewer false positives
+    assert table['false_positives'][0] >= table['false_positives'][1]
+
+    # The results do not depend on the number of processes
+    assert table['false_positives'] == bb_calibration.calibrate(300, p0s, n_simulations=12)['false_positives']
+
+    assert len(os.listdir(cache_dir)) == 1
+
+    # Now the table must be read from the cache
+    def fail(*args, **kwargs):
+
+        raise AssertionError("The calibration was not read from the cache")
+
+    monkeypatch.setattr(bb_calibration, 'calibrate', fail)
+
+    assert bb_calibration.get_calibration(300, cache_dir, p0s, n_simulations=12) == table
+
+    # A different configuration, or a different number of events, needs a new table
+    with pytest.raises(AssertionError):
+
+        bb_calibration.get_calibration(300, cache_dir, p0s, n_simulations=12, settings={'theta_cut': 50.0})
+
+    with pytest.raises(AssertionError):
+
+        bb_calibration.get_calibration(301, cache_dir, p0s, n_simulations=12)
+
+
+def test_p0_for_false_positive_rate():
+
+    table = {'p0s': [1e-1, 1e-2, 1e-3], 'false_positive_rates': [0.2, 0.03, 0.0]}
+
+    assert bb_calibration.p0_for_false_positive_rate(table, 0.05) == 1e-2
+    assert bb_calibration.p0_for_false_positive_rate(table, 0.5) == 1e-1
+    assert bb_calibration.p0_for_false_positive_rate({'p0s': [0.1], 'false_positive_rates': [0.2]}, 0.01) is None
+
+    with pytest.raises(ValueError):
+
+        bb_calibration.simulate_null_events(100, settings={'does_not_exist': 1})
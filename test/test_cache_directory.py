@@ -0,0 +1,55 @@
+import os
+
+import numpy as np
+import pytest
+
+from fermi_blind_search import cache_directory
+
+
+class _Reader(object):
+
+    def __init__(self, directory):
+
+        self.data = np.load(os.path.join(directory, "data.npy"))
+
+
+def test_write_and_open(tmpdir):
+
+    directory = str(tmpdir.join("cache"))
+
+    assert cache_directory.read_manifest(directory) is None
+
+    with cache_directory.write_cache_directory(directory, {'version': 1}) as tmp_directory:
+
+        np.save(os.path.join(tmp_directory, "data.npy"), np.arange(3))
+
+    assert cache_directory.read_manifest(directory) == {'version': 1}
+
+    reader = cache_directory.open_cache_directory(directory, _Reader)
+
+    # Opened only once
+    assert cache_directory.open_cache_directory(directory, _Reader) is reader
+
+    with cache_directory.write_cache_directory(directory, {'version': 2}) as tmp_directory:
+
+        np.save(os.path.join(tmp_directory, "data.npy"), np.arange(5))
+
+    # Rewriting the directory forgets the instance opened before
+    assert cache_directory.open_cache_directory(directory, _Reader).data.shape[0] == 5
+    assert cache_directory.read_manifest(directory) == {'version': 2}
+
+
+def test_interrupted_write(tmpdir):
+
+    directory = str(tmpdir.join("cache"))
+
+    with pytest.raises(RuntimeError):
+
+        with cache_directory.write_cache_directory(directory, {'version': 1}) as tmp_directory:
+
+            np.save(os.path.join(tmp_directory, "data.npy"), np.arange(3))
+
+            raise RuntimeError("interrupted")
+
+    # Nothing is left behind
+    assert os.listdir(str(tmpdir)) == []
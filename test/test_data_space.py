@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+from fermi_blind_search.angular_distance import angular_distance_fast
+from fermi_blind_search.bkge import data_space
+from fermi_blind_search.fits_handling import ft2_cache
+
+
+def test_get_roi():
+
+    header = {'DSTYP1': 'POS(RA,DEC)', 'DSVAL1': 'circle(10.5,-20.25,12)', 'DSVAL2': '100:100000'}
+
+    assert data_space.get_roi(header) == [10.5, -20.25, 12.0]
+
+
+@pytest.mark.parametrize('ft2_columns', [{'n': 5000, 'slew': 2.0, 'period': 90.0, 'short_every': 100,
+                                          'saa': False}], indirect=True)
+def test_data_space(ft2_cache_dir):
+
+    ft2 = ft2_cache.open_ft2_cache(ft2_cache_dir)
+
+    tstart, tstop = 5000.0, 140000.0
+
+    # Small chunks, not aligned with the selected entries
+    space = data_space.DataSpace(10.0, 20.0, tstart, tstop, ft2, chunk_size=333)
+
+    selected = (ft2['START'] >= tstart) & (ft2['STOP'] < tstop)
+
+    assert np.array_equal(space.start, ft2['START'][selected])
+    assert np.allclose(space.theta, angular_distance_fast(ft2['RA_SCZ'][selected], ft2['DEC_SCZ'][selected],
+                                                          10.0, 20.0))
+
+    # Events in any order, added in chunks
+    times = np.random.RandomState(0).uniform(tstart, tstop, 20000)
+
+    n_outside = sum([space.add_events(chunk) for chunk in np.array_split(times, 7)])
+
+    # Brute force
+    expected = np.array([np.sum((times >= t1) & (times <= t2)) for t1, t2 in zip(space.start, space.stop)])
+
+    assert np.array_equal(space.counts, expected)
+    assert n_outside == times.shape[0] - expected.sum()
+    assert n_outside > 0
+
+    # Histogram in theta
+    theta_bins = np.rad2deg(np.arccos(np.linspace(np.cos(np.deg2rad(75)), 1, 41)[::-1]))
+
+    counts, livetime = data_space.theta_histogram(space.theta, space.counts, space.livetime, theta_bins)
+
+    for i, (th1, th2) in enumerate(zip(theta_bins[:-1], theta_bins[1:])):
+
+        idx = (space.theta >= th1) & (space.theta < th2)
+
+        assert counts[i] == np.sum(space.counts[idx])
+        assert np.isclose(livetime[i], np.sum(space.livetime[idx]))
@@ -0,0 +1,63 @@
+import numpy as np
+
+from fermi_blind_search.angular_distance import angular_distance_fast
+from fermi_blind_search.fits_handling import ft1_partition
+
+
+def test_partition(tmpdir):
+
+    rng = np.random.RandomState(0)
+
+    # A coarse grid, with ROIs overlapping each other and across R.A. = 0
+    ras = np.array([0.5, 10.0, 15.0, 200.0, 359.0])
+    decs = np.array([0.0, 0.0, 5.0, -60.0, 1.0])
+    rad = 8.0
+
+    n = 50000
+
+    event_ras = rng.uniform(0, 360, n)
+    event_decs = np.rad2deg(np.arcsin(rng.uniform(-1, 1, n)))
+
+    # Some events do not pass the cuts, so they are not in the chunks
+    selected = rng.uniform(0, 1, n) < 0.8
+
+    chunks = []
+
+    for idx in np.array_split(np.arange(n), 7):
+
+        idx = idx[selected[idx]]
+
+        chunks.append((idx, event_ras[idx], event_decs[idx]))
+
+    rows, offsets = ft1_partition.partition_events(ras, decs, rad, chunks)
+
+    directory = ft1_partition.write_ft1_partition(ras, decs, rows, offsets, str(tmpdir.join("partition")),
+                                                  {'ft1': 'test'})
+
+    partition = ft1_partition.open_ft1_partition(directory)
+
+    assert len(partition) == ras.shape[0]
+    assert partition.get_source() == {'ft1': 'test'}
+
+    for ra, dec in zip(ras, decs):
+
+        # Same as the cone filter of FitsFile
+        expected = np.flatnonzero(selected & (angular_distance_fast(ra, dec, event_ras, event_decs) <= rad))
+
+        assert expected.shape[0] > 0
+        assert np.array_equal(partition.get_rows(ra, dec), expected)
+
+    # A ROI not in the partition
+    assert partition.get_rows(100.0, 20.0) is None
+
+
+def test_in_gtis():
+
+    gti_starts = np.array([10.0, 30.0, 50.0])
+    gti_stops = np.array([20.0, 40.0, 55.0])
+
+    times = np.array([0.0, 10.0, 15.0, 20.0, 25.0, 30.0, 45.0, 55.0, 60.0])
+
+    expected = [np.any((t >= gti_starts) & (t <= gti_stops)) for t in times]
+
+    assert np.array_equal(ft1_partition.in_gtis(times, gti_starts, gti_stops), expected)
@@ -0,0 +1,139 @@
+import numpy as np
+import pytest
+
+from fermi_blind_search.angular_distance import angular_distance_fast
+from fermi_blind_search.fits_handling import ft2_cache
+
+
+# Random bad entries, in the order and with the byte order of a FITS file
+_FT2 = {'bad_fraction': 0.05, 'fits_like': True}
+
+
+@pytest.mark.parametrize('ft2_columns', [_FT2], indirect=True)
+def test_cache_is_sorted_and_memory_mapped(ft2_columns, tmpdir):
+
+    columns = ft2_columns
+
+    directory = ft2_cache.write_ft2_cache(columns, str(tmpdir.join("cache")))
+
+    cache = ft2_cache.open_ft2_cache(directory)
+
+    # Opened only once per process
+    assert ft2_cache.open_ft2_cache(directory) is cache
+
+    assert len(cache) == columns['START'].shape[0]
+    assert isinstance(cache['START'], np.memmap)
+    assert np.all(np.diff(cache['START']) > 0)
+
+    idx = np.argsort(columns['START'])
+
+    for name in ft2_cache.COLUMNS:
+
+        assert np.array_equal(cache[name], columns[name][idx])
+
+    # Entries overlapping 5000 - 6000
+    rows = cache.get_slice(5000.0, 6000.0)
+
+    expected = (cache['STOP'] >= 5000.0) & (cache['START'] < 6000.0)
+
+    assert np.array_equal(np.arange(len(cache))[rows], np.where(expected)[0])
+
+
+@pytest.mark.parametrize('ft2_columns', [_FT2], indirect=True)
+def test_gtis(ft2_cache_dir):
+
+    cache = ft2_cache.open_ft2_cache(ft2_cache_dir)
+
+    ra, dec, zmax, thetamax, rad = 100.0, 20.0, 95.0, 60.0, 10.0
+
+    gti_starts, gti_stops = cache.get_gtis(ra, dec, zmax, thetamax, rad, 2000.0, 40000.0)
+
+    # Brute force selection
+    keep = ((cache['DATA_QUAL'] > 0) & (cache['LAT_CONFIG'] == 1) & ~cache['IN_SAA'] & (cache['LIVETIME'] > 0) &
+            (angular_distance_fast(cache['RA_ZENITH'], cache['DEC_ZENITH'], ra, dec) <= zmax - rad) &
+            (angular_distance_fast(cache['RA_SCZ'], cache['DEC_SCZ'], ra, dec) <= thetamax - rad) &
+            (cache['STOP'] >= 2000.0) & (cache['START'] <= 40000.0))
+
+    assert len(gti_starts) > 1
+    assert gti_starts[0] >= 2000.0
+    assert gti_stops[-1] <= 40000.0
+
+    # Each selected entry is within one GTI and, since the total length is the same, the GTIs contain
+    # nothing else
+    t1 = np.maximum(cache['START'][keep], 2000.0)
+    t2 = np.minimum(cache['STOP'][keep], 40000.0)
+
+    i = np.searchsorted(gti_starts, t1, side='right') - 1
+
+    assert np.all(t2 <= np.array(gti_stops)[i])
+
+    assert np.isclose(np.sum(np.array(gti_stops) - np.array(gti_starts)), np.sum(t2 - t1))
+
+
+@pytest.mark.parametrize('ft2_columns', [_FT2], indirect=True)
+def test_existing_cache_is_reused(ft2_columns, tmpdir):
+
+    # A fake FT2 file: the cache for it must be reused without reading it
+    ft2 = tmpdir.join("ft2.fits")
+    ft2.write("not a FITS file")
+
+    directory = str(tmpdir.join("cache"))
+
+    ft2_cache.write_ft2_cache(ft2_columns, directory, ft2_cache._describe_source(str(ft2)))
+
+    assert ft2_cache.make_ft2_cache(str(ft2), directory) == directory
+
+
+@pytest.mark.parametrize('ft2_columns', [_FT2], indirect=True)
+def test_all_gtis(ft2_cache_dir):
+
+    cache = ft2_cache.open_ft2_cache(ft2_cache_dir)
+
+    rng = np.random.RandomState(1)
+
+    ras = rng.uniform(0, 360, 50)
+    decs = np.rad2deg(np.arcsin(rng.uniform(-1, 1, 50)))
+
+    # Small masks, so that the ROIs are done in several blocks
+    gtis = cache.get_all_gtis(ras, decs, 95.0, 60.0, 10.0, 2000.0, 40000.0, mask_size=5000)
+
+    assert len(gtis) == ras.shape[0]
+
+    for (gti_starts, gti_stops), ra, dec in zip(gtis, ras, decs):
+
+        # Same as merging the entries selected for this ROI
+        keep = ((cache['DATA_QUAL'] > 0) & (cache['LAT_CONFIG'] == 1) & ~cache['IN_SAA'] &
+                (cache['LIVETIME'] > 0) &
+                (angular_distance_fast(cache['RA_ZENITH'], cache['DEC_ZENITH'], ra, dec) <= 85.0) &
+                (angular_distance_fast(cache['RA_SCZ'], cache['DEC_SCZ'], ra, dec) <= 50.0) &
+                (cache['STOP'] >= 2000.0) & (cache['START'] <= 40000.0))
+
+        expected_starts, expected_stops = ft2_cache.merge_intervals(cache['START'][keep], cache['STOP'][keep],
+                                                                    2000.0, 40000.0)
+
+        assert np.array_equal(gti_starts, expected_starts)
+        assert np.array_equal(gti_stops, expected_stops)
+
+
+def test_merge_intervals():
+
+    start = np.array([0.0, 10.0, 20.0, 40.0, 50.0, 70.0])
+    stop = np.array([10.0, 20.0, 30.0, 50.0, 60.0, 80.0])
+
+    # In any order
+    idx = np.array([3, 0, 5, 2, 1, 4])
+
+    gti_starts, gti_stops = ft2_cache.merge_intervals(start[idx], stop[idx], 5.0, 75.0)
+
+    assert np.array_equal(gti_starts, [5.0, 40.0, 70.0])
+    assert np.array_equal(gti_stops, [30.0, 60.0, 75.0])
+
+    # A mask for each column
+    mask = np.array([[True, False], [True, True], [False, True], [True, False], [True, False], [False, False]])
+
+    gtis = ft2_cache.mask_to_gtis(start, stop, mask)
+
+    assert np.array_equal(gtis[0][0], [0.0, 40.0]) and np.array_equal(gtis[0][1], [20.0, 60.0])
+    assert np.array_equal(gtis[1][0], [10.0]) and np.array_equal(gtis[1][1], [30.0])
+
+    assert ft2_cache.mask_to_gtis(start, stop, np.zeros(6, dtype=bool)) == ([], [])
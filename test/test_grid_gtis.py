@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+from fermi_blind_search.fits_handling import ft2_cache
+from fermi_blind_search.fits_handling import grid_gtis
+
+
+@pytest.mark.parametrize('ft2_columns', [{'short_every': 150}], indirect=True)
+def test_grid_gtis(ft2_cache_dir, tmpdir):
+
+    cache = ft2_cache.open_ft2_cache(ft2_cache_dir)
+
+    rng = np.random.RandomState(2)
+
+    ras = rng.uniform(0, 360, 20)
+    decs = np.rad2deg(np.arcsin(rng.uniform(-1, 1, 20)))
+
+    directory = grid_gtis.make_grid_gtis(ft2_cache_dir, ras, decs, 95.0, 60.0, 10.0, 2000.0, 50000.0,
+                                         str(tmpdir.join("grid_gtis")))
+
+    gtis = grid_gtis.open_grid_gtis(directory)
+
+    assert len(gtis) == ras.shape[0]
+
+    for ra, dec in zip(ras, decs):
+
+        # Whole interval and a part of it, the same as selecting the entries for this ROI only
+        for tstart, tstop in [(2000.0, 50000.0), (10015.0, 20000.0)]:
+
+            gti_starts, gti_stops = gtis.get_gtis(ra, dec, tstart, tstop)
+
+            expected_starts, expected_stops = cache.get_gtis(ra, dec, 95.0, 60.0, 10.0, tstart, tstop)
+
+            assert np.array_equal(gti_starts, expected_starts)
+            assert np.array_equal(gti_stops, expected_stops)
+
+    # A ROI not in the grid
+    assert gtis.get_gtis(ras[0] + 1.0, decs[0]) is None
+
+    # The same GTIs are reused
+    assert grid_gtis.make_grid_gtis(ft2_cache_dir, ras, decs, 95.0, 60.0, 10.0, 2000.0, 50000.0,
+                                    directory) == directory
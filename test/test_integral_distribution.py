@@ -0,0 +1,111 @@
+import numpy as np
+
+from fermi_blind_search.bkge.integral_distribution import GTIGrid, IntegralDistribution, make_adaptive_grid
+
+
+def test_grid():
+
+    gti_starts = np.array([0.0, 100.0, 250.5, 400.0])
+    gti_stops = np.array([50.0, 200.0, 250.6, 403.3])
+
+    grid = GTIGrid(gti_starts, gti_stops, binsize=1.0, padding=0.2)
+
+    assert len(grid) == np.sum(grid.n_points)
+
+    for i, (t1, t2) in enumerate(zip(gti_starts, gti_stops)):
+
+        times = grid.times[grid.gti == i]
+
+        # Same as the grid of each GTI computed separately
+        expected = np.linspace(t1, max(t2 - 0.2, t1), max(2, int(np.ceil((max(t2 - 0.2, t1) - t1) / 1.0))))
+
+        assert np.allclose(times, expected)
+
+
+def test_integral():
+
+    gti_starts = np.array([0.0, 100.0, 300.0])
+    gti_stops = np.array([50.0, 200.0, 310.0])
+
+    grid = GTIGrid(gti_starts, gti_stops, binsize=1.0, padding=0.2)
+
+    # A constant rate gives the total duration of the GTIs
+    knots, integral = grid.integrate(np.ones(len(grid)) * 2.0)
+
+    assert np.isclose(np.sum(2.0 * grid.widths), integral[-1])
+
+    assert np.all(np.diff(knots) >= 0)
+    assert np.isclose(integral[-1], 2.0 * 160.0)
+
+    integral_distribution = IntegralDistribution(knots, integral)
+
+    # Zero before, constant after and between the GTIs
+    assert integral_distribution(-10.0) == 0.0
+    assert np.isclose(integral_distribution(1000.0), 320.0)
+    assert np.isclose(integral_distribution(75.0), 100.0)
+    assert np.isclose(integral_distribution(250.0), 300.0)
+
+    # A linear rate is integrated exactly (it is constant in the padding at the end of the GTIs)
+    knots, integral = grid.integrate(grid.times)
+
+    integral_distribution = IntegralDistribution(knots, integral)
+
+    t = np.array([30.0, 49.8, 150.0, 305.0])
+
+    expected = np.array([30.0 ** 2 / 2,
+                         49.8 ** 2 / 2,
+                         49.8 ** 2 / 2 + 49.8 * 0.2 + (150.0 ** 2 - 100.0 ** 2) / 2,
+                         49.8 ** 2 / 2 + 49.8 * 0.2 + (199.8 ** 2 - 100.0 ** 2) / 2 + 199.8 * 0.2 +
+                         (305.0 ** 2 - 300.0 ** 2) / 2])
+
+    # (up to the linear interpolation of the integral between the knots)
+    assert np.allclose(integral_distribution(t), expected, rtol=0, atol=0.2)
+
+
+def test_adaptive_grid():
+
+    # A day of spacecraft data, with the rocking of the pointing
+    ft2_times = np.arange(0, 86400.0 + 30, 30.0)
+
+    theta = 30 + 25 * np.sin(2 * np.pi * ft2_times / 5700.0) + 5 * np.sin(2 * np.pi * ft2_times / 12000.0)
+    livetime_fraction = 0.9 + 0.05 * np.sin(ft2_times / 1000.0)
+
+    def rate_interpolator(x):
+
+        return 0.1 + np.cos(np.deg2rad(x)) ** 3
+
+    def rate_function(t):
+
+        return rate_interpolator(np.interp(t, ft2_times, theta)) * np.interp(t, ft2_times, livetime_fraction)
+
+    gti_starts = np.arange(100.0, 86000.0, 5700.0)
+    gti_stops = gti_starts + 4000.3
+
+    # Reference integral, with a very fine grid
+    fine = GTIGrid(gti_starts, gti_stops, binsize=0.02)
+
+    fine_knots, fine_integral = fine.integrate(rate_function(fine.times))
+
+    every_second = GTIGrid(gti_starts, gti_stops, binsize=1.0)
+
+    for max_relative_error in [1e-2, 1e-4, 1e-6]:
+
+        grid, rate = make_adaptive_grid(gti_starts, gti_stops, ft2_times, theta, livetime_fraction,
+                                        rate_interpolator, rate_function, max_relative_error)
+
+        assert np.allclose(rate, rate_function(grid.times))
+        assert np.all(np.diff(grid.times) >= 0)
+
+        knots, integral = grid.integrate(rate)
+
+        assert abs(integral[-1] - fine_integral[-1]) <= max_relative_error * fine_integral[-1]
+
+        # Also at any time
+        assert np.max(np.abs(np.interp(fine.times, knots, integral) -
+                             np.interp(fine.times, fine_knots, fine_integral))) <= max_relative_error * integral[-1]
+
+    # Far fewer points than with one point every second
+    grid, _ = make_adaptive_grid(gti_starts, gti_stops, ft2_times, theta, livetime_fraction, rate_interpolator,
+                                 rate_function, 1e-3)
+
+    assert len(grid) * 10 < len(every_second)
@@ -0,0 +1,118 @@
+import numpy as np
+import pytest
+import scipy.interpolate
+
+from fermi_blind_search.bkge import lookup_tables
+
+
+def test_archive_gives_same_splines(tmpdir):
+
+    filename = lookup_tables.make_lookup_table_archive(str(tmpdir.join("archive.npz")))
+
+    archive = lookup_tables.LookupTableArchive(filename)
+
+    assert len(archive) == len(lookup_tables.get_lookup_table_archive())
+
+    theta = np.linspace(0, 80, 200)
+
+    for index in [0, 100, len(archive) - 1]:
+
+        ra, dec = archive.ra[index], archive.dec[index]
+
+        # Fit the spline to the lookup table file, as done before the archive
+        sim_theta, sim_rate, sim_weights, k, s = lookup_tables.read_theta_lookup_table(
+            lookup_tables.find_theta_lookup_file(ra, dec))
+
+        spline = scipy.interpolate.UnivariateSpline(sim_theta, sim_rate, w=sim_weights, k=k, s=s)
+
+        assert archive.get_index(ra, dec) == index
+
+        assert np.array_equal(archive.get_table(index)[0], sim_theta)
+        assert np.array_equal(archive.get_table(index)[1], sim_rate)
+
+        rate_interpolator = archive.get_rate_interpolator(index)
+
+        assert np.array_equal(rate_interpolator(theta), spline(theta))
+        assert np.array_equal(rate_interpolator.get_coeffs(), spline.get_coeffs())
+        assert np.array_equal(rate_interpolator.get_knots(), spline.get_knots())
+
+        # The packaged archive is used by default
+        assert np.array_equal(lookup_tables.get_rate_interpolator(ra, dec)(theta), spline(theta))
+
+
+
+def test_lookup_table_index():
+
+    archive = lookup_tables.get_lookup_table_archive()
+
+    # Positions slightly off the centers of the tables are matched to the closest one
+    rng = np.random.RandomState(0)
+
+    indexes = rng.randint(0, len(archive), 100)
+
+    ras = archive.ra[indexes] + rng.uniform(-0.003, 0.003, 100)
+    decs = archive.dec[indexes] + rng.uniform(-0.003, 0.003, 100)
+
+    assert np.array_equal(archive.get_index(ras, decs), indexes)
+
+    assert archive.get_index(ras[0], decs[0]) == indexes[0]
+
+    # ...but not if they are farther than the tolerance
+    with pytest.raises(RuntimeError):
+
+        archive.get_index(archive.ra[0], archive.dec[0] + 0.5)
+
+    assert archive.get_index(archive.ra[0], archive.dec[0] + 0.5, tolerance=1.0) == 0
+
+
+def test_blended_rate_interpolator():
+
+    archive = lookup_tables.get_lookup_table_archive()
+
+    theta = np.linspace(0, 80, 200)
+
+    # At the center of a table, its own spline
+    rate_interpolator = archive.get_blended_rate_interpolator(archive.ra[10], archive.dec[10])
+
+    assert np.array_equal(rate_interpolator(theta), archive.get_rate_interpolator(10)(theta))
+
+    # Between tables, a weighted average of the closest ones
+    ra, dec = archive.ra[10], archive.dec[10] + 1.0
+
+    indexes, distances = archive._index.query_nearest(ra, dec, 4)
+
+    assert indexes[0] == 10
+    assert np.all(np.diff(distances) >= 0)
+
+    rate_interpolator = archive.get_blended_rate_interpolator(ra, dec, 4)
+
+    rates = np.array([archive.get_rate_interpolator(index)(theta) for index in indexes])
+
+    assert np.all(rate_interpolator(theta) >= rates.min(axis=0) - 1e-12)
+    assert np.all(rate_interpolator(theta) <= rates.max(axis=0) + 1e-12)
+
+    weights = 1.0 / distances ** 2
+
+    assert np.allclose(rate_interpolator(theta), np.dot(weights, rates) / weights.sum())
+
+    assert not np.any(np.isnan(rate_interpolator.get_coeffs()))
+
+    # Cached by position
+    assert archive.get_blended_rate_interpolator(ra, dec, 4) is rate_interpolator
+
+
+def test_blended_cache_eviction():
+
+    archive = lookup_tables.LookupTableArchive(lookup_tables.get_data_file_path(lookup_tables.ARCHIVE_NAME),
+                                               blended_cache_size=2)
+
+    first = archive.get_blended_rate_interpolator(10.0, 10.0)
+    second = archive.get_blended_rate_interpolator(20.0, 10.0)
+
+    # Using the first makes the second the least recently used
+    assert archive.get_blended_rate_interpolator(10.0, 10.0) is first
+
+    archive.get_blended_rate_interpolator(30.0, 10.0)
+
+    assert archive.get_blended_rate_interpolator(10.0, 10.0) is first
+    assert archive.get_blended_rate_interpolator(20.0, 10.0) is not second
@@ -0,0 +1,130 @@
+import json
+import os
+
+import numpy as np
+import pytest
+import scipy.interpolate
+
+from fermi_blind_search.bkge import lookup_tables
+from fermi_blind_search.bkge import make_lookup_tables
+from fermi_blind_search.bkge.reference_rois import get_root
+
+_RAS = [10.0, 100.0, 200.0]
+_DECS = [-30.0, 0.0, 45.0]
+
+
+def _write_data_space(directory, ra, dec, seed):
+
+    rng = np.random.RandomState(seed)
+
+    theta = rng.uniform(0, 90, 20000)
+    livetime = np.full(theta.shape[0], 25.0)
+    counts = rng.poisson(np.clip(1.0 - theta / 70.0, 0, None) * 3.0)
+
+    filename = os.path.join(directory, "%s_lookup.npz" % get_root(ra, dec))
+
+    np.savez(filename, theta=theta, counts=counts, livetime=livetime, ra=ra, dec=dec, rad=12.0)
+
+    return filename
+
+
+def test_make_lookup_tables(tmpdir):
+
+    directory = str(tmpdir.mkdir("reference_rois"))
+    workdir = str(tmpdir.join("work"))
+    outfile = str(tmpdir.join("archive.npz"))
+
+    for i, (ra, dec) in enumerate(zip(_RAS, _DECS)):
+
+        _write_data_space(directory, ra, dec, i)
+
+    # A broken data space
+    broken = os.path.join(directory, "%s_lookup.npz" % get_root(_RAS[1], _DECS[1]))
+
+    with open(broken, "w") as f:
+
+        f.write("not a data space")
+
+    sources = make_lookup_tables.find_sources(directory)
+
+    assert sorted(sources.keys()) == sorted([get_root(ra, dec) for ra, dec in zip(_RAS, _DECS)])
+
+    with pytest.raises(RuntimeError):
+
+        make_lookup_tables.make_lookup_tables(sources, workdir, outfile, ncpus=2)
+
+    with open(os.path.join(workdir, "manifest.json")) as f:
+
+        manifest = json.load(f)
+
+    assert sorted(manifest['completed']) == sorted([get_root(_RAS[i], _DECS[i]) for i in [0, 2]])
+    assert list(manifest['failed'].keys()) == [get_root(_RAS[1], _DECS[1])]
+    assert not os.path.exists(outfile)
+
+    # Resume after fixing the broken data space: only that ROI is made again
+    _write_data_space(directory, _RAS[1], _DECS[1], 1)
+
+    table_file = os.path.join(workdir, "tables", "%s.npz" % get_root(_RAS[0], _DECS[0]))
+
+    os.utime(table_file, (0, 0))
+
+    assert make_lookup_tables.make_lookup_tables(sources, workdir, outfile, ncpus=2) == outfile
+
+    assert os.path.getmtime(table_file) == 0
+
+    with open(os.path.join(workdir, "manifest.json")) as f:
+
+        manifest = json.load(f)
+
+    assert manifest['failed'] == {}
+    assert manifest['settings']['ft2'] is None
+    assert manifest['sources'][get_root(_RAS[1], _DECS[1])]['file'] == sources[get_root(_RAS[1], _DECS[1])]
+
+    # A data space regenerated after its table was made: only that ROI is made again
+    other_table_file = os.path.join(workdir, "tables", "%s.npz" % get_root(_RAS[2], _DECS[2]))
+
+    os.utime(other_table_file, (0, 0))
+
+    _write_data_space(directory, _RAS[0], _DECS[0], 10)
+
+    make_lookup_tables.make_lookup_tables(sources, workdir, outfile)
+
+    assert os.path.getmtime(table_file) > 0
+    assert os.path.getmtime(other_table_file) == 0
+
+    archive = lookup_tables.LookupTableArchive(outfile)
+
+    assert len(archive) == len(_RAS)
+
+    theta = np.linspace(0, 80, 100)
+
+    for i, (ra, dec) in enumerate(zip(_RAS, _DECS)):
+
+        index = archive.get_index(ra, dec)
+
+        # Same table as makeThetaHistogram
+        data = np.load(sources[get_root(ra, dec)])
+
+        theta_bins, rate, rate_error = make_lookup_tables.rate_histogram(data['theta'], data['counts'],
+                                                                         data['livetime'], 40)
+
+        center = (theta_bins[:-1] + theta_bins[1:]) / 2
+
+        xi = np.concatenate([[0.0], center, [80.0]])
+        yi = np.concatenate([[rate[0]], rate, [0.0]])
+        wi = np.concatenate([[rate_error[0]], rate_error, [rate_error[0]]])
+
+        assert np.array_equal(archive.get_table(index)[0], xi)
+        assert np.array_equal(archive.get_table(index)[1], yi)
+
+        spline = scipy.interpolate.UnivariateSpline(xi, yi, w=1.0 / wi, k=2, s=40 / 1.5)
+
+        assert np.allclose(archive.get_rate_interpolator(index)(theta), spline(theta))
+
+    # With different settings, everything is made again
+    os.utime(table_file, (0, 0))
+
+    make_lookup_tables.make_lookup_tables(sources, workdir, outfile, settings={'n_theta': 20})
+
+    assert os.path.getmtime(table_file) > 0
+    assert lookup_tables.LookupTableArchive(outfile).get_table(0)[0].shape[0] == 22
@@ -0,0 +1,110 @@
+import os
+import time
+
+import numpy as np
+
+from fermi_blind_search.bkge.integral_distribution import GTIGrid, join_gtis
+from fermi_blind_search.bkge.npred_cache import NpredCache, get_digest, make_key
+
+
+def _rate(t):
+
+    return 2.0 + np.sin(t / 100.0)
+
+
+def test_join_gtis():
+
+    grid = GTIGrid([0.0, 100.0, 300.0], [50.0, 200.0, 310.0])
+
+    knots, integral = grid.integrate(_rate(grid.times))
+
+    joined_knots, joined_integral = join_gtis(grid.integrate_gtis(_rate(grid.times)))
+
+    assert np.array_equal(joined_knots, knots)
+    assert np.allclose(joined_integral, integral)
+
+
+def test_partial_recompute(tmpdir):
+
+    cache = NpredCache(str(tmpdir.join("cache")))
+
+    key = make_key({'ra': 10.0, 'dec': 20.0})
+
+    # First window: the last GTI is cut at the end of the window
+    starts = np.array([0.0, 100.0, 300.0])
+    stops = np.array([50.0, 200.0, 350.0])
+    digests = [get_digest([t]) for t in starts]
+
+    assert cache.get(key, starts, stops, digests) == [None] * 3
+
+    grid = GTIGrid(starts, stops)
+
+    cache.put(key, starts, stops, digests, grid.integrate_gtis(_rate(grid.times)))
+
+    # Second window: the GTI at 300 is now complete and there is a new one
+    starts = np.array([100.0, 300.0, 500.0])
+    stops = np.array([200.0, 400.0, 600.0])
+    digests = [get_digest([t]) for t in starts]
+
+    segments = cache.get(key, starts, stops, digests)
+
+    assert segments[0] is not None
+    assert segments[1] is None and segments[2] is None
+
+    grid = GTIGrid(starts[1:], stops[1:])
+
+    segments[1:] = grid.integrate_gtis(_rate(grid.times))
+
+    cache.put(key, starts[1:], stops[1:], digests[1:], segments[1:])
+
+    # Same result as computing everything again
+    grid = GTIGrid(starts, stops)
+
+    knots, integral = grid.integrate(_rate(grid.times))
+
+    joined_knots, joined_integral = join_gtis(segments)
+
+    assert np.array_equal(joined_knots, knots)
+    assert np.allclose(joined_integral, integral)
+
+    # The GTI cut at the end of the first window was replaced
+    assert cache.get(key, [300.0], [350.0], [get_digest([300.0])]) == [None]
+    assert cache.get(key, [300.0], [400.0], [get_digest([300.0])])[0] is not None
+
+    # A different digest (for example, reprocessed spacecraft data) is not used
+    assert cache.get(key, [100.0], [200.0], ['other']) == [None]
+
+
+def test_eviction(tmpdir):
+
+    directory = str(tmpdir.join("cache"))
+
+    cache = NpredCache(directory)
+
+    grid = GTIGrid([0.0], [1000.0])
+
+    segments = grid.integrate_gtis(_rate(grid.times))
+
+    keys = [make_key({'ra': float(i), 'dec': 0.0}) for i in range(3)]
+
+    for i, key in enumerate(keys):
+
+        cache.put(key, [0.0], [1000.0], ['x'], segments)
+
+        # Oldest first
+        os.utime(os.path.join(directory, "%s.npz" % key), (time.time() - 100 + i, time.time() - 100 + i))
+
+    # Using the first key makes it the most recently used
+    assert cache.get(keys[0], [0.0], [1000.0], ['x'])[0] is not None
+
+    size = cache.get_size()
+
+    cache.max_size = size * 2 // 3 + 1
+
+    cache.evict()
+
+    assert cache.get_size() <= cache.max_size
+
+    assert not os.path.exists(os.path.join(directory, "%s.npz" % keys[1]))
+    assert os.path.exists(os.path.join(directory, "%s.npz" % keys[0]))
+    assert os.path.exists(os.path.join(directory, "%s.npz" % keys[2]))
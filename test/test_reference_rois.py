@@ -0,0 +1,51 @@
+import numpy as np
+
+from fermi_blind_search.angular_distance import angular_distance_fast
+from fermi_blind_search.bkge import reference_rois
+
+# Centers of the ROIs (two of them across R.A. = 0, so that they overlap)
+_RAS = np.array([0.039, 0.256, 1.207, 359.5])
+_DECS = np.array([29.138, -23.391, 41.507, 30.0])
+
+
+def test_select_events():
+
+    events = {'ENERGY': np.array([50.0, 150.0, 150.0, 150.0, 200000.0]),
+              'EVENT_CLASS': np.array([128, 128, 64, 128 + 64, 128]),
+              'EVENT_TYPE': np.array([1, 2, 1, 1, 1])}
+
+    expected = [False, True, False, True, False]
+
+    assert np.array_equal(reference_rois.select_events(events, 100, 100000, 128, 3), expected)
+
+    # Same with the bit columns read as arrays of booleans
+    events['EVENT_CLASS'] = ((events['EVENT_CLASS'][:, np.newaxis] >> np.arange(31, -1, -1)) & 1).astype(bool)
+
+    assert np.array_equal(reference_rois.select_events(events, 100, 100000, 128, 3), expected)
+
+
+def test_reference_events(tmpdir):
+
+    reference_events = reference_rois.ReferenceEvents(_RAS, _DECS, 12.0, str(tmpdir.join("reference_rois")))
+
+    rng = np.random.RandomState(0)
+
+    n = 20000
+
+    times = np.sort(rng.uniform(0, 1e6, n))
+    ras = rng.uniform(0, 360, n)
+    decs = np.rad2deg(np.arcsin(rng.uniform(-1, 1, n)))
+
+    # In chunks, as they are read from the FT1 file
+    for idx in np.array_split(np.arange(n), 5):
+
+        reference_events.add_events(times[idx], ras[idx], decs[idx])
+
+    for i, (ra, dec) in enumerate(zip(_RAS, _DECS)):
+
+        expected = times[angular_distance_fast(ras, decs, ra, dec) <= 12.0]
+
+        assert expected.shape[0] > 0
+        assert np.array_equal(reference_events.get_times(i), expected)
+
+    assert reference_events.get_times_file(0).endswith("ra0.039-dec29.138_ref_times.bin")